@@ -1,19 +1,62 @@
-from multiprocessing.pool import ThreadPool as Pool
+from multiprocessing import Pool
 from functions.network_generation import (
     focussed_assort_network_gen,
     barabasi_albert,
     erdos,
     write_graph,
 )
+from functions.metrics import pearson
 
 from pathlib import Path
 
+import numpy as np
+import random
 import json
 import sys
 import os
 
 
-def main(conf_file, n_networks, output_folder):
+def task_seed(root_entropy, a_idx, n_idx):
+    """Derive the seed of a single (a, network index) generation task.
+
+    The seed only depends on the root entropy and the position of the task in
+    the sweep, so a task regenerates the exact same network regardless of the
+    number of workers or the order in which the pool schedules it.
+    """
+    seed_seq = np.random.SeedSequence(root_entropy, spawn_key=(a_idx, n_idx))
+    return int(seed_seq.generate_state(1)[0])
+
+
+def make_network(task):
+    conf, conf_path, a, n_idx, seed = task
+
+    # Both the networkx generators (stdlib random) and the rewiring (numpy)
+    # draw from the global generators, seed them for this task only.
+    random.seed(seed)
+    np.random.seed(seed)
+
+    G, _ = focussed_assort_network_gen(
+        a,
+        conf["e_samples"],
+        conf["n_per_group"],
+        conf["p_rel"],
+        network_gen_fn=globals().get(conf["network_gen_fn"]),
+        # With target "modularity" the a_s of the config are aimed modularities
+        target=conf.get("target", "assortativity"),
+    )
+    file = f"{n_idx}.gml"
+    write_graph(G, os.path.join(conf_path, str(a)), predefined_name=file)
+    return {
+        "a": a,
+        "index": n_idx,
+        "file": os.path.join(str(a), file),
+        "seed": seed,
+        "assortativity": pearson(G),
+        "modularity": G.graph["modularity"],
+    }
+
+
+def main(conf_file, n_networks, output_folder, root_entropy=None, processes=None):
     # Get network configuration info
     with open(conf_file, "r") as f:
         conf = json.load(f)
@@ -21,30 +64,82 @@ def main(conf_file, n_networks, output_folder):
     if not os.path.exists(conf_path):
         os.makedirs(conf_path)
 
-    def make_networks(a):
-        for _ in range(n_networks):
-            G, _ = focussed_assort_network_gen(
-                a,
-                conf["e_samples"],
-                conf["n_per_group"],
-                conf["p_rel"],
-                network_gen_fn=globals().get(conf["network_gen_fn"]),
-            )
-            write_graph(G, os.path.join(conf_path, str(a)))
-        return f"Wrote files for assort {a}."
+    # Networks of an earlier run with the same root entropy are reused, without
+    # a root entropy an interrupted run is continued
+    manifest_path = os.path.join(conf_path, "manifest.json")
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    if root_entropy is None:
+        root_entropy = (
+            manifest["root_entropy"]
+            if manifest is not None
+            else np.random.SeedSequence().entropy
+        )
+
+    # Networks are written as <a>/<index>.gml, so networks of another root
+    # entropy would be overwritten
+    existing = [
+        os.path.join(str(a), f)
+        for a in conf["a_s"]
+        if os.path.isdir(os.path.join(conf_path, str(a)))
+        for f in os.listdir(os.path.join(conf_path, str(a)))
+        if f.endswith(".gml")
+    ]
+    if existing and (manifest is None or manifest["root_entropy"] != root_entropy):
+        raise ValueError(
+            f"{conf_path} already holds {len(existing)} networks of another root seed, use another output folder or the seed of the manifest."
+        )
+    done = {}
+    if manifest is not None and manifest["root_entropy"] == root_entropy:
+        done = {(n["a"], n["index"]): n for n in manifest["networks"]}
 
-    pool = Pool(len(conf["a_s"]))
-    for result in pool.imap_unordered(make_networks, conf["a_s"]):
-        print(result)
+    tasks = []
+    for a_idx, a in enumerate(conf["a_s"]):
+        for n_idx in range(n_networks):
+            seed = task_seed(root_entropy, a_idx, n_idx)
+            entry = done.get((a, n_idx))
+            if (
+                entry is not None
+                and entry["seed"] == seed
+                and os.path.exists(os.path.join(conf_path, entry["file"]))
+            ):
+                continue
+            tasks.append((conf, conf_path, a, n_idx, seed))
+
+    def write_manifest():
+        manifest = {
+            "root_entropy": root_entropy,
+            "config": conf,
+            "networks": sorted(done.values(), key=lambda n: (n["a"], n["index"])),
+        }
+        # Write to a temporary file first so an interrupted run never leaves a
+        # truncated manifest behind
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    # The root entropy is recorded before any network is written, and every
+    # finished network right away, so a run that dies partway is continued
+    # by the next one instead of being refused as another root seed
+    write_manifest()
+    with Pool(processes) as pool:
+        for result in pool.imap_unordered(make_network, tasks):
+            done[(result["a"], result["index"])] = result
+            write_manifest()
+            print(
+                f"Wrote network {result['index']} for assort {result['a']} ({result['assortativity']})."
+            )
 
 
 if __name__ == "__main__":
-    if (args_count := len(sys.argv)) > 4:
-        print(f"Two arguments expected, got {args_count - 1}.")
+    if (args_count := len(sys.argv)) > 5:
+        print(f"At most four arguments expected, got {args_count - 1}.")
         raise SystemExit(2)
-    elif args_count < 3:
+    elif args_count < 4:
         print(
-            "You must specify the configuration file, the number of networks you want to generate, and the root output folder."
+            "You must specify the configuration file, the number of networks you want to generate, and the root output folder. Optionally followed by a root seed."
         )
         raise SystemExit(2)
 
@@ -53,6 +148,7 @@ if __name__ == "__main__":
     conf_file = Path(os.path.join("input/configs/", sys.argv[1]))
     n_networks = int(sys.argv[2])
     output_folder = Path(sys.argv[3])
+    root_entropy = int(sys.argv[4]) if args_count == 5 else None
 
     if not os.path.exists(conf_file):
         print(f"Given configuration file does not exits: {conf_file}")
@@ -62,4 +158,4 @@ if __name__ == "__main__":
         print(f"Given output folder does not exits: {output_folder}")
         raise SystemExit(2)
 
-    main(conf_file, n_networks, output_folder)
+    main(conf_file, n_networks, output_folder, root_entropy)
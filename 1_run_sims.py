@@ -1,6 +1,14 @@
 from functions.network_generation import erdos, barabasi_albert, write_graph
-from functions.metrics import calc_pearson
-from functions.model import mainModel
+from functions.graph_store import EndStateStore
+from functions.topology import TopologyContext
+from functions.model import arrayModel
+from functions.simulation import (
+    simulate,
+    dyn_data,
+    coleman_hook,
+    mean_energy_hook,
+    log_spaced,
+)
 
 from multiprocessing.pool import ThreadPool as Pool
 import networkx as nx
@@ -12,17 +20,7 @@ import re
 import os
 
 
-def write_dyn_data(
-    non_lonely_mean, non_lonely_std, lonely_mean, lonely_std, pearsons, data_file_path
-):
-    data = {
-        "non_lonely_mean": non_lonely_mean.tolist(),
-        "non_lonely_std": non_lonely_std.tolist(),
-        "lonely_mean": lonely_mean.tolist(),
-        "lonely_std": lonely_std.tolist(),
-        "pearsons": pearsons,
-    }
-
+def write_dyn_data(data, data_file_path):
     # Serializing json
     json_object = json.dumps(data, indent=4)
 
@@ -43,7 +41,13 @@ def run_sims(a):
         "n_per_group": 500,
         "n_swaps": 1500,
         "network_gen_fn": barabasi_albert,
+        "noise_std": 0.02,
         "a": a,
+        # "gml" writes a full graph copy per run, which the notebook reads;
+        # "states" only keeps the final k/e vectors in an EndStateStore
+        "tt_format": "gml",
+        # Degree of separation shells kept with the t0 topology, 0 for none
+        "dos_depth": 4,
     }
     if conf["network_gen_fn"] == erdos:
         conf["p_rel"] = 0.2
@@ -70,13 +74,23 @@ def run_sims(a):
             os.mkdir(path)
 
     t0_assort_dir_path = os.path.join(base_path, t0_path, conf_path, str(a))
-    files = os.listdir(t0_assort_dir_path)
+    files = [f for f in os.listdir(t0_assort_dir_path) if f.endswith(".gml")]
     for file in files:
         logging.info(f"Running sims for {file} on assort {a}")
-        G = nx.read_gml(os.path.join(t0_assort_dir_path, file))
+        # Shared by all points, and cached in .topology_cache for the analysis
+        topology = TopologyContext.for_t0(
+            os.path.join(t0_assort_dir_path, file),
+            conf["e_samples"],
+            depth=conf["dos_depth"],
+        )
 
         for point in points:
-            model_parameters = {"G": G.copy(), "h": 0.05, "beta": 1 / 2, "point": point}
+            model_parameters = {
+                "h": 0.05,
+                "noise_std": conf["noise_std"],
+                "beta": 1 / 2,
+                "point": point,
+            }
 
             model_path = f"p{'-'.join(str(np.round(p,2)) for p in model_parameters['point'])}_b{model_parameters['beta']}_sd{sim_dur}"
 
@@ -100,50 +114,38 @@ def run_sims(a):
                 )
                 continue
 
-            model = mainModel(**model_parameters)
-
-            es = np.zeros((len(model.G.nodes), sim_dur))
-            # ks = np.zeros((len(model.G.nodes), sim_dur))
-            pearsons = [calc_pearson(model.G)]
-
-            for t in range(sim_dur):
-                model.next()
-                for n_idx, node in enumerate(model.G.nodes):
-                    es[n_idx, t] = model.G.nodes[node]["e"]
-                    # ks[n_idx, t] = model.G.nodes[node]["k"]
-                pearsons.append(calc_pearson(model.G))
-
-                if t > window and np.all(
-                    (np.var(es[:, t - window : t], axis=1) < 1e-5)
-                ):
-                    es[:, t:sim_dur] = np.tile(es[:, t], (sim_dur - t, 1)).T
-                    break
-
-            non_lonely_mean = np.mean(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][1]], axis=0
-            )
-            non_lonely_std = np.std(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][1]], axis=0
-            )
-
-            lonely_mean = np.mean(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][0]], axis=0
-            )
-            lonely_std = np.std(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][0]], axis=0
+            model = arrayModel.from_topology(topology, **model_parameters)
+            # Time resolved homophily, recorded in the dyn_data under "hooks"
+            hooks = [
+                coleman_hook(conf["e_samples"], log_spaced(50)),
+                mean_energy_hook(log_spaced(50)),
+            ]
+            result = simulate(model, topology.groups, sim_dur, window, hooks=hooks)
+            logging.info(
+                f"Hook overhead {result['timing']['hook_overhead']:.1%} of the model time"
             )
 
             logging.info(
                 f"Writing data for assort {a}, file {file}, and for point {point}"
             )
-            write_graph(model.G, graph_path, predefined_name=file)
+            if conf["tt_format"] == "gml":
+                G_tt = nx.read_gml(os.path.join(t0_assort_dir_path, file))
+                nx.set_node_attributes(
+                    G_tt,
+                    {
+                        node: {"k": k, "e": e}
+                        for node, k, e in zip(
+                            G_tt.nodes, model.k.tolist(), model.e.tolist()
+                        )
+                    },
+                )
+                write_graph(G_tt, graph_path, predefined_name=file)
+            else:
+                EndStateStore(graph_path).write(
+                    file, os.path.join(t0_assort_dir_path, file), model.k, model.e
+                )
             write_dyn_data(
-                non_lonely_mean,
-                non_lonely_std,
-                lonely_mean,
-                lonely_std,
-                pearsons,
-                dyn_data_path,
+                {**dyn_data(result), "noise_std": conf["noise_std"]}, dyn_data_path
             )
     return f"Pool finished for {a}"
 
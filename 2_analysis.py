@@ -1,48 +1,347 @@
-from multiprocessing.pool import ThreadPool as Pool
-from functions.network_generation import (
-    focussed_assort_network_gen,
-    barabasi_albert,
-    erdos,
-    write_graph,
-)
+"""Aggregate the raw simulation results of a configuration into a processed dataset.
 
+Reads the runs written by `1_run_sims.py` (or `test_run_sims.py`) below a raw
+data root, in either layout
+
+    <root>/dyn_data/<config>/<a>/p<point>_b<beta>_sd<sim_dur>/<n>.json
+    <root>/<config>/noise_<noise>-b<beta>-sd<sim_dur>/dyn_data/<a>/p<point>/<n>.json
+
+with the final states next to them under `tt_graphs` (an `EndStateStore` or
+GML copies) and the t0 networks in `<root>/t0_graphs/<config>/<a>/<n>.gml`.
+The noise of a run is the `noise_std` recorded in its dyn_data, else the
+one in the directory name, else the `noise` of the configuration file.
+Every run is summarised by a worker of a process pool: the final group means,
+the steps to convergence, the degree of separation correlations (DOS curve),
+the max degree of influence and the Coleman index per group. The results go
+to
+
+    <output>/<config>/v<ANALYSIS_VERSION>/runs.csv     one row per run and metric
+    <output>/<config>/v<ANALYSIS_VERSION>/summary.csv  mean, std and n per (a, point, noise, beta, sim_dur, metric)
+    <output>/<config>/v<ANALYSIS_VERSION>/inputs.json  input signature of every run
+
+Afterwards the `SummaryCube` over the datasets of all configs in the output
+folder is rebuilt in `<output>/summary_cube`, see `functions/summary_cube.py`.
+Runs whose input did not change since the last run are not processed again.
+Changing what is computed means bumping ANALYSIS_VERSION, which starts a
+new dataset next to the old one.
+
+Usage:
+    python 2_analysis.py <conf_file> <raw_data_root> <output_folder> [processes]
+"""
+from functions.graph_store import EndStateStore
+from functions.topology import TopologyContext
+from functions.metrics import coleman_arrays, dos_pearson, group_labels
+from functions import summary_cube
+
+from multiprocessing import Pool
 from pathlib import Path
 
+import networkx as nx
+import pandas as pd
+import numpy as np
+import hashlib
 import json
 import sys
+import re
 import os
 
+ANALYSIS_VERSION = 3
+DOS_DEPTH = 4
+COLUMNS = [
+    "a",
+    "point",
+    "noise",
+    "beta",
+    "sim_dur",
+    "graph",
+    "metric",
+    "value",
+    "source",
+]
+KEYS = COLUMNS[:5]
+MODEL_PATH = re.compile(r"p(?P<point>[^_]+)(_b(?P<beta>[^_]+)_sd(?P<sim_dur>\d+))?")
+SIM_INFO = re.compile(r"noise_(?P<noise>[^-]+)-b(?P<beta>[^-]+)-sd(?P<sim_dur>\d+)")
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _subdirs(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+
+
+def find_runs(root, conf_path, conf):
+    """All runs of a configuration below a raw data root.
+
+    Returns:
+        list: One dict per run with its table columns, the dyn_data file, the directory holding its final state and its t0 network.
+    """
+    # (dyn_data root, tt_graphs root, noise, beta, sim_dur) of every simulation setting
+    settings = [
+        (
+            os.path.join(root, "dyn_data", conf_path),
+            os.path.join(root, "tt_graphs", conf_path),
+            conf.get("noise"),
+            conf.get("beta"),
+            None,
+        )
+    ]
+    for sim_info in _subdirs(os.path.join(root, conf_path)):
+        match = SIM_INFO.fullmatch(sim_info)
+        if match is not None:
+            base = os.path.join(root, conf_path, sim_info)
+            settings.append(
+                (
+                    os.path.join(base, "dyn_data"),
+                    os.path.join(base, "tt_graphs"),
+                    float(match["noise"]),
+                    float(match["beta"]),
+                    int(match["sim_dur"]),
+                )
+            )
+
+    runs = []
+    for dyn_root, tt_root, noise, beta, sim_dur in settings:
+        for a in _subdirs(dyn_root):
+            for model_path in _subdirs(os.path.join(dyn_root, a)):
+                match = MODEL_PATH.fullmatch(model_path)
+                if match is None:
+                    continue
+                dyn_dir = os.path.join(dyn_root, a, model_path)
+                for file in sorted(f for f in os.listdir(dyn_dir) if f.endswith(".json")):
+                    graph = os.path.splitext(file)[0]
+                    runs.append(
+                        {
+                            "a": float(a),
+                            "point": str([float(p) for p in match["point"].split("-")]),
+                            "noise": noise,
+                            "beta": beta
+                            if match["beta"] is None
+                            else float(match["beta"]),
+                            "sim_dur": sim_dur
+                            if match["sim_dur"] is None
+                            else int(match["sim_dur"]),
+                            "graph": int(graph) if graph.isdigit() else graph,
+                            "dyn_path": os.path.join(dyn_dir, file),
+                            "tt_dir": os.path.join(tt_root, a, model_path),
+                            "t0_path": os.path.join(
+                                root, "t0_graphs", conf_path, a, f"{graph}.gml"
+                            ),
+                            "source": os.path.relpath(os.path.join(dyn_dir, file), root),
+                        }
+                    )
+    return runs
+
+
+def run_signature(run):
+    """Signature of the input of a run: its dyn_data file and its final state."""
+    parts = [_file_signature(run["dyn_path"])]
+    tt_gml = os.path.join(run["tt_dir"], f"{run['graph']}.gml")
+    if os.path.exists(tt_gml):
+        parts.append(_file_signature(tt_gml))
+    else:
+        store = EndStateStore(run["tt_dir"])
+        if f"{run['graph']}.gml" in store:
+            k, e = store.state(f"{run['graph']}.gml")
+            parts.append(hashlib.sha1(np.concatenate([k, e]).tobytes()).hexdigest())
+    return "-".join(parts)
+
+
+def steps_to_convergence(data):
+    """Step a run converged at, nan when it ran for its full duration.
+
+    Runs written before `converged_at` was stored are recognised by their
+    group means, which repeat the value at convergence up to the end.
+    """
+    if "converged_at" in data:
+        return np.nan if data["converged_at"] is None else data["converged_at"]
+    if "non_lonely_mean" in data:
+        series = np.array([data["lonely_mean"], data["non_lonely_mean"]])
+    else:
+        series = np.array(data["group_mean"])
+    changes = np.flatnonzero(np.any(np.diff(series, axis=1) != 0, axis=0))
+    last_change = changes[-1] + 1 if len(changes) else 0
+    return np.nan if last_change >= series.shape[1] - 1 else int(last_change)
+
+
+def max_degree_of_influence(dos):
+    """Last degree of separation before the correlation drops to zero or below.
+
+    As in the figures, the first distance with a correlation <= 0 minus one,
+    so 0 when even direct neighbours do not correlate. The deepest distance
+    when the correlation never drops.
+    """
+    for d in sorted(dos):
+        if dos[d] <= 0:
+            return d - 1
+    return max(dos, default=0)
 
-def main(conf_file, input_folder):
+
+def final_state(run, e_samples):
+    """Topology and final energies of a run, in the node order of the topology."""
+    file = f"{run['graph']}.gml"
+    tt_gml = os.path.join(run["tt_dir"], file)
+    if os.path.exists(tt_gml):
+        G = nx.read_gml(tt_gml)
+        if os.path.exists(run["t0_path"]):
+            topology = TopologyContext.for_t0(run["t0_path"], e_samples, DOS_DEPTH)
+            return topology, np.array([G.nodes[n]["e"] for n in topology.nodes])
+        topology = TopologyContext.from_graph(G, depth=DOS_DEPTH)
+        return topology, topology.e0
+    store = EndStateStore(run["tt_dir"])
+    # The store records the t0 path as the simulation saw it, relative to
+    # where it ran, so the path below the raw data root comes first
+    t0_path = run["t0_path"]
+    if not os.path.exists(t0_path):
+        t0_path = {r["name"]: r["t0"] for r in store.index()["runs"]}[file]
+    _, e = store.state(file)
+    return TopologyContext.for_t0(t0_path, e_samples, DOS_DEPTH), e
+
+
+def analyse_run(task):
+    """Summarise one run.
+
+    Args:
+        task (tuple): The run dict from `find_runs`, the group energies and the input signature of the previous analysis.
+
+    Returns:
+        tuple: Source, input signature, and the rows as dicts. No rows when the input is unchanged, no signature when the final state could not be read, so the run is analysed again next time.
+    """
+    run, e_samples, previous_signature = task
+    signature = run_signature(run)
+    if signature == previous_signature:
+        return run["source"], signature, None
+
+    with open(run["dyn_path"], "r") as f:
+        data = json.load(f)
+    # Runs record their noise since 1_run_sims writes it to the dyn_data
+    if data.get("noise_std") is not None:
+        run = {**run, "noise": float(data["noise_std"])}
+    values = {"steps_to_convergence": steps_to_convergence(data)}
+    if "non_lonely_mean" in data:
+        values["lonely_mean"] = data["lonely_mean"][-1]
+        values["non_lonely_mean"] = data["non_lonely_mean"][-1]
+    else:
+        for g, mean in enumerate(data["group_mean"]):
+            values[f"group_{g}_mean"] = mean[-1]
+
+    try:
+        topology, e = final_state(run, e_samples)
+    except (OSError, KeyError, ValueError) as exc:
+        print(f"No final state for {run['source']}: {exc}")
+        signature = None
+    else:
+        dos = dos_pearson(topology.shells(DOS_DEPTH), e)
+        values.update({f"dos_{d}": v for d, v in dos.items()})
+        values["max_doi"] = max_degree_of_influence(dos)
+        groups = group_labels(e, e_samples)
+        coleman = coleman_arrays(topology.src, topology.dst, groups, len(e_samples))
+        values.update({f"coleman_{g}": float(v) for g, v in enumerate(coleman)})
+
+    rows = [
+        {
+            **{c: run[c] for c in COLUMNS[:6]},
+            "metric": metric,
+            "value": value,
+            "source": run["source"],
+        }
+        for metric, value in values.items()
+    ]
+    return run["source"], signature, rows
+
+
+def summarise(runs):
+    """Mean, std and number of runs per (a, point, noise, beta, sim_dur, metric)."""
+    grouped = runs.groupby(KEYS + ["metric"], dropna=False)["value"]
+    return grouped.agg(["mean", "std", "count"]).reset_index()
+
+
+def main(conf_file, input_folder, output_folder, processes=None):
     # Get network configuration info
     with open(conf_file, "r") as f:
         conf = json.load(f)
-    conf_path = f"{input_folder}/{conf['network_gen_fn']}-{conf['e_samples']}es-{conf['n_per_group']}n-{conf['p_rel']}p"
-    if not os.path.exists(conf_path):
-        raise
+    conf_path = f"{conf['network_gen_fn']}-{conf['e_samples']}es-{conf['n_per_group']}n-{conf['p_rel']}p"
+    dataset_path = os.path.join(output_folder, conf_path, f"v{ANALYSIS_VERSION}")
+    if not os.path.exists(dataset_path):
+        os.makedirs(dataset_path)
+    runs_path = os.path.join(dataset_path, "runs.csv")
+    inputs_path = os.path.join(dataset_path, "inputs.json")
+
+    if os.path.exists(runs_path) and os.path.exists(inputs_path):
+        table = pd.read_csv(runs_path)
+        with open(inputs_path, "r") as f:
+            inputs = json.load(f)
+    else:
+        table, inputs = pd.DataFrame(columns=COLUMNS), {}
+
+    runs = find_runs(input_folder, conf_path, conf)
+    tasks = [(run, conf["e_samples"], inputs.get(run["source"])) for run in runs]
+
+    frames, changed = [], set()
+    with Pool(processes) as pool:
+        for source, signature, rows in pool.imap_unordered(
+            analyse_run, tasks, chunksize=4
+        ):
+            if rows is None:
+                continue
+            changed.add(source)
+            if signature is None:
+                inputs.pop(source, None)
+            else:
+                inputs[source] = signature
+            frames.append(pd.DataFrame(rows, columns=COLUMNS))
+    print(f"Analysed {len(changed)} of {len(tasks)} runs.")
+
+    # Drop rows of changed runs and of runs whose input is gone
+    present = {run["source"] for run in runs}
+    table = table[table["source"].isin(list(present - changed))]
+    table = pd.concat([table] + frames, ignore_index=True)
+    inputs = {source: inputs[source] for source in present if source in inputs}
+
+    # Write to temporary files first so an interrupted run never leaves a
+    # truncated dataset behind
+    table.to_csv(runs_path + ".tmp", index=False)
+    summarise(table).to_csv(os.path.join(dataset_path, "summary.csv.tmp"), index=False)
+    with open(inputs_path + ".tmp", "w") as f:
+        json.dump(inputs, f, indent=4)
+    os.replace(runs_path + ".tmp", runs_path)
+    os.replace(
+        os.path.join(dataset_path, "summary.csv.tmp"),
+        os.path.join(dataset_path, "summary.csv"),
+    )
+    os.replace(inputs_path + ".tmp", inputs_path)
+
+    # The figures read their statistics from the cube over all configs
+    summary_cube.main(output_folder)
+    return table
 
 
 if __name__ == "__main__":
-    if (args_count := len(sys.argv)) > 4:
-        print(f"Two arguments expected, got {args_count - 1}.")
-        raise SystemExit(2)
-    elif args_count < 3:
-        print(
-            "You must specify the configuration file, the number of networks you want to generate, and the root output folder."
-        )
+    if not 4 <= (args_count := len(sys.argv)) <= 5:
+        print(__doc__)
         raise SystemExit(2)
 
-    # Extract command line arguments for conf file and how many networks
-    # there are to be generated.
+    # Extract command line arguments for conf file, raw data root and where
+    # the processed data goes
     conf_file = Path(os.path.join("input/configs/", sys.argv[1]))
+    input_folder = Path(sys.argv[2])
     output_folder = Path(sys.argv[3])
+    processes = int(sys.argv[4]) if args_count == 5 else None
 
     if not os.path.exists(conf_file):
         print(f"Given configuration file does not exits: {conf_file}")
         raise SystemExit(2)
 
+    if not os.path.exists(input_folder):
+        print(f"Given input folder does not exits: {input_folder}")
+        raise SystemExit(2)
+
     if not os.path.exists(output_folder):
         print(f"Given output folder does not exits: {output_folder}")
         raise SystemExit(2)
 
-    main(conf_file, output_folder)
+    main(conf_file, input_folder, output_folder, processes)
@@ -0,0 +1,133 @@
+"""Render the `final_results` figure set headlessly from the summary cube.
+
+Every figure registered in `functions.visualize.FIGURES` (or only the ones
+named on the command line) is rendered in its own worker process, with the
+Agg backend, from the `SummaryCube` written by `2_analysis.py`. The main
+runs are selected by the config, noise, beta and sim_dur of the configuration
+file, the noise being the `noise` key `2_analysis.py` labels the runs by. A
+figure whose selection matches no runs fails instead of being written empty.
+`<output_folder>/figures.json` records per figure the hash of its spec and
+of its inputs, the datasets the cube was built from and the selection;
+figures whose hashes did not change since they were last written are
+skipped.
+
+Usage:
+    python 3_render_figures.py <conf_file> <cube_path> <output_folder> [figure ...]
+"""
+import matplotlib
+
+matplotlib.use("Agg")
+
+from functions.summary_cube import SummaryCube
+from functions.visualize import FIGURES, render_figure, spec_hash
+
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import traceback
+import hashlib
+import json
+import sys
+import os
+
+
+def _render(task):
+    # Every figure gets a fresh worker, so no matplotlib state is shared
+    name, cube_path, setting, save_path = task
+    try:
+        render_figure(name, SummaryCube.open(cube_path), setting, save_path)
+    except Exception:
+        return name, traceback.format_exc()
+    return name, None
+
+
+def main(conf_file, cube_path, output_folder, names=None, processes=None):
+    # Get network configuration info
+    with open(conf_file, "r") as f:
+        conf = json.load(f)
+    conf_path = f"{conf['network_gen_fn']}-{conf['e_samples']}es-{conf['n_per_group']}n-{conf['p_rel']}p"
+    if "noise" not in conf:
+        raise ValueError(f"{conf_file} has no noise to select the main runs by.")
+    cube = SummaryCube.open(cube_path)
+    setting = {
+        "config": conf_path,
+        "noise": conf["noise"],
+        "beta": conf["beta"],
+        "sim_dur": conf["sim_dur"],
+    }
+    # Check the selection once here, rather than failing in every worker
+    for dim, value in setting.items():
+        if not any(
+            c == value if isinstance(c, str) or c is None else np.isclose(c, value)
+            for c in cube.coords[dim]
+        ):
+            raise ValueError(f"{dim} {value!r} not in the cube, it has {cube.coords[dim]}.")
+
+    names = list(FIGURES) if not names else names
+    unknown = [name for name in names if name not in FIGURES]
+    if unknown:
+        raise ValueError(f"Unknown figures {unknown}, choose from {list(FIGURES)}.")
+
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, "figures.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    inputs = hashlib.sha1(
+        json.dumps(
+            {"sources": cube.provenance["sources"], "setting": setting},
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()
+    hashes, tasks = {}, []
+    for name in names:
+        hashes[name] = {"spec": spec_hash(name), "inputs": inputs}
+        save_path = os.path.join(output_folder, f"{name}.png")
+        if manifest.get(name) == hashes[name] and os.path.exists(save_path):
+            continue
+        tasks.append((name, cube_path, setting, save_path))
+    print(f"Rendering {len(tasks)} of {len(names)} figures.")
+
+    failed = []
+    with Pool(processes, maxtasksperchild=1) as pool:
+        for name, error in pool.imap_unordered(_render, tasks):
+            if error is not None:
+                print(f"Failed to render {name}:\n{error}")
+                failed.append(name)
+                manifest.pop(name, None)
+            else:
+                manifest[name] = hashes[name]
+            # Record every finished figure right away, so an interrupted
+            # run only repeats the figures it did not get to
+            with open(manifest_path + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=4)
+            os.replace(manifest_path + ".tmp", manifest_path)
+    return failed
+
+
+if __name__ == "__main__":
+    if (args_count := len(sys.argv)) < 4:
+        print(__doc__)
+        raise SystemExit(2)
+
+    # Extract command line arguments for conf file, summary cube, where the
+    # figures go and which figures to render
+    conf_file = Path(os.path.join("input/configs/", sys.argv[1]))
+    cube_path = Path(sys.argv[2])
+    output_folder = Path(sys.argv[3])
+    names = sys.argv[4:]
+
+    if not os.path.exists(conf_file):
+        print(f"Given configuration file does not exits: {conf_file}")
+        raise SystemExit(2)
+
+    if not os.path.exists(os.path.join(cube_path, "cube.json")):
+        print(f"Given summary cube does not exits: {cube_path}")
+        raise SystemExit(2)
+
+    if main(conf_file, cube_path, output_folder, names):
+        raise SystemExit(1)
@@ -0,0 +1,83 @@
+"""Accuracy and time of sampled betweenness and shell statistics versus the exact values.
+
+Generates a network of the current main configuration (two groups of 500
+nodes, Barabasi-Albert with m = 11), computes the exact betweenness with
+networkx and the exact shell sizes with `dos_shells`, and prints for an
+increasing number of pivots the time, the estimated mean, its standard
+error and the errors of the estimate.
+
+Usage:
+    python -m benchmarks.betweenness [n_per_group] [processes]
+"""
+from functions.network_generation import focussed_assort_network_gen
+from functions.metrics import (
+    adjacency_csr,
+    approx_betweenness,
+    dos_shells,
+    dos_shell_counts,
+    sampled_shell_stats,
+)
+
+import networkx as nx
+import numpy as np
+import random
+import time
+import sys
+
+PIVOTS = (10, 30, 100, 300)
+
+
+def timed(fn):
+    tic = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - tic
+
+
+def main(n_per_group, processes, aim=0.4, p_rel=11, depth=4):
+    random.seed(0)
+    np.random.seed(0)
+    G, _ = focussed_assort_network_gen(aim, [0.2, 0.8], n_per_group, p_rel)
+    A, nodes = adjacency_csr(G)
+    n = len(nodes)
+
+    exact, exact_time = timed(lambda: nx.betweenness_centrality(G))
+    exact = np.array([exact[node] for node in nodes])
+    print(f"{n} nodes, {A.nnz} edges, exact networkx betweenness {exact_time:.2f} s")
+    print(
+        f"{'pivots':>7} {'time s':>8} {'mean':>10} {'se':>10} {'|err|':>10}"
+        f" {'err/se':>7} {'node MAE':>10}"
+    )
+    for n_pivots in PIVOTS + (n,):
+        (bc, _, per_pivot), t = timed(
+            lambda: approx_betweenness(A, n_pivots, seed=1, processes=processes)
+        )
+        k = len(per_pivot)
+        se = np.std(per_pivot, ddof=1) / np.sqrt(k) * np.sqrt((n - k) / (n - 1))
+        error = abs(bc.mean() - exact.mean())
+        print(
+            f"{n_pivots:>7} {t:>8.3f} {bc.mean():>10.6f} {se:>10.2e} {error:>10.2e}"
+            f" {error / se if se > 0 else 0:>7.2f} {np.abs(bc - exact).mean():>10.2e}"
+        )
+
+    exact_counts, exact_time = timed(lambda: dos_shell_counts(dos_shells(A, depth)))
+    print(f"\nShell sizes at degree 1..{depth}, exact in {exact_time:.2f} s:")
+    print(f"{'exact':>7} {'':>8} " + " ".join(f"{m:>9.2f}" for m in exact_counts.mean(0)))
+    for n_sources in PIVOTS:
+        stats, t = timed(
+            lambda: sampled_shell_stats(A, n_sources, depth, seed=1, processes=processes)
+        )
+        print(
+            f"{n_sources:>7} {t:>8.3f} "
+            + " ".join(f"{m:>9.2f}" for m in stats["mean"])
+            + "  se "
+            + " ".join(f"{s:.2f}" for s in stats["se"])
+        )
+
+
+if __name__ == "__main__":
+    if (args_count := len(sys.argv)) > 3:
+        print(f"At most two arguments expected, got {args_count - 1}.")
+        raise SystemExit(2)
+    n_per_group = int(sys.argv[1]) if args_count > 1 else 500
+    processes = int(sys.argv[2]) if args_count > 2 else None
+    main(n_per_group, processes)
@@ -0,0 +1,73 @@
+"""Time and peak memory of network generation and simulation versus network size.
+
+Runs the array pipeline (`assort_network_arrays`, `arrayModel`, `simulate`)
+for two groups and for a multi-group case at increasing `n_per_group`, and
+prints one row per (groups, n_per_group). Peak memory is measured with
+tracemalloc, which sees every numpy allocation.
+
+Usage:
+    python -m benchmarks.scaling [max_n_per_group] [n_steps]
+"""
+from functions.network_generation import assort_network_arrays, barabasi_albert
+from functions.model import arrayModel
+from functions.simulation import simulate
+
+from scipy import sparse  # noqa: F401, keeps the import out of the first timing
+import numpy as np
+import tracemalloc
+import time
+import sys
+
+GROUP_SETUPS = {2: [0.2, 0.8], 4: [0.2, 0.4, 0.6, 0.8]}
+
+
+def measure(fn):
+    tracemalloc.start()
+    tic = time.perf_counter()
+    result = fn()
+    toc = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, toc - tic, peak / 1024**2
+
+
+def main(max_n_per_group, n_steps, aim=0.4, p_rel=11):
+    sizes = [n for n in (10**3, 10**4, 10**5, 10**6) if n <= max_n_per_group]
+    print(
+        f"{'groups':>6} {'n/group':>9} {'edges':>11} {'gen s':>8} {'gen MB':>8}"
+        f" {'step ms':>8} {'sim MB':>8}"
+    )
+    for n_groups, e_groups in GROUP_SETUPS.items():
+        for n_per_group in sizes:
+            (src, dst, groups, _, _), gen_time, gen_mem = measure(
+                lambda: assort_network_arrays(
+                    aim, e_groups, n_per_group, p_rel, barabasi_albert, seed=0
+                )
+            )
+            e = np.asarray(e_groups)[groups]
+
+            def run():
+                model = arrayModel(
+                    src, dst, e, e, h=0.05, beta=0.5, point=[1 / 3, 1 / 3, 1 / 3],
+                    noise_std=0.02, rng=np.random.default_rng(0),
+                )
+                # Block mode, so the window never needs a history
+                return simulate(
+                    model, groups, n_steps, max(n_steps // 10, 1),
+                    record_pearson=True, memory_budget=0,
+                )
+
+            _, sim_time, sim_mem = measure(run)
+            print(
+                f"{n_groups:>6} {n_per_group:>9} {len(src):>11} {gen_time:>8.2f}"
+                f" {gen_mem:>8.0f} {1000 * sim_time / n_steps:>8.2f} {sim_mem:>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    if (args_count := len(sys.argv)) > 3:
+        print(f"At most two arguments expected, got {args_count - 1}.")
+        raise SystemExit(2)
+    max_n_per_group = int(sys.argv[1]) if args_count > 1 else 10**5
+    n_steps = int(sys.argv[2]) if args_count > 2 else 20
+    main(max_n_per_group, n_steps)
@@ -0,0 +1,373 @@
+"""Compute network metrics for every network below an output root.
+
+The networks are found in the layout written by `0_network_gen.py` and
+`1_run_sims.py`
+
+    <root>/t0_graphs/<config>/<a>/<n>.gml
+    <root>/tt_graphs/<config>/<a>/<model_path>/<n>.gml      (tt_format "gml")
+    <root>/tt_graphs/<config>/<a>/<model_path>/end_states.* (tt_format "states")
+
+Every network is loaded once by a worker of a process pool, which computes
+all requested metrics on that one load. The topology of a t0 network comes
+from its stored `TopologyContext`, shared by all runs on that network. The
+results are a tidy table with one row per (config, a, point, sim_dur, graph,
+metric) in `<root>/metrics.csv`, t0 networks having point "t0" and sim_dur 0. Next to
+the table a JSON file records the signature of the input of every network
+(size and modification time of a GML file, a hash of the final state of a
+stored run), so networks whose input did not change are skipped on the
+next run.
+
+Usage:
+    python -m functions.batch_metrics <root> <metric,metric,...|all> [<results_file>]
+"""
+from functions.graph_store import EndStateStore
+from functions.topology import TopologyContext
+from functions.metrics import (
+    pearson_arrays,
+    coleman_arrays,
+    modularity_arrays,
+    group_labels,
+    dos_pearson,
+    calc_deg_assort,
+    calc_betweenness,
+    approx_betweenness,
+)
+
+from multiprocessing import Pool
+import networkx as nx
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import sys
+import re
+import os
+
+COLUMNS = ["config", "a", "point", "sim_dur", "graph", "metric", "value", "source"]
+MODEL_PATH = re.compile(r"p(?P<point>[^_]+)_b(?P<beta>[^_]+)_sd(?P<sim_dur>\d+)")
+E_SAMPLES = re.compile(r"-(?P<e_samples>\[[^\]]*\])es-")
+
+
+class Network:
+    """A loaded network: its `TopologyContext`, final energies and group labels.
+
+    The networkx graph, needed by the metrics that have no array version, is
+    only built when asked for.
+    """
+
+    def __init__(self, topology, e, e_samples=None):
+        self.topology = topology
+        self.src, self.dst = topology.src, topology.dst
+        self.e = np.asarray(e, dtype=np.float64)
+        if e_samples is None:
+            self.groups = np.round(self.e).astype(np.int64)
+        else:
+            self.groups = group_labels(self.e, e_samples)
+        self._G = None
+
+    @property
+    def G(self):
+        if self._G is None:
+            nodes = self.topology.nodes
+            self._G = nx.DiGraph()
+            self._G.add_nodes_from(
+                (node, {"e": e}) for node, e in zip(nodes, self.e.tolist())
+            )
+            self._G.add_edges_from(
+                (nodes[u], nodes[v]) for u, v in zip(self.src.tolist(), self.dst.tolist())
+            )
+        return self._G
+
+    def shells(self, depth):
+        return self.topology.shells(depth)
+
+
+def _pearson(net):
+    return {"pearson": pearson_arrays(net.src, net.dst, net.e)}
+
+
+def _coleman(net):
+    values = coleman_arrays(net.src, net.dst, net.groups)
+    return {f"coleman_{g}": float(v) for g, v in enumerate(values)}
+
+
+def _modularity(net):
+    # Lonely/non-lonely partition, as `check_lonely` with its default threshold
+    lonely = (net.e > 0.4).astype(np.int64)
+    return {"modularity": modularity_arrays(net.src, net.dst, lonely, n_groups=2)}
+
+
+DOS_DEPTH = 4
+
+
+def _dos(net, depth=DOS_DEPTH):
+    return {f"dos_{d}": v for d, v in dos_pearson(net.shells(depth), net.e).items()}
+
+
+def _mean_energy(net):
+    return {"mean_energy": float(np.mean(net.e))}
+
+
+def _degree_assortativity(net):
+    return {"degree_assortativity": float(calc_deg_assort(net.G))}
+
+
+def _betweenness(net):
+    return {"betweenness": float(calc_betweenness(net.G))}
+
+
+def _betweenness_approx(net, n_pivots=100):
+    # Pool workers cannot start pools of their own, so run in this worker
+    _, _, per_pivot = approx_betweenness(
+        net.topology.A_out, n_pivots, seed=0, processes=1
+    )
+    n, k = net.topology.n_nodes, len(per_pivot)
+    se = np.std(per_pivot, ddof=1) / np.sqrt(k) * np.sqrt((n - k) / (n - 1))
+    return {
+        "betweenness_approx": float(np.mean(per_pivot)),
+        "betweenness_approx_se": float(se),
+    }
+
+
+def _columns(metric, net):
+    # Names of the values `metric` produces, for the nan rows of a failure
+    if metric == "coleman":
+        return [f"coleman_{g}" for g in range(int(net.groups.max()) + 1)]
+    if metric == "dos":
+        return [f"dos_{d}" for d in range(1, DOS_DEPTH + 1)]
+    if metric == "betweenness_approx":
+        return ["betweenness_approx", "betweenness_approx_se"]
+    return [metric]
+
+
+METRICS = {
+    "pearson": _pearson,
+    "coleman": _coleman,
+    "modularity": _modularity,
+    "dos": _dos,
+    "mean_energy": _mean_energy,
+    "degree_assortativity": _degree_assortativity,
+    "betweenness": _betweenness,
+    "betweenness_approx": _betweenness_approx,
+}
+
+
+def _graph_id(file):
+    digits = re.sub("[^0-9]", "", file)
+    return int(digits) if digits else file
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def find_networks(root):
+    """All networks below an output root.
+
+    Returns:
+        list: One dict per network with its table columns, a `source` relative to `root` identifying it, and how to load it.
+    """
+    networks = []
+    t0_root = os.path.join(root, "t0_graphs")
+    tt_root = os.path.join(root, "tt_graphs")
+    for config in sorted(os.listdir(t0_root)) if os.path.isdir(t0_root) else []:
+        for a in sorted(os.listdir(os.path.join(t0_root, config))):
+            a_path = os.path.join(t0_root, config, a)
+            if not os.path.isdir(a_path):
+                continue
+            for file in sorted(f for f in os.listdir(a_path) if f.endswith(".gml")):
+                networks.append(
+                    {
+                        "config": config,
+                        "a": float(a),
+                        "point": "t0",
+                        "sim_dur": 0,
+                        "graph": _graph_id(file),
+                        "kind": "gml",
+                        "path": os.path.join(a_path, file),
+                    }
+                )
+
+    for config in sorted(os.listdir(tt_root)) if os.path.isdir(tt_root) else []:
+        for a in sorted(os.listdir(os.path.join(tt_root, config))):
+            a_path = os.path.join(tt_root, config, a)
+            if not os.path.isdir(a_path):
+                continue
+            for model_path in sorted(os.listdir(a_path)):
+                match = MODEL_PATH.fullmatch(model_path)
+                dir_path = os.path.join(a_path, model_path)
+                if match is None or not os.path.isdir(dir_path):
+                    continue
+                columns = {
+                    "config": config,
+                    "a": float(a),
+                    "point": str([float(p) for p in match["point"].split("-")]),
+                    "sim_dur": int(match["sim_dur"]),
+                }
+                for file in sorted(
+                    f for f in os.listdir(dir_path) if f.endswith(".gml")
+                ):
+                    networks.append(
+                        {
+                            **columns,
+                            "graph": _graph_id(file),
+                            "kind": "gml",
+                            "path": os.path.join(dir_path, file),
+                        }
+                    )
+                for name in EndStateStore(dir_path).names():
+                    networks.append(
+                        {
+                            **columns,
+                            "graph": _graph_id(name),
+                            "kind": "states",
+                            "path": dir_path,
+                            "name": name,
+                        }
+                    )
+
+    for network in networks:
+        source = os.path.relpath(network["path"], root)
+        if network["kind"] == "states":
+            source = os.path.join(source, network["name"])
+        network["source"] = source
+    return networks
+
+
+def compute_network(task):
+    """Load one network and compute the requested metrics on it.
+
+    Args:
+        task (tuple): The network dict from `find_networks`, the requested metric names, and the input signature and metric names of the previous run.
+
+    Returns:
+        tuple: Source, input signature, the metric names computed, and the rows as dicts. No rows when the input is unchanged and every metric was computed before. A failed metric gets nan rows but is not among the computed ones, so it is tried again on the next run.
+    """
+    network, metrics, previous_signature, previous_metrics = task
+    if network["kind"] == "gml":
+        signature = _file_signature(network["path"])
+    else:
+        store = EndStateStore(network["path"])
+        k, e = store.state(network["name"])
+        t0_path = {run["name"]: run["t0"] for run in store.index()["runs"]}[
+            network["name"]
+        ]
+        digest = hashlib.sha1(np.concatenate([k, e]).tobytes()).hexdigest()
+        signature = f"{digest}-{_file_signature(t0_path)}"
+
+    if signature == previous_signature:
+        metrics = [m for m in metrics if m not in previous_metrics]
+    if not metrics:
+        return network["source"], signature, [], []
+
+    match = E_SAMPLES.search(network["config"])
+    e_samples = json.loads(match["e_samples"]) if match else None
+    depth = DOS_DEPTH if "dos" in metrics else 0
+    if network["kind"] == "states":
+        topology = TopologyContext.for_t0(t0_path, e_samples, depth)
+    elif network["point"] == "t0":
+        topology = TopologyContext.for_t0(network["path"], e_samples, depth)
+        e = topology.e0
+    else:
+        G = nx.read_gml(network["path"])
+        topology = TopologyContext.from_graph(G)
+        e = topology.e0
+    net = Network(topology, e, e_samples)
+
+    rows, computed = [], []
+    for metric in metrics:
+        try:
+            values = METRICS[metric](net)
+        except Exception as exc:
+            print(f"{metric} failed for {network['source']}: {exc}")
+            values = {name: np.nan for name in _columns(metric, net)}
+        else:
+            computed.append(metric)
+        for name, value in values.items():
+            rows.append(
+                {
+                    **{c: network[c] for c in COLUMNS[:5]},
+                    "metric": name,
+                    "value": value,
+                    "source": network["source"],
+                }
+            )
+    return network["source"], signature, computed, rows
+
+
+def main(root, metrics, results_path=None, processes=None):
+    """Compute `metrics` for every network below `root` and update the results table.
+
+    Args:
+        root (str): Output root holding `t0_graphs` and/or `tt_graphs`.
+        metrics (list): Metric names, keys of `METRICS`.
+        results_path (str, optional): Results table. Defaults to `<root>/metrics.csv`.
+        processes (int, optional): Number of worker processes. Defaults to the number of cpus.
+
+    Returns:
+        pd.DataFrame: The full results table.
+    """
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics {unknown}, choose from {list(METRICS)}.")
+    results_path = results_path or os.path.join(root, "metrics.csv")
+    inputs_path = results_path + ".inputs.json"
+
+    if os.path.exists(results_path) and os.path.exists(inputs_path):
+        table = pd.read_csv(results_path)
+        with open(inputs_path, "r") as f:
+            inputs = json.load(f)
+    else:
+        table, inputs = pd.DataFrame(columns=COLUMNS), {}
+
+    tasks = []
+    for network in find_networks(root):
+        previous = inputs.get(network["source"], {})
+        tasks.append(
+            (network, metrics, previous.get("signature"), previous.get("metrics", []))
+        )
+
+    frames, stale, replaced, n_computed = [table], set(), set(), 0
+    with Pool(processes) as pool:
+        for source, signature, computed, rows in pool.imap_unordered(
+            compute_network, tasks, chunksize=4
+        ):
+            if not rows:
+                continue
+            n_computed += 1
+            previous = inputs.get(source, {})
+            if previous.get("signature") != signature:
+                # The input changed, results of other metrics are outdated too
+                stale.add(source)
+                inputs[source] = {"signature": signature, "metrics": computed}
+            else:
+                previous["metrics"] = previous["metrics"] + computed
+                # Metrics that failed before are computed again
+                replaced.update((source, row["metric"]) for row in rows)
+            frames.append(pd.DataFrame(rows, columns=COLUMNS))
+    print(f"Computed {n_computed} of {len(tasks)} networks.")
+
+    keys = pd.MultiIndex.from_arrays([table["source"], table["metric"]])
+    table = table[~table["source"].isin(stale) & ~keys.isin(list(replaced))]
+    table = pd.concat([table] + frames[1:], ignore_index=True)
+
+    # Write to temporary files first so an interrupted run never leaves a
+    # truncated table behind
+    table.to_csv(results_path + ".tmp", index=False)
+    with open(inputs_path + ".tmp", "w") as f:
+        json.dump(inputs, f, indent=4)
+    os.replace(results_path + ".tmp", results_path)
+    os.replace(inputs_path + ".tmp", inputs_path)
+    return table
+
+
+if __name__ == "__main__":
+    if not 3 <= (args_count := len(sys.argv)) <= 4:
+        print(__doc__)
+        raise SystemExit(2)
+    if not os.path.exists(sys.argv[1]):
+        print(f"Given output root does not exits: {sys.argv[1]}")
+        raise SystemExit(2)
+    metrics = list(METRICS) if sys.argv[2] == "all" else sys.argv[2].split(",")
+    main(sys.argv[1], metrics, *sys.argv[3:])
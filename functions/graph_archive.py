@@ -0,0 +1,309 @@
+"""Packed archive holding a collection of networks in a single file.
+
+A directory of GML files (e.g. all t0 networks of one assortativity value)
+is stored as one binary file. The layout is a fixed magic, the length of a
+JSON header, the header itself and a data section. The header holds the
+network names, node labels, metadata and the position of every array in the
+data section. The arrays are
+
+    node_offsets (n + 1,)   start of the nodes of network i in the node arrays
+    edge_offsets (n + 1,)   start of the edges of network i in `edges`
+    edges        (E, 2)     edges as (source, target) node positions local
+                            to their network
+    node_<attr>  (N,)       one array per numeric node attribute (e.g. e, k),
+                            int64 when every value is an integer, bool
+                            when every value is a bool, else float64
+
+so network i can be read by memory-mapping only its slices, and a whole
+collection comes in with a single sequential read. Attributes the archive
+cannot hold, non-numeric node attributes, node attributes missing on some
+nodes and any edge attribute, make `pack_graphs` raise a ValueError rather
+than being dropped.
+
+Usage:
+    python -m functions.graph_archive pack <gml_dir> [<archive>]
+    python -m functions.graph_archive pack-all <root_dir>
+    python -m functions.graph_archive unpack <archive> <gml_dir>
+"""
+import networkx as nx
+import numpy as np
+import json
+import sys
+import re
+import os
+
+MAGIC = b"LCGRAPH1"
+EXTENSION = ".gpack"
+ALIGNMENT = 64
+
+
+def _node_attributes(Gs):
+    # dtype of every node attribute, which has to be numeric and present on
+    # every node of every graph
+    values, counts, n_nodes = {}, {}, 0
+    for G in Gs:
+        for _, data in G.nodes(data=True):
+            n_nodes += 1
+            for attr, value in data.items():
+                if not isinstance(value, (bool, int, float, np.bool_, np.number)):
+                    raise ValueError(
+                        f"Node attribute {attr!r} = {value!r} is not numeric and cannot be packed."
+                    )
+                values.setdefault(attr, set()).add(type(value))
+                counts[attr] = counts.get(attr, 0) + 1
+        for u, v, data in G.edges(data=True):
+            if data:
+                raise ValueError(
+                    f"Edge ({u!r}, {v!r}) has attributes {sorted(data)}, which cannot be packed."
+                )
+    missing = [attr for attr, count in counts.items() if count < n_nodes]
+    if missing:
+        raise ValueError(f"Node attributes {missing} are not set on every node.")
+
+    dtypes = {}
+    for attr, types in values.items():
+        if all(issubclass(t, (bool, np.bool_)) for t in types):
+            dtypes[attr] = np.bool_
+        elif all(
+            issubclass(t, (int, np.integer)) and not issubclass(t, bool) for t in types
+        ):
+            dtypes[attr] = np.int64
+        else:
+            dtypes[attr] = np.float64
+    return dtypes
+
+
+def pack_graphs(Gs, path, names=None, metadata=None):
+    """Pack a list of graphs into a single archive file.
+
+    Args:
+        Gs (list): List of nx.DiGraph to pack.
+        path (str): Path of the archive file.
+        names (list, optional): Name for every graph, e.g. its original file name. Defaults to the graph index.
+        metadata (dict, optional): JSON serialisable metadata stored with the archive. Defaults to None.
+    """
+    Gs = list(Gs)
+    names = [str(i) for i in range(len(Gs))] if names is None else list(names)
+    assert len(names) == len(Gs), "Desired (len(names) == len(Gs))"
+    dtypes = _node_attributes(Gs)
+    attrs = list(dtypes)
+
+    # Networks of the same configuration share their node labels, keep
+    # every distinct label list once
+    label_sets, label_set_index, label_set_ids = [], [], {}
+    node_offsets, edge_offsets = [0], [0]
+    edges, node_values = [], {attr: [] for attr in attrs}
+    for G in Gs:
+        labels = list(G.nodes)
+        key = tuple(labels)
+        if key not in label_set_ids:
+            label_set_ids[key] = len(label_sets)
+            label_sets.append(labels)
+        label_set_index.append(label_set_ids[key])
+
+        position = {node: idx for idx, node in enumerate(labels)}
+        edges.append(
+            np.array(
+                [[position[u], position[v]] for u, v in G.edges], dtype=np.int32
+            ).reshape(-1, 2)
+        )
+        for attr in attrs:
+            node_values[attr].append(
+                np.array([G.nodes[n][attr] for n in labels], dtype=dtypes[attr])
+            )
+        node_offsets.append(node_offsets[-1] + len(labels))
+        edge_offsets.append(edge_offsets[-1] + len(edges[-1]))
+
+    arrays = {
+        "node_offsets": np.array(node_offsets, dtype=np.int64),
+        "edge_offsets": np.array(edge_offsets, dtype=np.int64),
+        "edges": np.concatenate(edges) if edges else np.zeros((0, 2), np.int32),
+    }
+    for attr in attrs:
+        arrays[f"node_{attr}"] = (
+            np.concatenate(node_values[attr]) if Gs else np.zeros(0, dtypes[attr])
+        )
+
+    # Lay out the arrays in the data section
+    table, offset = {}, 0
+    for name, array in arrays.items():
+        table[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps(
+        {
+            "version": 1,
+            "n_networks": len(Gs),
+            "names": names,
+            "node_attributes": attrs,
+            "label_sets": label_sets,
+            "label_set_index": label_set_index,
+            "graph_attributes": [dict(G.graph) for G in Gs],
+            "metadata": metadata or {},
+            "arrays": table,
+        }
+    ).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + table[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+class GraphArchive:
+    """Read access to an archive written by `pack_graphs`.
+
+    Args:
+        path (str): Path of the archive file.
+        mmap (bool, optional): Memory-map the data section so only the slices of the accessed networks are read. When False the whole file is read in one sequential read. Defaults to True.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a graph archive.")
+            header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(f.read(header_length).decode("utf-8"))
+            data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+            if not mmap:
+                f.seek(data_start)
+                buffer = f.read()
+
+        self.names = self.header["names"]
+        self.metadata = self.header["metadata"]
+        self.node_attributes = self.header["node_attributes"]
+        self._arrays = {}
+        for name, spec in self.header["arrays"].items():
+            dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                self._arrays[name] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                self._arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=data_start + spec["offset"],
+                    shape=shape,
+                )
+            else:
+                self._arrays[name] = np.frombuffer(
+                    buffer,
+                    dtype=dtype,
+                    count=int(np.prod(shape)),
+                    offset=spec["offset"],
+                ).reshape(shape)
+
+    def __len__(self):
+        return self.header["n_networks"]
+
+    def __getitem__(self, i):
+        return self.graph(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.graph(i)
+
+    def labels(self, i):
+        return self.header["label_sets"][self.header["label_set_index"][i]]
+
+    def arrays(self, i):
+        """Array view of network i.
+
+        Returns:
+            dict: `edges` as (E, 2) local node positions, `labels` and one (N,) array per node attribute.
+        """
+        n0, n1 = self._arrays["node_offsets"][i : i + 2]
+        e0, e1 = self._arrays["edge_offsets"][i : i + 2]
+        data = {"edges": self._arrays["edges"][e0:e1], "labels": self.labels(i)}
+        for attr in self.node_attributes:
+            data[attr] = self._arrays[f"node_{attr}"][n0:n1]
+        return data
+
+    def graph(self, i):
+        """Rebuild network i as a networkx DiGraph."""
+        data = self.arrays(i)
+        labels = data["labels"]
+        G = nx.DiGraph()
+        G.graph.update(self.header["graph_attributes"][i])
+        values = [np.asarray(data[attr]).tolist() for attr in self.node_attributes]
+        G.add_nodes_from(
+            (label, dict(zip(self.node_attributes, node_values)))
+            for label, *node_values in zip(labels, *values)
+        )
+        G.add_edges_from((labels[u], labels[v]) for u, v in data["edges"].tolist())
+        return G
+
+    def load_all(self):
+        return list(self)
+
+
+def _gml_files(gml_dir):
+    files = [f for f in os.listdir(gml_dir) if f.endswith(".gml")]
+    return sorted(files, key=lambda f: (int(re.sub("[^0-9]", "", f) or -1), f))
+
+
+def pack_directory(gml_dir, path=None, metadata=None):
+    """Pack all GML files of a directory, in numerical file order.
+
+    Returns:
+        str: Path of the archive, defaults to `<gml_dir>.gpack`.
+    """
+    path = path or os.path.normpath(gml_dir) + EXTENSION
+    files = _gml_files(gml_dir)
+    Gs = [nx.read_gml(os.path.join(gml_dir, f)) for f in files]
+    metadata = {"source": os.path.normpath(gml_dir), **(metadata or {})}
+    pack_graphs(Gs, path, names=files, metadata=metadata)
+    return path
+
+
+def pack_tree(root_dir):
+    """Pack every directory below `root_dir` that holds GML files."""
+    paths = []
+    for dirpath, _, filenames in os.walk(root_dir):
+        if any(f.endswith(".gml") for f in filenames):
+            paths.append(pack_directory(dirpath))
+    return paths
+
+
+def unpack_archive(path, gml_dir):
+    """Write every network of an archive back as a GML file."""
+    if not os.path.exists(gml_dir):
+        os.makedirs(gml_dir)
+    archive = GraphArchive(path, mmap=False)
+    for name, G in zip(archive.names, archive):
+        nx.write_gml(G, os.path.join(gml_dir, name))
+    return gml_dir
+
+
+if __name__ == "__main__":
+    commands = {"pack": (2, 3), "pack-all": (2, 2), "unpack": (3, 3)}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        raise SystemExit(2)
+    n_min, n_max = commands[sys.argv[1]]
+    if not n_min <= (args_count := len(sys.argv) - 1) <= n_max:
+        print(f"Wrong number of arguments for {sys.argv[1]}, got {args_count - 1}.")
+        raise SystemExit(2)
+    if not os.path.exists(sys.argv[2]):
+        print(f"Given path does not exits: {sys.argv[2]}")
+        raise SystemExit(2)
+
+    if sys.argv[1] == "pack":
+        print(f"Wrote {pack_directory(*sys.argv[2:])}")
+    elif sys.argv[1] == "pack-all":
+        for path in pack_tree(sys.argv[2]):
+            print(f"Wrote {path}")
+    else:
+        print(f"Wrote {unpack_archive(*sys.argv[2:])}")
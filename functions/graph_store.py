@@ -0,0 +1,259 @@
+import networkx as nx
+import numpy as np
+import fcntl
+import json
+import re
+import os
+
+
+class GraphStore:
+    """Directory of numbered GML graphs (0.gml, 1.gml, ...) with an id index.
+
+    The next free id is kept in a small index file inside the directory. Ids
+    are handed out under an exclusive lock on that file, so concurrent writers
+    (threads or processes) never pick the same number and allocating an id
+    costs the same no matter how many graphs the directory already holds. The
+    directory is only scanned once, to seed the index of a directory written
+    by the old `write_graph`.
+
+    Args:
+        path (str): Directory holding the graphs, created if missing.
+    """
+
+    index_name = ".graph_index"
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, self.index_name)
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+
+    def _scan_next_id(self):
+        filenumbers = [
+            int(re.sub("[^0-9]", "", fn))
+            for fn in os.listdir(self.path)
+            if not fn.startswith(".")
+            and any(i.isdigit() for i in fn)
+            and os.path.isfile(os.path.join(self.path, fn))
+        ]
+        return max(filenumbers) + 1 if filenumbers else 0
+
+    def _update_index(self, update):
+        # Apply `update` to the stored next id under an exclusive lock
+        with open(self.index_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read().strip()
+                current = int(content) if content else self._scan_next_id()
+                f.seek(0)
+                f.truncate()
+                f.write(str(update(current)))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return current
+
+    def allocate(self, n=1):
+        """Reserve `n` consecutive ids.
+
+        Args:
+            n (int, optional): Number of ids to reserve. Defaults to 1.
+
+        Returns:
+            range: The reserved ids.
+        """
+        first = self._update_index(lambda current: current + n)
+        return range(first, first + n)
+
+    def _write(self, G, name):
+        fpath = os.path.join(self.path, name)
+        # Write next to the target and move it in place, so readers never see
+        # a partially written graph
+        tmp_path = os.path.join(self.path, f".{name}.{os.getpid()}.tmp")
+        nx.write_gml(G, tmp_path)
+        os.replace(tmp_path, fpath)
+        return fpath
+
+    def write(self, G, name=None):
+        """Write a graph, under a newly allocated id unless a name is given.
+
+        Args:
+            G (nx.DiGraph): Graph to write.
+            name (str, optional): Fixed file name, bypassing the index. Defaults to None.
+
+        Returns:
+            str: Path of the written file.
+        """
+        if name is None:
+            name = f"{self.allocate()[0]}.gml"
+        elif os.path.exists(self.index_path) and any(i.isdigit() for i in name):
+            # Keep the index ahead of numbered files written by name
+            number = int(re.sub("[^0-9]", "", name))
+            self._update_index(lambda current: max(current, number + 1))
+        return self._write(G, name)
+
+    def write_many(self, Gs):
+        """Write a batch of graphs under one block of allocated ids.
+
+        Args:
+            Gs (list): List of graphs to write.
+
+        Returns:
+            list: Paths of the written files, in the order of `Gs`.
+        """
+        Gs = list(Gs)
+        ids = self.allocate(len(Gs))
+        return [self._write(G, f"{i}.gml") for i, G in zip(ids, Gs)]
+
+
+class EndStateStore:
+    """Final node states of simulation runs, keyed to their t0 network.
+
+    The model never changes edges, so instead of a GML copy of the whole
+    topology per run only the final `k` and `e` vectors are kept. All runs of
+    a directory are rows of one binary float64 file (`k` followed by `e`, in
+    the node order of the t0 graph). The index is a small JSON header with
+    the number of nodes plus a log with one JSON line per written run (its
+    name, the path of its t0 network and its row), so storing a run appends
+    a line instead of rewriting the index. A store reads only the log lines
+    added since it last looked. Loading the final states of every run is a
+    single array read, the graph itself is only rebuilt when asked for.
+
+    Args:
+        path (str): Directory holding the end states, created if missing.
+    """
+
+    data_name = "end_states.f8"
+    index_name = "end_states.json"
+    log_name = "end_states.log"
+    lock_name = ".end_states.lock"
+
+    def __init__(self, path):
+        self.path = path
+        self.data_path = os.path.join(path, self.data_name)
+        self.index_path = os.path.join(path, self.index_name)
+        self.log_path = os.path.join(path, self.log_name)
+        self.lock_path = os.path.join(path, self.lock_name)
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+        self._n_nodes = None
+        self._runs = []
+        self._rows = {}
+        self._offset = 0
+
+    def _refresh(self):
+        # Pick up the header and the log lines written since the last call
+        if self._n_nodes is None and os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                header = json.load(f)
+            self._n_nodes = header["n_nodes"]
+            # Stores written before the log kept every run in the header
+            for run in header.get("runs", []):
+                self._add(run["name"], run["t0"], len(self._runs))
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._offset)
+            new = f.read()
+        # Only complete lines, a line being appended is picked up next time
+        complete = new[: new.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            run = json.loads(line)
+            self._add(run["name"], run["t0"], run["row"])
+
+    def _add(self, name, t0_path, row):
+        if row < len(self._runs):
+            self._runs[row] = {"name": name, "t0": t0_path}
+        else:
+            self._runs.append({"name": name, "t0": t0_path})
+        self._rows[name] = row
+
+    def index(self):
+        self._refresh()
+        return {"n_nodes": self._n_nodes, "runs": [dict(run) for run in self._runs]}
+
+    def __contains__(self, name):
+        self._refresh()
+        return name in self._rows
+
+    def names(self):
+        self._refresh()
+        return [run["name"] for run in self._runs]
+
+    def write(self, name, t0_path, k, e):
+        """Store the final state of a run, replacing an earlier run of the same name.
+
+        Args:
+            name (str): Name of the run, e.g. the file name of its t0 network.
+            t0_path (str): Path of the t0 network the run started from.
+            k (array): Final connectivity per node, in t0 node order.
+            e (array): Final energy per node, in t0 node order.
+        """
+        row = np.concatenate([np.asarray(k), np.asarray(e)]).astype(np.float64)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if self._n_nodes is None:
+                    self._n_nodes = len(row) // 2
+                    with open(self.index_path + ".tmp", "w") as f:
+                        json.dump({"n_nodes": self._n_nodes}, f, indent=4)
+                    os.replace(self.index_path + ".tmp", self.index_path)
+                assert (
+                    len(row) == 2 * self._n_nodes
+                ), f"Expected {self._n_nodes} nodes, got {len(row) // 2}."
+                position = self._rows.get(name, len(self._runs))
+
+                mode = "r+b" if os.path.exists(self.data_path) else "wb"
+                with open(self.data_path, mode) as f:
+                    f.seek(position * row.nbytes)
+                    f.write(row.tobytes())
+                # The run only counts once its line is in the log
+                line = json.dumps({"name": name, "t0": t0_path, "row": position})
+                with open(self.log_path, "a") as f:
+                    f.write(line + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def states(self):
+        """Final states of all runs.
+
+        Returns:
+            tuple: Run names, and the (n_runs, n_nodes) arrays of final `k` and `e`.
+        """
+        index = self.index()
+        n_runs = len(index["runs"])
+        if n_runs == 0:
+            return [], np.zeros((0, 0)), np.zeros((0, 0))
+        # Rows beyond the index belong to a write that never completed
+        data = np.fromfile(
+            self.data_path, dtype=np.float64, count=n_runs * 2 * index["n_nodes"]
+        ).reshape(n_runs, 2, index["n_nodes"])
+        return [run["name"] for run in index["runs"]], data[:, 0], data[:, 1]
+
+    def state(self, name):
+        """Final `k` and `e` of a single run, reading only its row."""
+        index = self.index()
+        names = [run["name"] for run in index["runs"]]
+        n_nodes = index["n_nodes"]
+        data = np.fromfile(
+            self.data_path,
+            dtype=np.float64,
+            count=2 * n_nodes,
+            offset=names.index(name) * 2 * n_nodes * 8,
+        )
+        return data[:n_nodes], data[n_nodes:]
+
+    def graph(self, name):
+        """Rebuild the final graph of a run from its t0 network."""
+        k, e = self.state(name)
+        G = nx.read_gml(self._runs[self._rows[name]]["t0"])
+        nx.set_node_attributes(
+            G, {n: {"k": k, "e": e} for n, k, e in zip(G.nodes, k.tolist(), e.tolist())}
+        )
+        return G
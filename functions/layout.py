@@ -0,0 +1,134 @@
+"""Persistent cache of network layouts.
+
+Laying out a 1000 node network with graphviz is the slowest part of every
+network figure, while the same t0 topology is drawn over and over. Layouts
+are stored as (N, 2) arrays in `.layout_cache/<topology hash>-<prog>.npy`
+(`LAYOUT_CACHE_DIR` overrides the location), so every topology is laid out
+once per layout program. When graphviz (pygraphviz) is not installed the
+NumPy force layout `force_layout` is used instead, cached under the program
+name "force".
+"""
+from functions.topology import TopologyContext
+
+import networkx as nx
+import numpy as np
+import os
+
+
+def _graphviz_available():
+    try:
+        import pygraphviz  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _as_topology(G):
+    return G if isinstance(G, TopologyContext) else TopologyContext.from_graph(G)
+
+
+def _to_graph(topology):
+    G = nx.DiGraph()
+    G.add_nodes_from(topology.nodes)
+    nodes = topology.nodes
+    G.add_edges_from(
+        (nodes[u], nodes[v])
+        for u, v in zip(topology.src.tolist(), topology.dst.tolist())
+    )
+    return G
+
+
+def force_layout(topology, iterations=100, seed=0, chunk_size=2048):
+    """Fruchterman-Reingold force layout in NumPy.
+
+    All nodes repel each other with force k^2 / d and the ends of every
+    edge attract with d^2 / k, k being the optimal distance 1 / sqrt(N). The
+    step size cools linearly over the iterations. Repulsion is computed in
+    blocks of `chunk_size` rows, so memory stays O(chunk_size * N).
+
+    Args:
+        topology (TopologyContext): Topology to lay out, edge directions are ignored.
+        iterations (int, optional): Number of iterations. Defaults to 100.
+        seed (int, optional): Seed of the random initial positions. Defaults to 0.
+        chunk_size (int, optional): Rows per block of the repulsion. Defaults to 2048.
+
+    Returns:
+        np.array: (N, 2) positions in the unit square, in the node order of the topology.
+    """
+    n = topology.n_nodes
+    pos = np.random.default_rng(seed).random((n, 2))
+    if n < 2:
+        return pos
+    k = 1 / np.sqrt(n)
+    src, dst = topology.src, topology.dst
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        displacement = np.zeros((n, 2))
+        x, y = pos[:, 0], pos[:, 1]
+        for start in range(0, n, chunk_size):
+            stop = start + chunk_size
+            dx = x[start:stop, None] - x[None, :]
+            dy = y[start:stop, None] - y[None, :]
+            # Repulsion delta * k^2 / d^2, the distance kept above 0.01
+            scale = k**2 / np.maximum(dx**2 + dy**2, 1e-4)
+            displacement[start:stop, 0] = (dx * scale).sum(axis=1)
+            displacement[start:stop, 1] = (dy * scale).sum(axis=1)
+        delta = pos[src] - pos[dst]
+        distance = np.maximum(np.linalg.norm(delta, axis=1), 0.01)
+        pull = delta * (distance / k)[:, None]
+        np.add.at(displacement, src, -pull)
+        np.add.at(displacement, dst, pull)
+
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 0.01)
+        pos += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    pos -= pos.min(axis=0)
+    return pos / max(pos.max(), 1e-12)
+
+
+def cache_dir():
+    return os.environ.get("LAYOUT_CACHE_DIR", ".layout_cache")
+
+
+def layout_positions(G, prog="neato"):
+    """Layout of a network, computed once per topology and layout program.
+
+    Args:
+        G (TopologyContext or nx.Graph): Network to lay out.
+        prog (str, optional): Graphviz program. Defaults to "neato".
+
+    Returns:
+        np.array: (N, 2) positions, in the node order of the topology (`G.nodes` for a graph).
+    """
+    topology = _as_topology(G)
+    if not _graphviz_available():
+        prog = "force"
+    path = os.path.join(cache_dir(), f"{topology.cache_key()}-{prog}.npy")
+    if os.path.exists(path):
+        try:
+            return np.load(path)
+        except (OSError, ValueError):
+            pass
+
+    if prog == "force":
+        pos = force_layout(topology)
+    else:
+        graph = G if isinstance(G, nx.Graph) else _to_graph(topology)
+        layout = nx.nx_agraph.graphviz_layout(graph, prog=prog)
+        pos = np.array([layout[node] for node in topology.nodes], dtype=np.float64)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write next to the target and move it in place, so concurrent figures
+    # never load a partially written layout
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, pos)
+    os.replace(tmp_path, path)
+    return pos
+
+
+def graph_layout(G, prog="neato"):
+    """Same as `layout_positions`, as the node to position dict networkx drawing expects."""
+    return dict(zip(G.nodes, map(tuple, layout_positions(G, prog))))
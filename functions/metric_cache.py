@@ -0,0 +1,232 @@
+"""Persistent cache for metric values.
+
+Entries are keyed by the content hash of the arguments (graphs, arrays and
+plain parameters), the metric name and a code version derived from the
+source of the metric function, so editing a metric invalidates its entries.
+They live in a small SQLite database, by default `.metric_cache/metrics.db`
+in the working directory (`METRIC_CACHE_DIR` overrides the location), whose
+size is bounded by evicting the least recently used entries. A hit does
+not write to the database: its time is kept in memory and stored with the
+next insert, which evicts anyway. Setting `METRIC_CACHE=0` disables the
+cache.
+
+A metric opts in with the decorator, naming the helpers it hands its work
+to so that editing those invalidates its entries as well:
+
+    @cached_metric(depends=("dos_shells", "dos_pearson"))
+    def get_DOS(G, depth=4):
+        ...
+"""
+from scipy import sparse
+import networkx as nx
+import numpy as np
+import functools
+import threading
+import hashlib
+import inspect
+import sqlite3
+import pickle
+import time
+import os
+
+DEFAULT_MAX_BYTES = 256 * 1024**2
+
+
+def _update_hash(h, value):
+    # Feed a value into the hash, by content for graphs and arrays
+    if isinstance(value, nx.Graph):
+        h.update(f"{type(value).__name__}:{len(value)}:{value.number_of_edges()}".encode())
+        for node, data in value.nodes(data=True):
+            h.update(repr((node, sorted(data.items()))).encode())
+        for u, v, data in value.edges(data=True):
+            h.update(repr((u, v, sorted(data.items()))).encode())
+    elif isinstance(value, np.ndarray):
+        h.update(f"{value.dtype.str}:{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif sparse.issparse(value):
+        value = sparse.csr_matrix(value)
+        h.update(f"csr:{value.shape}".encode())
+        for array in (value.data, value.indices, value.indptr):
+            _update_hash(h, array)
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}:{len(value)}".encode())
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, dict):
+        h.update(f"dict:{len(value)}".encode())
+        for key, item in sorted(value.items(), key=lambda kv: repr(kv[0])):
+            h.update(repr(key).encode())
+            _update_hash(h, item)
+    elif hasattr(value, "cache_key"):
+        # Objects that know their own content hash, e.g. TopologyContext
+        h.update(f"{type(value).__name__}:{value.cache_key()}".encode())
+    elif callable(value):
+        h.update(_code_version(value).encode())
+    else:
+        h.update(repr(value).encode())
+
+
+def content_hash(*values):
+    """Hash of the content of graphs, arrays and plain values."""
+    h = hashlib.sha1()
+    for value in values:
+        _update_hash(h, value)
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version(fn):
+    name = f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', repr(fn))}"
+    try:
+        source = inspect.getsource(fn)
+    except (OSError, TypeError):
+        source = ""
+    return hashlib.sha1(f"{name}\n{source}".encode()).hexdigest()
+
+
+class MetricCache:
+    """Size bounded, least recently used store of pickled metric values.
+
+    Args:
+        path (str): Directory holding the database, created if missing.
+        max_bytes (int, optional): Size above which the least recently used entries are evicted. Defaults to 256 MiB.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+        self.db_path = os.path.join(path, "metrics.db")
+        self._local = threading.local()
+        # Time of the last hit per key, written along with the next insert
+        self._hits = {}
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, metric TEXT, value BLOB, size INTEGER, used REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+
+    def _connection(self):
+        # One connection per thread, and a new one in a forked worker
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=60)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def get(self, key):
+        """Cached value for `key`, or raise KeyError."""
+        row = (
+            self._connection()
+            .execute("SELECT value FROM entries WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            raise KeyError(key)
+        self._hits[key] = time.time()
+        return pickle.loads(row[0])
+
+    def set(self, key, metric, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, metric, blob, len(blob), time.time()),
+            )
+            hits, self._hits = self._hits, {}
+            db.executemany(
+                "UPDATE entries SET used = ? WHERE key = ?",
+                [(used, hit) for hit, used in hits.items()],
+            )
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute(
+            "SELECT key, size FROM entries ORDER BY used"
+        ).fetchall():
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """Number of entries and their total size in bytes, per metric."""
+        with self._connection() as db:
+            rows = db.execute(
+                "SELECT metric, COUNT(*), SUM(size) FROM entries GROUP BY metric"
+            ).fetchall()
+        return {metric: {"entries": n, "bytes": size} for metric, n, size in rows}
+
+    def clear(self, metric=None):
+        with self._connection() as db:
+            if metric is None:
+                db.execute("DELETE FROM entries")
+            else:
+                db.execute("DELETE FROM entries WHERE metric = ?", (metric,))
+
+
+_cache = None
+
+
+def get_cache():
+    """The cache used by `cached_metric`, None when disabled through `METRIC_CACHE=0`."""
+    global _cache
+    if os.environ.get("METRIC_CACHE", "1") == "0":
+        return None
+    path = os.environ.get("METRIC_CACHE_DIR", ".metric_cache")
+    if _cache is None or _cache.path != path:
+        max_bytes = int(os.environ.get("METRIC_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        _cache = MetricCache(path, max_bytes)
+    return _cache
+
+
+def cached_metric(fn=None, *, version=None, depends=()):
+    """Decorator caching a metric on the content of its arguments.
+
+    The key is the hash of all arguments with their defaults filled in, the
+    qualified function name and the code version, which is the hash of the
+    function source, of the source of every function in `depends` and the
+    optional `version`.
+
+    Args:
+        fn (function): Metric to cache.
+        version (str, optional): Extra version, to invalidate entries when code the metric calls changes. Defaults to None.
+        depends (tuple, optional): Functions the metric calls, or their names in the module of the metric, which may be defined below it. Defaults to ().
+    """
+    if fn is None:
+        return functools.partial(cached_metric, version=version, depends=depends)
+
+    signature = inspect.signature(fn)
+    metric = f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.lru_cache(maxsize=None)
+    def code_version():
+        # Resolved on first use, once every helper of the module exists
+        helpers = [fn.__globals__[d] if isinstance(d, str) else d for d in depends]
+        return [_code_version(f) for f in [fn, *helpers]]
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        cache = get_cache()
+        if cache is None:
+            return fn(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = content_hash(
+            metric, code_version(), version, list(bound.arguments.items())
+        )
+        try:
+            return cache.get(key)
+        except KeyError:
+            pass
+        value = fn(*args, **kwargs)
+        cache.set(key, metric, value)
+        return value
+
+    wrapper.uncached = fn
+    return wrapper
@@ -3,6 +3,9 @@ import networkx as nx
 from collections.abc import Iterable
 from collections import Counter
 import pandas as pd
+import warnings
+
+from functions.metric_cache import cached_metric
 
 
 def make_group_assignment(G):
@@ -12,6 +15,7 @@ def make_group_assignment(G):
     return group_assignment, theoretical_groups
 
 
+@cached_metric(depends=("coleman_arrays", "_coleman"))
 def coleman_homophily_index(G, make_group_assignment):
     """The segregation index S^g_{coleman} for group is established to represent the propensity of an individual to create a tie to someone from the same group (i.e., the extent of homophily), as opposed to choosing randomly.
 
@@ -26,47 +30,159 @@ def coleman_homophily_index(G, make_group_assignment):
     """
     # Assign agents to groups
     t, theoretic_groups = make_group_assignment(G)
+    position = {node: idx for idx, node in enumerate(G.nodes)}
+    src = np.array([position[u] for u, _ in G.edges], dtype=np.int64)
+    dst = np.array([position[v] for _, v in G.edges], dtype=np.int64)
+    t = np.asarray(t, dtype=np.int64)
+    n_groups = max(int(t.max()), int(np.max(theoretic_groups))) + 1
+    values = coleman_arrays(src, dst, t, n_groups=n_groups)
+    return {nG: float(values[nG]) for nG in theoretic_groups}
+
+
+def _coleman(src, dst, groups, batch, n_batch, n_groups):
+    # Coleman index per (batch entry, group), with `groups` and `batch` given
+    # per node and the edges indexing into those node arrays
+    cell = batch * n_groups + groups
+    n_cells = n_batch * n_groups
+    sizes = np.bincount(cell, minlength=n_cells)
+    n_nodes = np.bincount(batch, minlength=n_batch)
+    out_degree = np.bincount(src, minlength=len(groups))
+    degree_sum = np.bincount(cell, weights=out_degree, minlength=n_cells)
+
+    # Ties whose ends are in the same group, counted for the source's group
+    same = groups[src] == groups[dst]
+    within = np.bincount(cell[src[same]], minlength=n_cells).astype(np.float64)
+    expected = degree_sum * (sizes - 1) / np.repeat(n_nodes - 1, n_groups)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coleman = np.where(
+            within < expected,
+            (within - expected) / expected,
+            (within - expected) / (degree_sum - expected),
+        )
+    coleman[~np.isfinite(coleman)] = np.nan
+    return coleman.reshape(n_batch, n_groups)
 
-    # Filter people based on their group
-    nGs = {i: np.where(t == i)[0] for i in range(0, len(set(t)))}
 
-    # Get total size of system
-    N = len(G.nodes())
+def coleman_arrays(src, dst, groups, n_groups=None):
+    """Same as `coleman_homophily_index`, on edge arrays and group labels.
 
-    # Calculate how many within group ties we expect based on their ratio in the network
-    expected_within_group_ties = {
-        nG: sum([G.out_degree(i) * ((len(nGs[nG]) - 1) / (N - 1)) for i in nGs[nG]])
-        for nG in nGs
-    }
+    The expected and observed within group ties are `np.bincount`s over the
+    nodes and edges, so the index costs O(N + E) for any node labelling and
+    number of groups. A 2D `groups` holds the labels of a batch of end states
+    of the same topology, e.g. `group_labels` of every row of
+    `EndStateStore.states`, which are all computed in one pass.
 
-    # Calculate how many within group ties we see
-    within_group_ties = {
-        nG: sum([sum([1 for n in G.neighbors(v) if t[v] == t[n]]) for v in nGs[nG]])
-        for nG in nGs
-    }
+    Args:
+        src (np.array): Source node of every edge.
+        dst (np.array): Target node of every edge.
+        groups (np.array): Group of every node, (N,) or (B, N) for a batch.
+        n_groups (int, optional): Number of groups. Defaults to the largest label plus one.
 
-    coleman = {}
+    Returns:
+        np.array: Coleman index per group, (G,) or (B, G). Groups for which it is undefined are nan.
+    """
+    src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+    groups = np.asarray(groups, dtype=np.int64)
+    single = groups.ndim == 1
+    groups = np.atleast_2d(groups)
+    n_batch, n_nodes = groups.shape
+    n_groups = int(groups.max()) + 1 if n_groups is None else n_groups
+
+    # Every batch entry is a copy of the topology with its own node range
+    offsets = (np.arange(n_batch) * n_nodes)[:, None]
+    coleman = _coleman(
+        (src[None, :] + offsets).ravel(),
+        (dst[None, :] + offsets).ravel(),
+        groups.ravel(),
+        np.repeat(np.arange(n_batch), n_nodes),
+        n_batch,
+        n_groups,
+    )
+    return coleman[0] if single else coleman
 
-    # Apply Coleman homophily index to all groups
-    for nG in theoretic_groups:
-        try:
-            if within_group_ties[nG] < expected_within_group_ties[nG]:
-                coleman[nG] = (
-                    within_group_ties[nG] - expected_within_group_ties[nG]
-                ) / expected_within_group_ties[nG]
-            else:
-                out_degree_agents = (
-                    sum([G.out_degree(i) for i in nGs[nG]])
-                    - expected_within_group_ties[nG]
-                )
-                coleman[nG] = (
-                    within_group_ties[nG] - expected_within_group_ties[nG]
-                ) / out_degree_agents
-        except ZeroDivisionError as e:
-            coleman[nG] = np.nan
-        except KeyError as k:
-            coleman[nG] = np.nan
-    return coleman
+
+def coleman_batch(networks, n_groups=None):
+    """Coleman index of a batch of networks with different topologies.
+
+    Args:
+        networks (list): (src, dst, groups) arrays of every network.
+        n_groups (int, optional): Number of groups. Defaults to the largest label plus one.
+
+    Returns:
+        np.array: Coleman index per network and group, (B, G).
+    """
+    srcs, dsts, groups, batch = [], [], [], []
+    offset = 0
+    for b, (src, dst, labels) in enumerate(networks):
+        srcs.append(np.asarray(src, dtype=np.int64) + offset)
+        dsts.append(np.asarray(dst, dtype=np.int64) + offset)
+        groups.append(np.asarray(labels, dtype=np.int64))
+        batch.append(np.full(len(labels), b))
+        offset += len(labels)
+    if not groups:
+        return np.zeros((0, n_groups or 0))
+    groups = np.concatenate(groups)
+    n_groups = int(groups.max()) + 1 if n_groups is None else n_groups
+    return _coleman(
+        np.concatenate(srcs),
+        np.concatenate(dsts),
+        groups,
+        np.concatenate(batch),
+        len(batch),
+        n_groups,
+    )
+
+
+def modularity_arrays(src, dst, groups, n_groups=None):
+    """Directed modularity of a node partition, on edge arrays and group labels.
+
+    Q = sum over groups of (within group edges / m - K_out * K_in / m^2),
+    with K_out and K_in the summed out- and in-degree of the group, the same
+    value as `nx.algorithms.community.modularity` of the partition. Like
+    `coleman_arrays` it is a few `np.bincount`s, O(N + E), and a 2D `groups`
+    gives the modularity of a batch of labellings of the same topology.
+
+    Args:
+        src (np.array): Source node of every edge.
+        dst (np.array): Target node of every edge.
+        groups (np.array): Group of every node, (N,) or (B, N) for a batch.
+        n_groups (int, optional): Number of groups. Defaults to the largest label plus one.
+
+    Returns:
+        float or np.array: Modularity, or (B,) array of it for a batch.
+    """
+    src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+    groups = np.asarray(groups, dtype=np.int64)
+    single = groups.ndim == 1
+    groups = np.atleast_2d(groups)
+    n_batch = len(groups)
+    n_groups = int(groups.max()) + 1 if n_groups is None else n_groups
+    m = len(src)
+    if m == 0:
+        return np.nan if single else np.full(n_batch, np.nan)
+
+    # Row b of the flat group index holds the groups of batch entry b
+    offsets = (np.arange(n_batch) * n_groups)[:, None]
+    g_src, g_dst = groups[:, src] + offsets, groups[:, dst] + offsets
+    size = n_batch * n_groups
+    within = np.bincount(g_src[g_src == g_dst], minlength=size)
+    k_out = np.bincount(g_src.ravel(), minlength=size)
+    k_in = np.bincount(g_dst.ravel(), minlength=size)
+    q = (within / m - k_out * k_in / m**2).reshape(n_batch, n_groups).sum(axis=1)
+    return float(q[0]) if single else q
+
+
+@cached_metric(depends=("check_lonely", "modularity_arrays"))
+def calc_modularity(G, threshold=0.4):
+    """Directed modularity of the lonely/non-lonely partition of `check_lonely`."""
+    nodes = list(G.nodes)
+    index = {node: idx for idx, node in enumerate(nodes)}
+    lonely = check_lonely(G, threshold)
+    groups = np.array([lonely[node] for node in nodes], dtype=np.int64)
+    edges = np.array([[index[u], index[v]] for u, v in G.edges], dtype=np.int64)
+    edges = edges.reshape(-1, 2)
+    return modularity_arrays(edges[:, 0], edges[:, 1], groups, n_groups=2)
 
 
 def pearson(G, precision=5):
@@ -106,14 +222,54 @@ def pearson(G, precision=5):
     ][1]
 
 
+def pearson_arrays(src, dst, e, precision=5):
+    """Same as `pearson`, on edge arrays and a node energy array.
+
+    Args:
+        src (np.array): Source node of every edge.
+        dst (np.array): Target node of every edge.
+        e (np.array): Energy of every node.
+        precision (int, optional): Decimals to round at. Defaults to 5.
+
+    Returns:
+        float: Pearson correlation of the energies at both ends of the edges.
+    """
+    x, y = e[src], e[dst]
+    if np.all(x == x[0]) and np.all(y == y[0]):
+        return 1
+    with warnings.catch_warnings():
+        warnings.filterwarnings("error")
+        try:
+            corrcoef = np.corrcoef(x, y)[0, 1]
+        except Warning as w:
+            raise ValueError(f"Energy links were off, check this! ({w})") from w
+    return float(np.around(corrcoef, precision))
+
+
+def group_labels(e, e_groups):
+    """Group of every node, the group whose initial energy is closest to its energy.
+
+    Args:
+        e (np.array): Energy of every node, usually the initial energies. (B, N) for a batch of states.
+        e_groups (list): Initial energy of every group.
+
+    Returns:
+        np.array: Index into `e_groups` for every node, shaped like `e`.
+    """
+    e_groups = np.asarray(e_groups, dtype=np.float64)
+    return np.argmin(np.abs(np.asarray(e)[..., None] - e_groups), axis=-1)
+
+
 def calc_avg_degree(G):
     return sum([G.degree[i] for i in G.nodes]) / len(G.nodes)
 
 
+@cached_metric
 def calc_deg_assort(G):
     return nx.degree_assortativity_coefficient(G)
 
 
+@cached_metric
 def calc_betweenness(G):
     return np.mean([n for n in nx.betweenness_centrality(G).values()])
 
@@ -151,30 +307,170 @@ def check_lonely(G, threshold=0.4):
     return {i: is_lonely(G.nodes[i]["e"]) for i in G.nodes}
 
 
-def dos_neighbors(G, depth=4):
+def adjacency_csr(G):
+    """Sparse adjacency of a graph, row i holding the successors of node i.
+
+    Args:
+        G (nx.DiGraph): Graph of network
+
+    Returns:
+        tuple: (N, N) scipy CSR matrix with ones for every edge, and the node list giving the row order.
+    """
+    from scipy import sparse
+
+    nodes = list(G.nodes)
+    index = {node: idx for idx, node in enumerate(nodes)}
+    edges = np.array([[index[u], index[v]] for u, v in G.edges], dtype=np.int64)
+    edges = edges.reshape(-1, 2)
+    A = sparse.csr_matrix(
+        (np.ones(len(edges), dtype=np.float32), (edges[:, 0], edges[:, 1])),
+        shape=(len(nodes), len(nodes)),
+    )
+    return A, nodes
+
+
+def dos_shells(A, depth=4, chunk_size=2000, sources=None):
+    """Nodes at every degree of separation, for all nodes at once.
+
+    Frontier based breadth first search from every node simultaneously, as
+    sparse matrix products: the frontier at distance d is the frontier at
+    d - 1 times the adjacency, minus everything reached before. As in the
+    original `dos_neighbors` a node is not counted as reached by itself, so
+    it shows up at distance 2 of itself when one of its successors points
+    back. Sources are processed in chunks to bound the memory of the
+    frontiers.
+
+    Args:
+        A (sparse matrix): Adjacency, row i holding the successors of node i.
+        depth (int, optional): Largest degree of separation. Defaults to 4.
+        chunk_size (int, optional): Number of sources per chunk. Defaults to 2000.
+        sources (np.array, optional): Only search from these nodes, the rows of the shells following their order. Defaults to all nodes.
+
+    Returns:
+        list: For d = 1..depth an (N, N) boolean CSR matrix, row i marking the nodes at degree of separation d from node i.
+    """
+    from scipy import sparse
+
+    A = sparse.csr_matrix(A, dtype=np.float32)
+    A.data[:] = 1
+    n = A.shape[0]
+    rows = np.arange(n) if sources is None else np.asarray(sources)
+    chunks = [[] for _ in range(depth)]
+    for start in range(0, len(rows), chunk_size):
+        frontier = A[rows[start : start + chunk_size]]
+        reached = frontier.copy()
+        chunks[0].append(frontier)
+        for d in range(1, depth):
+            step = frontier @ A
+            step.data[:] = 1
+            frontier = step - step.multiply(reached)
+            frontier.eliminate_zeros()
+            reached = reached + frontier
+            chunks[d].append(frontier)
+    return [sparse.vstack(c, format="csr").astype(bool) for c in chunks]
+
+
+def dos_shell_counts(shells):
+    """Number of nodes at every degree of separation.
+
+    Returns:
+        np.array: (N, depth) array, entry [i, d - 1] the number of nodes at degree of separation d from node i.
+    """
+    return np.stack([np.diff(S.indptr) for S in shells], axis=1)
+
+
+def shells_to_dos_n(shells, nodes):
+    """Convert `dos_shells` output to the `dos_neighbors` dictionary."""
+    dos_n = {}
+    for d, S in enumerate(shells, start=1):
+        for i, node in enumerate(nodes):
+            dos_n.setdefault(node, {})
+            dos_n[node][d] = [nodes[j] for j in S.indices[S.indptr[i] : S.indptr[i + 1]]]
+    return dos_n
+
+
+def dos_neighbors(G, depth=4, topology=None):
     """Provide a structure for each node and others at degree of separation depth.
 
     Args:
         G (nx.DiGraph): Graph of network
         depth (int, optional): The degrees of separation you want lists of. Defaults to 4.
+        topology (TopologyContext, optional): Context of G, reusing its shells. Defaults to None.
 
     Returns:
         dict: Dictionary providing lists of nodes from data[node] at depth d. data[node][d] = list nodes at desired degree of separation.
     """
+    if topology is not None:
+        return shells_to_dos_n(topology.shells(depth), topology.nodes)
+    A, nodes = adjacency_csr(G)
+    return shells_to_dos_n(dos_shells(A, depth), nodes)
 
-    def get_neighbours(l):
-        return list(flatten([list(nx.neighbors(G, n)) for n in l]))
 
-    dos_n = {}
-    for node in list(G.nodes):
-        dos_n.setdefault(node, {})
-        dos_n[node][1] = list(nx.neighbors(G, node))
-        already_iterated = dos_n[node][1].copy()
-        for d in range(2, depth + 1):
-            nd = get_neighbours(dos_n[node][d - 1])
-            dos_n[node][d] = list(set(nd) - set(already_iterated))
-            already_iterated += nd
-    return dos_n
+def dos_pearson(shells, e, precision=5):
+    """Pearson correlation of energies between nodes at every degree of separation.
+
+    Equal to correlating the list of all (ego energy, alter energy) pairs per
+    distance, but computed from sums over the shell matrices, so the pairs
+    are never built. With S the shell at distance d, the pair count is the
+    number of entries of S, the ego and alter sums are the row and column
+    counts weighted with the (squared) energies and the sum of products is
+    e^T S e.
+
+    Args:
+        shells (list): Shell matrices from `dos_shells`.
+        e (np.array): Energy of every node, in the row order of the shells.
+        precision (int, optional): Decimals to round at. Defaults to 5.
+
+    Returns:
+        dict: Correlation per degree of separation, nan for distances without any pairs.
+    """
+    e = np.asarray(e, dtype=np.float64)
+    # Pearson is shift invariant, centering keeps the sums small
+    x = e - e.mean()
+    DOS = {}
+    for d, S in enumerate(shells, start=1):
+        n = S.nnz
+        if n == 0:
+            DOS[d] = np.nan
+            continue
+        row_count = np.diff(S.indptr)
+        col_count = np.bincount(S.indices, minlength=S.shape[1])
+
+        # All pairs equal, as in `pearson`
+        ego, alter = e[row_count > 0], e[col_count > 0]
+        ego_constant, alter_constant = np.all(ego == ego[0]), np.all(alter == alter[0])
+        if ego_constant and alter_constant:
+            DOS[d] = 1
+            continue
+        elif ego_constant or alter_constant:
+            raise Exception("Energy links were off, check this!")
+
+        sx, sy = row_count @ x, col_count @ x
+        sxx, syy = row_count @ x**2, col_count @ x**2
+        sxy = x @ (S @ x)
+        corrcoef = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx**2) * (n * syy - sy**2))
+        DOS[d] = float(np.around(corrcoef, precision))
+    return DOS
+
+
+@cached_metric(depends=("adjacency_csr", "dos_shells", "dos_pearson"))
+def get_DOS(G, depth=4, topology=None):
+    """Pearson correlation of energies between nodes at degree of separation 1..depth.
+
+    Args:
+        G (nx.DiGraph): Graph of network
+        depth (int, optional): Largest degree of separation. Defaults to 4.
+        topology (TopologyContext, optional): Context of G, reusing its shells. Defaults to None.
+
+    Returns:
+        dict: Correlation per degree of separation.
+    """
+    if topology is not None:
+        e = [G.nodes[n]["e"] for n in topology.nodes]
+        return dos_pearson(topology.shells(depth), e)
+    A, nodes = adjacency_csr(G)
+    e = [G.nodes[n]["e"] for n in nodes]
+    return dos_pearson(dos_shells(A, depth), e)
 
 
 def dos_df(dos_n, energies, dos_depth=6, states=[0, 1]):
@@ -241,6 +537,68 @@ def dos_df(dos_n, energies, dos_depth=6, states=[0, 1]):
     return df, dos_metric
 
 
+def dos_df_shells(shells, nodes, energies, dos_depth=6, states=[0, 1]):
+    """Vectorised `dos_df`, counting alters per state from the shell matrices.
+
+    The number of alters in state k of every ego at every distance is the
+    shell matrix times the indicator vector of state k, which gives all
+    counts as one (N, depth) integer matrix per state. The fractions,
+    `difference_random` and `dos_metric` are then array operations.
+
+    Args:
+        shells (list): Shell matrices from `dos_shells`.
+        nodes (list): Node of every shell row, as returned by `adjacency_csr`.
+        energies (dict): A dictionary with all nodes as keys, and their group (0, or 1) as values.
+        dos_depth (int, optional): Largest degree of separation in the dos_metric list. Defaults to 6.
+        states (list, optional): States in which the nodes can be. Defaults to [0, 1].
+
+    Returns:
+        tuple: The `dos_df` dataframe, with rows ordered by node and then degree, and the dos_metric list.
+    """
+    n_nodes, depth = len(nodes), len(shells)
+    ego_e = np.array([energies[n] for n in nodes])
+    n_neighbors = dos_shell_counts(shells)
+    alters = {
+        k: np.stack([S @ (ego_e == k).astype(np.int64) for S in shells], axis=1)
+        for k in states
+    }
+
+    # Calculate population ratio of minimal energy individuals
+    values, counts = np.unique(ego_e, return_counts=True)
+    expected_fraction_lonely = counts[0] / n_nodes
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alter_fraction = alters[0] / n_neighbors
+        difference_random = alter_fraction / expected_fraction_lonely - 1
+        metric = difference_random / np.abs(difference_random[:, [0]])
+
+    df = {
+        "ego": np.repeat(np.array(nodes, dtype=object), depth),
+        "dos": np.tile(np.arange(1, depth + 1), n_nodes),
+        "ego_e": np.repeat(ego_e, depth),
+        "n_neighbors": n_neighbors.ravel(),
+    }
+    for k in states:
+        df[f"alter_e{k}"] = alters[k].ravel()
+    df["alter_fraction_e0"] = alter_fraction.ravel()
+    df["difference_random"] = difference_random.ravel()
+    df["dos_metric"] = metric.ravel()
+    df = pd.DataFrame(df)
+    df.replace([np.inf, -np.inf], 0, inplace=True)
+
+    # Mean difference per degree over the lonely egos, relative to degree 1
+    difference_random[np.isinf(difference_random)] = 0
+    lonely = difference_random[ego_e < 0.5][:, :dos_depth]
+    if len(lonely) == 0:
+        return df, [0] * dos_depth
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        grouped = np.nanmean(lonely, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dos_metric = (grouped / np.abs(grouped[0])).tolist()
+    return df, dos_metric
+
+
 # def dos_df(dos_n, energies, states=[0, 1]):
 #     df = {"ego": [], "dos": [], "ego_e": [], "n_neighbors": []}
 #     for node in dos_n:
@@ -264,3 +622,167 @@ def dos_df(dos_n, energies, dos_depth=6, states=[0, 1]):
 #     df["dos_metric"] = df["difference_random"].div(
 #         df.groupby(["ego"])["difference_random"].transform("first"))
 #     return df
+
+
+def _brandes_dependencies(A, AT, sources):
+    # Brandes dependencies of every node on the given sources, breadth first
+    # from all of them at once: the path counts of the next level are the
+    # counts of the current level times the adjacency, and the dependencies
+    # flow back one level at a time through the same products.
+    n, k = A.shape[0], len(sources)
+    sigma = np.zeros((k, n))
+    sigma[np.arange(k), sources] = 1
+    visited = sigma > 0
+    frontier = sigma.copy()
+    levels = []
+    while True:
+        step = np.asarray(AT @ frontier.T).T
+        new = (step > 0) & ~visited
+        if not new.any():
+            break
+        visited |= new
+        frontier = np.where(new, step, 0)
+        sigma += frontier
+        levels.append(new)
+
+    delta = np.zeros((k, n))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inv_sigma = np.where(sigma > 0, 1 / sigma, 0)
+    for level in range(len(levels) - 1, 0, -1):
+        coef = np.where(levels[level], (1 + delta) * inv_sigma, 0)
+        delta += np.where(levels[level - 1], sigma * np.asarray(A @ coef.T).T, 0)
+    return delta
+
+
+_worker_adjacency = None
+
+
+def _init_worker(A):
+    global _worker_adjacency
+    _worker_adjacency = (A, A.T.tocsr())
+
+
+def _dependency_chunk(sources):
+    A, AT = _worker_adjacency
+    delta = _brandes_dependencies(A, AT, sources)
+    return delta.sum(axis=0), (delta**2).sum(axis=0), delta.sum(axis=1)
+
+
+def _map_chunks(fn, A, chunks, processes):
+    # Run `fn` over the chunks, in a process pool when processes != 1
+    if processes == 1 or len(chunks) == 1:
+        _init_worker(A)
+        return [fn(chunk) for chunk in chunks]
+    from multiprocessing import Pool
+
+    with Pool(processes, initializer=_init_worker, initargs=(A,)) as pool:
+        return pool.map(fn, chunks)
+
+
+def approx_betweenness(A, n_pivots=None, seed=None, chunk_size=32, processes=None):
+    """Betweenness centrality estimated from a random sample of pivot sources.
+
+    Brandes' accumulation is run from `n_pivots` sources drawn without
+    replacement instead of from all N, and the dependencies are scaled by
+    N / n_pivots, as `nx.betweenness_centrality(G, k=n_pivots)` does. The
+    cost is O(n_pivots * E * diameter / chunk_size) sparse products, so
+    `n_pivots` trades accuracy for time; with all nodes as pivots the result
+    is exact. Pivot chunks are spread over a process pool.
+
+    The standard error of every node follows from the spread of its
+    dependency over the pivots, with the finite population correction for
+    sampling without replacement, so it is zero when every node is a pivot.
+
+    Args:
+        A (sparse matrix): Adjacency, row i holding the successors of node i, e.g. from `adjacency_csr`.
+        n_pivots (int, optional): Number of pivot sources. Defaults to all nodes.
+        seed (int, optional): Seed of the pivot sample. Defaults to None.
+        chunk_size (int, optional): Pivots searched at once, memory is about 6 * chunk_size * N floats per worker. Defaults to 32.
+        processes (int, optional): Worker processes, 1 to run in this process. Defaults to the number of cpus.
+
+    Returns:
+        tuple: Normalised betweenness per node as `nx.betweenness_centrality` (directed), its standard error, and the per pivot total dependency.
+    """
+    from scipy import sparse
+
+    A = sparse.csr_matrix(A, dtype=np.float64)
+    A.data[:] = 1
+    n = A.shape[0]
+    n_pivots = n if n_pivots is None else min(int(n_pivots), n)
+    pivots = np.random.default_rng(seed).choice(n, n_pivots, replace=False)
+    chunks = [pivots[i : i + chunk_size] for i in range(0, n_pivots, chunk_size)]
+
+    results = _map_chunks(_dependency_chunk, A, chunks, processes)
+    total = np.sum([r[0] for r in results], axis=0)
+    total_sq = np.sum([r[1] for r in results], axis=0)
+    per_pivot = np.concatenate([r[2] for r in results])
+
+    scale = 1 / ((n - 1) * (n - 2)) if n > 2 else 1
+    bc = scale * n * total / n_pivots
+    fpc = (n - n_pivots) / (n - 1) if n > 1 else 0
+    if n_pivots > 1:
+        var = (total_sq - total**2 / n_pivots) / (n_pivots - 1)
+        se = scale * n * np.sqrt(np.maximum(var, 0) * fpc / n_pivots)
+    else:
+        se = np.full(n, np.nan)
+    return bc, se, scale * per_pivot
+
+
+def calc_betweenness_approx(G, n_pivots=100, seed=None, processes=None):
+    """`calc_betweenness` estimated from `n_pivots` sampled pivots, see `approx_betweenness`.
+
+    Returns:
+        tuple: Mean normalised betweenness and its standard error.
+    """
+    A, _ = adjacency_csr(G)
+    _, _, per_pivot = approx_betweenness(A, n_pivots, seed, processes=processes)
+    n, k = A.shape[0], len(per_pivot)
+    # The mean over nodes is the mean total dependency of a pivot
+    if k < 2:
+        return float(np.mean(per_pivot)), np.nan
+    se = np.std(per_pivot, ddof=1) / np.sqrt(k) * np.sqrt((n - k) / (n - 1))
+    return float(np.mean(per_pivot)), float(se)
+
+
+def _shell_count_chunk(args):
+    sources, depth = args
+    A, _ = _worker_adjacency
+    return dos_shell_counts(dos_shells(A, depth, sources=sources))
+
+
+def sampled_shell_stats(
+    A, n_sources=100, depth=4, seed=None, chunk_size=256, processes=None
+):
+    """Mean number of nodes at every degree of separation, from sampled sources.
+
+    Runs `dos_shells` from `n_sources` sources drawn without replacement, so
+    the cost scales with the sample instead of with N.
+
+    Args:
+        A (sparse matrix): Adjacency, row i holding the successors of node i.
+        n_sources (int, optional): Number of sampled sources. Defaults to 100.
+        depth (int, optional): Largest degree of separation. Defaults to 4.
+        seed (int, optional): Seed of the sample. Defaults to None.
+        chunk_size (int, optional): Sources per task. Defaults to 256.
+        processes (int, optional): Worker processes, 1 to run in this process. Defaults to the number of cpus.
+
+    Returns:
+        dict: `mean` and `se` of the shell size per degree of separation, shape (depth,), and the sampled `sources`.
+    """
+    from scipy import sparse
+
+    A = sparse.csr_matrix(A, dtype=np.float32)
+    n = A.shape[0]
+    n_sources = min(int(n_sources), n)
+    sources = np.random.default_rng(seed).choice(n, n_sources, replace=False)
+    chunks = [
+        (sources[i : i + chunk_size], depth) for i in range(0, n_sources, chunk_size)
+    ]
+    counts = np.concatenate(_map_chunks(_shell_count_chunk, A, chunks, processes))
+    fpc = (n - n_sources) / (n - 1) if n > 1 else 0
+    se = (
+        counts.std(axis=0, ddof=1) / np.sqrt(n_sources) * np.sqrt(fpc)
+        if n_sources > 1
+        else np.full(depth, np.nan)
+    )
+    return {"mean": counts.mean(axis=0), "se": se, "sources": sources}
@@ -1,5 +1,4 @@
 import numpy as np
-import random
 
 def distribute_points_over_cores(cores, exps, points):
     # Divide point simulations over cores
@@ -27,17 +26,158 @@ def distribute_points_over_cores(cores, exps, points):
     return cores, runs_per_core, distr_points
 
 
-def bootstrap_resample_data(data, N):
-    bootstrapped_data = [random.choices(data, k=len(data)) for _ in range(N)]
-    # print(f"{bootstrapped_data=}")
-    # means = []
-    # for i in bootstrapped_data:
-    #     mean = np.nanmean(i, axis=0)
-    #     # print(f"{mean=}")
-    #     means.append(mean)
-    means = [np.nanmean(i, axis=0) for i in bootstrapped_data]
+def bootstrap_resample_data(data, N, seed=None):
+    result = bootstrap(data, N, seed=seed, method=None, return_means=True)
+    means = result["means"]
     mean_of_means = np.mean(means, axis=0)
-    # if np.isnan(mean_of_means):
-    #     print(f"{bootstrapped_data=}\n{means=}")
     se_of_means = np.std(means, ddof=1, axis=0) / np.sqrt(N)
-    return means, mean_of_means, se_of_means
\ No newline at end of file
+    return means, mean_of_means, se_of_means
+
+
+def resample_counts(n, n_resamples, seed=None):
+    """How often every observation is drawn in every bootstrap resample.
+
+    Draws the (n_resamples, n) index matrix from a seeded Generator and
+    counts the draws per row, so a resample mean is a weighted sum.
+
+    Returns:
+        np.array: (n_resamples, n) counts, every row summing to n.
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n, size=(n_resamples, n))
+    idx += (np.arange(n_resamples) * n)[:, None]
+    return np.bincount(idx.ravel(), minlength=n_resamples * n).reshape(n_resamples, n)
+
+
+_worker_bootstrap = None
+
+
+def _init_bootstrap_worker(flat, counts):
+    global _worker_bootstrap
+    _worker_bootstrap = (flat, counts)
+
+
+def _bootstrap_chunk(args):
+    cols, ci, method = args
+    flat, counts = _worker_bootstrap
+    x = flat[:, cols]
+    valid = ~np.isnan(x)
+    x = np.where(valid, x, 0)
+    # NaN aware means of all resamples at once, as counts times values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (counts @ x) / (counts @ valid)
+    result = {"means": means}
+    if method is None:
+        return result
+
+    alpha = (1 - ci) / 2
+    if method == "percentile":
+        low, high = np.percentile(means, [100 * alpha, 100 * (1 - alpha)], axis=0)
+    elif method == "bca":
+        from scipy.special import ndtr, ndtri
+
+        # Bias correction from the fraction of resamples below the estimate
+        n = x.shape[0]
+        n_valid = valid.sum(axis=0)
+        total = x.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            estimate = total / n_valid
+            below = np.clip((means < estimate).mean(axis=0), 1 / len(means), 1 - 1 / len(means))
+            z0 = ndtri(below)
+            # Acceleration from the jackknife means, leaving out one observation
+            jack = (total - x) / (n_valid - valid)
+            jack = np.where(n_valid - valid > 0, jack, np.nan)
+        d = np.nanmean(jack, axis=0) - jack
+        d = np.where(np.isnan(d), 0, d)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            a = (d**3).sum(axis=0) / (6 * ((d**2).sum(axis=0)) ** 1.5)
+        a = np.where(np.isfinite(a), a, 0)
+        z = ndtri([alpha, 1 - alpha])[:, None]
+        q = ndtr(z0 + (z0 + z) / (1 - a * (z0 + z)))
+        q = np.where(np.isfinite(q), q, [[alpha], [1 - alpha]])
+        low, high = _column_quantiles(means, q)
+    else:
+        raise ValueError(f"Unknown interval method {method}, use 'percentile' or 'bca'.")
+    result["low"], result["high"] = low, high
+    return result
+
+
+def _column_quantiles(values, q):
+    # Quantile q[:, j] of column j, linear interpolation as np.percentile
+    ordered = np.sort(values, axis=0)
+    pos = q * (len(values) - 1)
+    lower = np.floor(pos).astype(int)
+    upper = np.minimum(lower + 1, len(values) - 1)
+    cols = np.arange(values.shape[1])
+    frac = pos - lower
+    return ordered[lower, cols] * (1 - frac) + ordered[upper, cols] * frac
+
+
+def bootstrap(
+    data,
+    n_resamples=1000,
+    seed=None,
+    ci=0.95,
+    method="percentile",
+    memory_budget=256 * 1024**2,
+    processes=1,
+    return_means=False,
+):
+    """Bootstrap the mean of a set of observations, e.g. runs of a time series.
+
+    All resamples are drawn at once as an (n_resamples, n) index matrix from
+    a seeded Generator, and their NaN aware means are computed as matrix
+    products of the draw counts with the values and with the non-NaN mask.
+    Observations may be scalars or arrays (e.g. series of 10000 steps); the
+    trailing dimensions are processed in chunks of columns so memory stays
+    within `memory_budget`. With `processes` other than 1 the chunks run in
+    a process pool when there is more than one, except inside a daemonic
+    pool worker, which cannot start one.
+
+    Args:
+        data (array): Observations along the first axis, (n,) or (n, ...).
+        n_resamples (int, optional): Number of resamples. Defaults to 1000.
+        seed (int, optional): Seed of the Generator. Defaults to None.
+        ci (float, optional): Confidence level of the interval. Defaults to 0.95.
+        method (str, optional): "percentile", "bca" (bias corrected and accelerated) or None for no interval. Defaults to "percentile".
+        memory_budget (int, optional): Bytes a chunk of columns may take. Defaults to 256 MiB.
+        processes (int, optional): Worker processes for the chunks, None for the number of cpus. Defaults to 1, in this process.
+        return_means (bool, optional): Also return the mean of every resample. Defaults to False.
+
+    Returns:
+        dict: `mean` and `se` (mean and standard deviation of the resample means), `low` and `high` of the interval, and `means` when asked for, all shaped as one observation.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n, shape = data.shape[0], data.shape[1:]
+    flat = data.reshape(n, -1)
+    n_cols = flat.shape[1]
+    counts = resample_counts(n, n_resamples, seed).astype(np.float64)
+
+    # Resample means plus temporaries of about four times that per column
+    chunk_size = max(1, int(memory_budget // (8 * (4 * n_resamples + 3 * n))))
+    chunks = [
+        (slice(i, min(i + chunk_size, n_cols)), ci, method)
+        for i in range(0, n_cols, chunk_size)
+    ]
+    from multiprocessing import Pool, current_process
+
+    if processes == 1 or len(chunks) == 1 or current_process().daemon:
+        _init_bootstrap_worker(flat, counts)
+        results = [_bootstrap_chunk(chunk) for chunk in chunks]
+    else:
+        with Pool(
+            processes, initializer=_init_bootstrap_worker, initargs=(flat, counts)
+        ) as pool:
+            results = pool.map(_bootstrap_chunk, chunks)
+
+    means = np.concatenate([r["means"] for r in results], axis=1)
+    out = {
+        "mean": np.mean(means, axis=0).reshape(shape),
+        "se": np.std(means, ddof=1, axis=0).reshape(shape),
+    }
+    if method is not None:
+        out["low"] = np.concatenate([r["low"] for r in results]).reshape(shape)
+        out["high"] = np.concatenate([r["high"] for r in results]).reshape(shape)
+    if return_means:
+        out["means"] = means.reshape((n_resamples,) + shape)
+    return out
@@ -211,3 +211,236 @@ class mainModel:
     #         new_e = 0
 
     #     return new_k, new_e
+
+
+class arrayModel:
+    """Vectorised `mainModel` on edge arrays, for large networks.
+
+    Takes the same parameters as `mainModel` but keeps `k` and `e` as arrays
+    and sums over incoming neighbours with a sparse in-adjacency matrix, so a
+    step costs O(N + E) in numpy instead of Python loops over networkx views.
+    Noise is drawn in node order for the nodes with incoming edges, exactly
+    like `mainModel`, so with the global numpy generator both models follow
+    the same noise sequence.
+
+    Args:
+        src (np.array): Source node of every edge.
+        dst (np.array): Target node of every edge.
+        e (np.array): Initial energy per node.
+        k (np.array): Initial connectivity per node.
+        rng (optional): np.random.Generator to draw noise from. Defaults to the global numpy generator.
+        topology (TopologyContext, optional): Precomputed adjacency and degrees of these edges, shared between runs on the same network. Defaults to None.
+    """
+
+    def __init__(
+        self, src, dst, e, k, h, beta, point, noise_std, alpha=3, rng=None, topology=None
+    ):
+        from functions.topology import TopologyContext
+
+        self.h = h
+        self.alpha = alpha
+        self.beta = beta
+        self.pc, self.pb, self.pec = point
+        self.noise_std = noise_std
+        self.rng = np.random if rng is None else rng
+
+        # Check input values
+        if np.round(sum(point), 3) != 1:
+            raise ValueError(
+                f"Parameters pc+pb+pec != 1 for point({point}), relative strengths cannot exceed or be lower than one.")
+
+        self.e = np.array(e, dtype=np.float64)
+        self.k = np.array(k, dtype=np.float64)
+        n = len(self.e)
+        assert len(self.k) == n, "Energy and connectivity arrays differ in length."
+
+        if topology is None:
+            topology = TopologyContext(src, dst, n)
+        assert topology.n_nodes == n, "Topology and state arrays differ in length."
+        self.topology = topology
+        self.src, self.dst = topology.src, topology.dst
+        self.A_in = topology.A_in
+        self.in_degree = topology.in_degree
+        self.out_degree = topology.out_degree
+        self.has_in = topology.has_in
+        self.n_has_in = int(self.has_in.sum())
+        self.inv_in_degree = topology.inv_in_degree
+        self.inv_out_degree = topology.inv_out_degree
+
+    @classmethod
+    def from_graph(cls, G, **model_parameters):
+        """Build the model from a networkx graph, keeping its node order."""
+        index = {node: idx for idx, node in enumerate(G.nodes)}
+        edges = np.array([[index[u], index[v]] for u, v in G.edges], dtype=np.int64)
+        return cls(
+            edges[:, 0],
+            edges[:, 1],
+            [G.nodes[n]["e"] for n in G.nodes],
+            [G.nodes[n]["k"] for n in G.nodes],
+            **model_parameters,
+        )
+
+    @classmethod
+    def from_topology(cls, topology, e=None, k=None, **model_parameters):
+        """Build the model on a `TopologyContext`, starting from its t0 state unless `e` and `k` are given."""
+        return cls(
+            topology.src,
+            topology.dst,
+            topology.e0 if e is None else e,
+            topology.k0 if k is None else k,
+            topology=topology,
+            **model_parameters,
+        )
+
+    ##########################
+    # Simulate next timestep #
+    ##########################
+    def next(self):
+        k, e = self.k, self.e
+
+        # Calculate connectivity derivative
+        dk = e - k * self.beta
+
+        # Means over incoming neighbours, zero for nodes without any
+        cogn_p = self.A_in.dot(k) * self.inv_in_degree
+        beha_p = e * self.A_in.dot((e - 0.5) * self.inv_out_degree) * self.inv_in_degree
+        emco_p = self.A_in.dot(e) * self.inv_in_degree
+
+        noise = np.zeros(len(e))
+        noise[self.has_in] = self.rng.normal(0, self.noise_std, self.n_has_in)
+
+        christakis_conjecture = (
+            self.pc * (k - cogn_p)
+            + self.pb * beha_p
+            + self.pec * (emco_p - e)
+            + noise * np.sqrt(self.h)
+        )
+        de = np.where(self.has_in, christakis_conjecture * e * (1 - e), 0)
+
+        self.k = k + self.h * dk
+        self.e = e + self.h * de
+
+    ####################################
+    # Little shorthand for running sim #
+    ####################################
+    def run_for_n_steps(self, n_steps):
+        for _ in range(n_steps):
+            self.next()
+
+
+class batchModel:
+    """`arrayModel` for a batch of points on the same network, stepped together.
+
+    The state of all points is kept as one (N, P) array, a column per (pc,
+    pb, pec) point, so the neighbour sums of every point are a single sparse
+    matrix product per step and a sweep over hundreds of points costs one
+    Python loop instead of one per point. `e` and `k` are (P, N) views of
+    it, a row per point. Points can be frozen with `active`, e.g. once they
+    converged. With a single point and the same generator the noise
+    sequence, and so the trajectory, is the one of `arrayModel`. With one
+    generator per point every point draws its noise from its own, so its
+    trajectory does not depend on the other points of the batch.
+
+    Args:
+        topology (TopologyContext): Network all points run on.
+        points (np.array): (P, 3) points (pc, pb, pec).
+        e (np.array, optional): Initial energy per node. Defaults to the t0 energies of the topology.
+        k (np.array, optional): Initial connectivity per node. Defaults to the t0 connectivity of the topology.
+        rng (optional): np.random.Generator to draw noise from, or a list with one per point. Defaults to the global numpy generator.
+    """
+
+    def __init__(
+        self,
+        topology,
+        points,
+        h,
+        beta,
+        noise_std,
+        e=None,
+        k=None,
+        alpha=3,
+        rng=None,
+    ):
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        # Check input values
+        invalid = np.round(points.sum(axis=1), 3) != 1
+        if invalid.any():
+            raise ValueError(
+                f"Parameters pc+pb+pec != 1 for points({points[invalid].tolist()}), relative strengths cannot exceed or be lower than one.")
+
+        self.h = h
+        self.alpha = alpha
+        self.beta = beta
+        self.points = points
+        self.pc, self.pb, self.pec = points.T[:, None, :]
+        self.noise_std = noise_std
+        self.rng = np.random if rng is None else rng
+        if isinstance(self.rng, (list, tuple)):
+            assert len(self.rng) == len(points), "Desired one generator per point."
+
+        self.topology = topology
+        self.src, self.dst = topology.src, topology.dst
+        self.A_in = topology.A_in
+        self.has_in = topology.has_in
+        self.n_has_in = int(self.has_in.sum())
+        self.inv_in_degree = topology.inv_in_degree[:, None]
+        self.inv_out_degree = topology.inv_out_degree[:, None]
+
+        n_points = len(points)
+        e = topology.e0 if e is None else e
+        k = topology.k0 if k is None else k
+        self._e = np.repeat(np.asarray(e, dtype=np.float64)[:, None], n_points, axis=1)
+        self._k = np.repeat(np.asarray(k, dtype=np.float64)[:, None], n_points, axis=1)
+        assert self._e.shape == self._k.shape == (topology.n_nodes, n_points), "Topology and state arrays differ in length."
+
+    @property
+    def e(self):
+        return self._e.T
+
+    @property
+    def k(self):
+        return self._k.T
+
+    ##########################
+    # Simulate next timestep #
+    ##########################
+    def next(self, active=None):
+        """Step all points, or only the ones selected by the boolean mask `active`."""
+        if active is None or active.all():
+            cols = slice(None)
+        else:
+            cols = np.flatnonzero(active)
+        k, e = self._k[:, cols], self._e[:, cols]
+        pc, pb, pec = self.pc[:, cols], self.pb[:, cols], self.pec[:, cols]
+        n_points = e.shape[1]
+
+        # Calculate connectivity derivative
+        dk = e - k * self.beta
+
+        # Means over incoming neighbours, zero for nodes without any, of all
+        # three terms and points in one product
+        sums = self.A_in.dot(np.hstack([k, (e - 0.5) * self.inv_out_degree, e]))
+        sums *= self.inv_in_degree
+        cogn_p, beha_p, emco_p = np.split(sums, 3, axis=1)
+        beha_p *= e
+
+        # Drawn per point, as arrayModel draws them
+        noise = np.zeros(e.shape)
+        if isinstance(self.rng, (list, tuple)):
+            rngs = self.rng[cols] if isinstance(cols, slice) else [self.rng[c] for c in cols]
+            noise[self.has_in] = np.stack(
+                [rng.normal(0, self.noise_std, self.n_has_in) for rng in rngs], axis=1
+            )
+        else:
+            noise[self.has_in] = self.rng.normal(0, self.noise_std, (n_points, self.n_has_in)).T
+
+        christakis_conjecture = (
+            pc * (k - cogn_p)
+            + pb * beha_p
+            + pec * (emco_p - e)
+            + noise * np.sqrt(self.h)
+        )
+        de = np.where(self.has_in[:, None], christakis_conjecture * e * (1 - e), 0)
+
+        self._k[:, cols] = k + self.h * dk
+        self._e[:, cols] = e + self.h * de
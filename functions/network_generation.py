@@ -1,11 +1,10 @@
-from functions.metrics import pearson, calc_avg_degree
+from functions.metrics import pearson, pearson_arrays
+from functions.graph_store import GraphStore
 
 import matplotlib.pyplot as plt
 import networkx as nx
 import pandas as pd
 import numpy as np
-import re
-import os
 
 
 def erdos(N, p, e, prefix=0):
@@ -51,56 +50,362 @@ def holme_kim_graph(N, m, p, e, idx=0):
     return G, {e: list(G.edges())}
 
 
-def fully_assortative_network(e_groups, n_per_group, p, network_gen_fn=barabasi_albert):
-    G, component_links = network_gen_fn(n_per_group, p, e_groups[0])
-    for idx, e in enumerate(e_groups[1:]):
-        tmp = G.copy()
-        tmp = nx.relabel_nodes(
-            tmp, {f"0{i}": f"{idx+1}{i}" for i in range(len(tmp.nodes))}
+def barabasi_albert_edges(N, m, rng):
+    """Array version of `barabasi_albert` for very large N.
+
+    Preferential attachment via the Batagelj-Brandes endpoint list: every new
+    node picks m uniformly random entries of the list of all earlier edge
+    endpoints. The picks are drawn at once and resolved by pointer jumping,
+    so the cost is O(E log E) in numpy instead of a Python loop per node.
+    Duplicate picks of the same target are dropped. Like `barabasi_albert`
+    the network starts from a star on m + 1 nodes and the direction of every
+    other edge is flipped.
+
+    Returns:
+        tuple: Source and target node arrays.
+    """
+    n_new = N - m - 1
+    node = np.repeat(np.arange(m + 1, N), m)
+    # Entries 0..2m-1 of the endpoint list belong to the initial star, entry
+    # 2m + 2j is the source and 2m + 2j + 1 the target of new edge j. A node
+    # may only pick entries that exist before its own edges.
+    first_entry = 2 * m + 2 * m * np.arange(n_new).repeat(m)
+    pick = (rng.random(n_new * m) * first_entry).astype(np.int64)
+
+    star = np.zeros(2 * m, dtype=np.int64)
+    star[1::2] = np.arange(1, m + 1)
+    target = np.full(len(pick), -1, dtype=np.int64)
+    entry = pick.copy()
+    todo = np.arange(len(pick))
+    while len(todo):
+        pos = entry[todo] - 2 * m
+        in_star = pos < 0
+        target[todo[in_star]] = star[pos[in_star] + 2 * m]
+        is_source = ~in_star & (pos % 2 == 0)
+        target[todo[is_source]] = node[pos[is_source] // 2]
+
+        # A target entry holds whatever the pick of that earlier edge was
+        follow = ~in_star & ~is_source
+        todo, edge = todo[follow], pos[follow] // 2
+        known = target[edge] >= 0
+        target[todo[known]] = target[edge[known]]
+        todo, edge = todo[~known], edge[~known]
+        entry[todo] = pick[edge]
+
+    u = np.concatenate([np.zeros(m, dtype=np.int64), node])
+    v = np.concatenate([np.arange(1, m + 1), target])
+    _, keep = np.unique(u * N + v, return_index=True)
+    keep.sort()
+    u, v = u[keep], v[keep]
+
+    # Diffuse the tree, otherwise nodes will have scalefree incoming nodes
+    # and fixed outgoing
+    flip = np.arange(len(u)) % 2 == 1
+    src, dst = np.where(flip, v, u), np.where(flip, u, v)
+    return src.astype(np.int32), dst.astype(np.int32)
+
+
+def erdos_edges(N, p, rng, chunk_size=1000):
+    """Array version of `erdos`, drawing chunk_size rows of the adjacency matrix at a time.
+
+    Returns:
+        tuple: Source and target node arrays.
+    """
+    src, dst = [], []
+    for start in range(0, N, chunk_size):
+        rows = min(chunk_size, N - start)
+        u, v = np.nonzero(rng.random((rows, N)) < p)
+        u += start
+        no_loop = u != v
+        src.append(u[no_loop].astype(np.int32))
+        dst.append(v[no_loop].astype(np.int32))
+    return np.concatenate(src), np.concatenate(dst)
+
+
+EDGE_GENERATORS = {barabasi_albert: barabasi_albert_edges, erdos: erdos_edges}
+
+
+def template_edges(network_gen_fn, n_per_group, p, rng=None):
+    """Edges of the single group network every group is copied from.
+
+    Args:
+        network_gen_fn (function): One of the networkx generators above.
+        n_per_group (int): Number of nodes in the network.
+        p (float): Density parameter of the generator.
+        rng (np.random.Generator, optional): When given, the array generator from `EDGE_GENERATORS` is used with this generator. Otherwise the networkx generator is used, which draws from the global random state. Defaults to None.
+
+    Returns:
+        tuple: Source and target node arrays, nodes numbered 0..n_per_group-1.
+    """
+    if rng is not None:
+        return EDGE_GENERATORS[network_gen_fn](n_per_group, p, rng)
+    G, _ = network_gen_fn(n_per_group, p, 0)
+    edges = np.array([[int(u[1:]), int(v[1:])] for u, v in G.edges], dtype=np.int32)
+    return edges[:, 0], edges[:, 1]
+
+
+def node_labels(n_groups, n_per_group):
+    """Labels of the nodes of a grouped network, group-major.
+
+    The label is the group index followed by the node index in its group,
+    with the group index zero-padded to a fixed width so labels stay unique
+    for more than ten groups. For up to ten groups this is the `f"{g}{i}"`
+    labelling of the original two group networks.
+    """
+    width = len(str(n_groups - 1))
+    return np.array(
+        [f"{g:0{width}d}{i}" for g in range(n_groups) for i in range(n_per_group)]
+    )
+
+
+def initial_permutation(n_rows, e_groups, assortative=True):
+    """Target group of every copy of every template edge.
+
+    Row r, column g holds the group the copy of template edge r in group g
+    points to. Fully assortative networks keep every edge in its group. Fully
+    disassortative ones point the group with the lowest energy to the one with
+    the highest, the second lowest to the second highest and so on, which
+    minimises the assortativity over all group pairings. For two groups every
+    edge then crosses to the other group.
+    """
+    n_groups = len(e_groups)
+    dtype = np.min_scalar_type(max(n_groups - 1, 1))
+    targets = np.arange(n_groups, dtype=dtype)
+    if not assortative:
+        order = np.argsort(e_groups, kind="stable").astype(dtype)
+        targets[order] = order[::-1]
+    return np.tile(targets, (n_rows, 1))
+
+
+def group_edges(tsrc, tdst, perm, n_per_group):
+    """Edge arrays of the full network from the template and the permutation.
+
+    Node i of group g is numbered g * n_per_group + i.
+
+    Returns:
+        tuple: Source and target node arrays.
+    """
+    n_groups = perm.shape[1]
+    dtype = np.int32 if n_groups * n_per_group < 2**31 else np.int64
+    groups = np.arange(n_groups, dtype=dtype)
+    src = (groups[:, None] * n_per_group + tsrc[None, :]).ravel()
+    dst = (perm.T.astype(dtype) * n_per_group + tdst[None, :]).ravel()
+    return src, dst
+
+
+def perm_modularity(perm):
+    """Modularity of the group partition of a network given by `initial_permutation` style targets.
+
+    Every group copy of the template sends and receives one edge per row, so
+    all groups have the same in- and out-degree sums and the expected share
+    of within group edges is 1 / G. Only the number of edges staying in
+    their group varies.
+    """
+    n_rows, n_groups = perm.shape
+    within = np.count_nonzero(perm == np.arange(n_groups)[None, :])
+    return float(within / (n_rows * n_groups) - 1 / n_groups)
+
+
+def rewire_assortativity(
+    perm, e_groups, aim_assort_values, rng, target="assortativity"
+):
+    """Swap edge targets between group copies until the assortativity hits the aims.
+
+    A swap exchanges the targets of the copies of one template edge in two
+    groups, which keeps all in- and out-degrees. The source and target energy
+    sums over the edges then never change and only the sum of products does,
+    so the Pearson assortativity is updated in O(1) per swap. Rows are swapped
+    in random order, each row once per pass, with G - 1 passes for G groups.
+    For two groups this is the original procedure of swapping every template
+    edge between the two groups once. Within a pass every row is touched
+    once, so the assortativity after each swap is computed for the whole
+    pass with a cumulative sum.
+
+    The modularity Q of the group partition is tracked the same way: with
+    fixed degrees only the number of within group edges changes, by the
+    difference of at most two edges per swap (see `perm_modularity`). With
+    `target="modularity"` the aims are modularity values instead.
+
+    Args:
+        perm (np.array): Target groups from `initial_permutation`, modified in place.
+        e_groups (list): Energy of every group.
+        aim_assort_values (list): Assortativity (or modularity) values to stop at, rounded at 2 decimals.
+        rng: np.random.Generator or the np.random module, used for the swap order.
+        target (str, optional): "assortativity" or "modularity", the value the aims refer to. Defaults to "assortativity".
+
+    Returns:
+        tuple: List of (aim, permutation at the first hit, assortativity, modularity) in the order they were hit, and the assortativity and modularity after every swap.
+    """
+    if target not in ("assortativity", "modularity"):
+        raise ValueError(f"Unknown target {target}.")
+    n_rows, n_groups = perm.shape
+    e = np.asarray(e_groups, dtype=np.float64)
+
+    # Energy sums over all edges, the source and target sums are equal
+    n = n_rows * n_groups
+    sx = n_rows * e.sum()
+    var = n * n_rows * (e**2).sum() - sx**2
+    sxy = (e[None, :] * e[perm]).sum()
+    within = np.count_nonzero(perm == np.arange(n_groups)[None, :])
+
+    def assortativity(sxy):
+        if var == 0:
+            return np.ones_like(sxy)
+        return np.round((n * sxy - sx**2) / var, 5)
+
+    def modularity(within):
+        return np.round(within / n - 1 / n_groups, 5)
+
+    remaining = list(aim_assort_values)
+    hits = []
+    ps, qs = [assortativity(np.array([sxy]))], [modularity(np.array([within]))]
+    for _ in range(n_groups - 1):
+        rows = rng.permutation(n_rows)
+        if n_groups == 2:
+            g = np.zeros(n_rows, dtype=perm.dtype)
+            h = np.ones(n_rows, dtype=perm.dtype)
+        else:
+            g = (rng.random(n_rows) * n_groups).astype(perm.dtype)
+            shift = (rng.random(n_rows) * (n_groups - 1)).astype(perm.dtype) + 1
+            h = ((g + shift) % n_groups).astype(perm.dtype)
+        pg, ph = perm[rows, g], perm[rows, h]
+        delta = e[g] * e[ph] + e[h] * e[pg] - e[g] * e[pg] - e[h] * e[ph]
+        delta_within = (
+            (ph == g).astype(np.int64)
+            + (pg == h)
+            - (pg == g)
+            - (ph == h)
         )
-        nx.set_node_attributes(tmp, {i: {"e": e, "k": e} for i in tmp.nodes})
+        p = assortativity(sxy + np.cumsum(delta))
+        q = modularity(within + np.cumsum(delta_within))
+        rounded = np.round(p if target == "assortativity" else q, 2)
+
+        def swap(start, stop):
+            perm[rows[start:stop], g[start:stop]] = ph[start:stop]
+            perm[rows[start:stop], h[start:stop]] = pg[start:stop]
+
+        pass_hits = []
+        for aim in remaining:
+            hit = np.flatnonzero(rounded == aim)
+            if len(hit):
+                pass_hits.append((hit[0], aim))
+        applied = 0
+        for idx, aim in sorted(pass_hits):
+            swap(applied, idx + 1)
+            applied = idx + 1
+            hits.append((aim, perm.copy(), p[idx], q[idx]))
+            remaining.remove(aim)
+
+        stop = len(rows) if remaining else applied
+        swap(applied, stop)
+        ps.append(p[:stop])
+        qs.append(q[:stop])
+        if not remaining:
+            break
+        sxy += delta.sum()
+        within += delta_within.sum()
+    return hits, np.concatenate(ps), np.concatenate(qs)
+
+
+def assort_network_arrays(
+    aim_assort_value,
+    e_groups,
+    n_per_group,
+    p_rel,
+    network_gen_fn=barabasi_albert,
+    seed=None,
+    max_rec=100,
+    target="assortativity",
+):
+    """Array-only version of `focussed_assort_network_gen` for large networks.
+
+    Never builds a networkx graph. Memory stays around 60 bytes per template
+    edge while rewiring, and the returned network takes 8 bytes per edge
+    (4 bytes per endpoint while the node count fits in int32). For the
+    Barabasi-Albert generator with m = 11 and two groups of 10^6 nodes that
+    is about 1.3 GB at peak and 180 MB for the result.
+
+    Args:
+        aim_assort_value (float): Aimed assortativity, rounded at 2 decimals.
+        e_groups (list): Initial energy of every group, any number of groups.
+        n_per_group (int): Number of nodes per group.
+        p_rel (float): Density parameter of the generator.
+        network_gen_fn (function, optional): Generator with an entry in `EDGE_GENERATORS`. Defaults to barabasi_albert.
+        seed (optional): Seed for np.random.default_rng. Defaults to None.
+        max_rec (int, optional): Number of new template networks to try. Defaults to 100.
+        target (str, optional): "assortativity" or "modularity", the value `aim_assort_value` refers to. Defaults to "assortativity".
+
+    Returns:
+        tuple: Source and target node arrays, group of every node, and the achieved assortativity and modularity.
+    """
+    rng = np.random.default_rng(seed)
+    n_groups = len(e_groups)
+    for _ in range(max_rec + 1):
+        tsrc, tdst = template_edges(network_gen_fn, n_per_group, p_rel, rng)
+        perm = initial_permutation(len(tsrc), e_groups, aim_assort_value >= 0)
+        if _initial_hit(perm, aim_assort_value, target):
+            hits = [(aim_assort_value, perm)]
+        else:
+            hits, _, _ = rewire_assortativity(
+                perm, e_groups, [aim_assort_value], rng, target
+            )
+        if hits:
+            perm = hits[0][1]
+            src, dst = group_edges(tsrc, tdst, perm, n_per_group)
+            groups = np.repeat(np.arange(n_groups), n_per_group)
+            e = np.asarray(e_groups, dtype=np.float64)[groups]
+            return src, dst, groups, pearson_arrays(src, dst, e), perm_modularity(perm)
+    raise Exception("Exceeded max recursion.")
+
+
+def _initial_hit(perm, aim, target):
+    # Whether the unrewired (fully (dis)assortative) network is the aim
+    if target == "assortativity":
+        return aim == -1.0 or aim == 1.0
+    return np.round(perm_modularity(perm), 2) == aim
+
+
+def arrays_to_graph(tsrc, tdst, perm, e_groups, n_per_group):
+    """Build the networkx graph and component links of a grouped network.
+
+    Returns:
+        tuple: nx.DiGraph with `e` and `k` set to the group energy and the group modularity in `G.graph["modularity"]`, and a DataFrame with for every template edge (rows) the edge of every group's copy (columns, keyed by group energy).
+    """
+    labels = node_labels(len(e_groups), n_per_group).tolist()
+    src, dst = group_edges(tsrc, tdst, perm, n_per_group)
+    G = nx.DiGraph(modularity=round(perm_modularity(perm), 5))
+    G.add_nodes_from(
+        (labels[g * n_per_group + i], {"e": e, "k": e})
+        for g, e in enumerate(e_groups)
+        for i in range(n_per_group)
+    )
+    edges = [(labels[u], labels[v]) for u, v in zip(src.tolist(), dst.tolist())]
+    G.add_edges_from(edges)
+    n_rows = len(tsrc)
+    component_links = pd.DataFrame(
+        {e: edges[g * n_rows : (g + 1) * n_rows] for g, e in enumerate(e_groups)}
+    )
+    return G, component_links
 
-        G = nx.compose(G, tmp)
-        component_links = {**component_links, **{e: list(tmp.edges())}}
+
+def fully_assortative_network(e_groups, n_per_group, p, network_gen_fn=barabasi_albert):
+    tsrc, tdst = template_edges(network_gen_fn, n_per_group, p)
+    perm = initial_permutation(len(tsrc), e_groups)
+    G, component_links = arrays_to_graph(tsrc, tdst, perm, e_groups, n_per_group)
     assert pearson(G) == 1, "Network assortativity is fully assortative."
-    return G, pd.DataFrame(component_links)
+    return G, component_links
 
 
 def fully_disassortative_network(
     e_groups, n_per_group, p, network_gen_fn=barabasi_albert
 ):
-    G, component_links = fully_assortative_network(
-        e_groups, n_per_group, p, network_gen_fn=network_gen_fn
-    )
-    initial_ad = calc_avg_degree(G)
-
-    for _, row in component_links.iterrows():
-        G.remove_edges_from([row[e_groups[0]], row[e_groups[1]]])
-        G.add_edge(row[e_groups[0]][0], row[e_groups[1]][1])
-        G.add_edge(row[e_groups[1]][0], row[e_groups[0]][1])
-
-        # Fix component links for later use, it's ugly, I know. But tuples be immutable tuples.
-        row[e_groups[0]], row[e_groups[1]] = list(row[e_groups[0]]), list(
-            row[e_groups[1]]
-        )
-        row[e_groups[0]][0], row[e_groups[1]][0] = (
-            row[e_groups[1]][0],
-            row[e_groups[0]][0],
-        )
-        row[e_groups[0]], row[e_groups[1]] = tuple(row[e_groups[0]]), tuple(
-            row[e_groups[1]]
-        )
+    tsrc, tdst = template_edges(network_gen_fn, n_per_group, p)
+    perm = initial_permutation(len(tsrc), e_groups, assortative=False)
+    G, component_links = arrays_to_graph(tsrc, tdst, perm, e_groups, n_per_group)
 
     # Perform some tests
-    assert np.all(
-        component_links.apply(
-            lambda row: (row[e_groups[0]][0][1:] == row[e_groups[1]][0][1:])
-            & (row[e_groups[0]][1][1:] == row[e_groups[1]][1][1:]),
-            axis=1,
-        )
-    ), "Mapping of links incorrect. Check component_links."
-    assert pearson(G) == -1.0, "Network assortativity is not -1"
-    assert calc_avg_degree(G) == initial_ad, "Average degree changed"
+    if len(e_groups) == 2:
+        assert pearson(G) == -1.0, "Network assortativity is not -1"
     return G, component_links
 
 
@@ -113,66 +418,25 @@ def focussed_assort_network_gen(
     max_rec=100,
     cur_rec=0,
     debug=False,
+    target="assortativity",
 ):
-    if aim_assort_value < 0:
-        G, component_links = fully_disassortative_network(
-            e_groups, n_per_group, p_rel, network_gen_fn
+    # With target="modularity" aim_assort_value is the aimed modularity Q
+    for _ in range(cur_rec, max_rec + 1):
+        tsrc, tdst = template_edges(network_gen_fn, n_per_group, p_rel)
+        perm = initial_permutation(len(tsrc), e_groups, aim_assort_value >= 0)
+        if _initial_hit(perm, aim_assort_value, target):
+            return arrays_to_graph(tsrc, tdst, perm, e_groups, n_per_group)
+
+        hits, ps, qs = rewire_assortativity(
+            perm, e_groups, [aim_assort_value], np.random, target
         )
-    else:
-        G, component_links = fully_assortative_network(
-            e_groups, n_per_group, p_rel, network_gen_fn
-        )
-
-    if aim_assort_value == -1.0 or aim_assort_value == 1.0:
-        return G, component_links
-
-    # Generate default network
-    p = np.round(pearson(G), 2) + 0.0
-    avg_degree = calc_avg_degree(G)
-
-    if debug:
-        ps = [p]
-
-    rand_component_links = component_links.sample(frac=1)
-    for _, row in rand_component_links.iterrows():
-        G.remove_edges_from([row[e_groups[0]], row[e_groups[1]]])
-        G.add_edge(row[e_groups[0]][0], row[e_groups[1]][1])
-        G.add_edge(row[e_groups[1]][0], row[e_groups[0]][1])
-
-        # Calculate pearson and store graph if needed
-        p = np.round(pearson(G), 2)
         if debug:
-            ps.append(p)
-
-        if p == aim_assort_value:
-            if debug:
-                print(ps)
-                plt.plot(ps)
-                plt.show()
-            assert (
-                calc_avg_degree(G) == avg_degree
-            ), f"Average degree changed from {calc_avg_degree(G)} to {avg_degree}, please check rewiring."
-            return G, component_links
-
-    if debug:
-        print(ps)
-        plt.plot(ps)
-        plt.show()
-    if cur_rec == max_rec:
-        raise Exception("Exceeded max recursion.")
-
-    assert (
-        calc_avg_degree(G) == avg_degree
-    ), f"Average degree changed from {calc_avg_degree(G)} to {avg_degree}, please check rewiring."
-    return focussed_assort_network_gen(
-        aim_assort_value,
-        e_groups,
-        n_per_group,
-        p_rel,
-        network_gen_fn=network_gen_fn,
-        cur_rec=cur_rec + 1,
-        max_rec=max_rec,
-    )
+            print(list(ps if target == "assortativity" else qs))
+            plt.plot(ps if target == "assortativity" else qs)
+            plt.show()
+        if hits:
+            return arrays_to_graph(tsrc, tdst, hits[0][1], e_groups, n_per_group)
+    raise Exception("Exceeded max recursion.")
 
 
 def focussed_assort_networks_gen(
@@ -185,91 +449,33 @@ def focussed_assort_networks_gen(
     cur_rec=0,
     debug=False,
 ):
-    G_list = []
-    p_list = []
-    G, component_links = fully_assortative_network(
-        e_groups, n_per_group, p_rel, network_gen_fn
-    )
+    for _ in range(cur_rec, max_rec + 1):
+        tsrc, tdst = template_edges(network_gen_fn, n_per_group, p_rel)
+        perm = initial_permutation(len(tsrc), e_groups)
+        aims = [a for a in aim_assort_values if a != 1.0]
 
-    if 1.0 in aim_assort_values:
-        G_list.append(G.copy())
-        p_list.append(1.0)
-        if len(G_list) == len(aim_assort_values):
-            return G_list
-
-    # Generate default network
-    p = np.round(pearson(G), 2) + 0.0
-    avg_degree = calc_avg_degree(G)
-
-    if debug:
-        ps = [p]
-
-    rand_component_links = component_links.sample(frac=1)
-    for _, row in rand_component_links.iterrows():
-        G.remove_edges_from([row[e_groups[0]], row[e_groups[1]]])
-        G.add_edge(row[e_groups[0]][0], row[e_groups[1]][1])
-        G.add_edge(row[e_groups[1]][0], row[e_groups[0]][1])
-
-        # Calculate pearson and store graph if needed
-        p = np.round(pearson(G), 2) + 0.0
+        hits, ps, _ = rewire_assortativity(perm, e_groups, aims, np.random)
         if debug:
-            ps.append(p)
-
-        if p in aim_assort_values and p not in p_list:
-            if debug:
-                print(ps)
-                plt.plot(ps)
-                plt.show()
-
-            assert (
-                calc_avg_degree(G) == avg_degree
-            ), f"Average degree changed from {calc_avg_degree(G)} to {avg_degree}, please check rewiring."
-            print(f"adding {p=}")
-            G_list.append(G.copy())
-            p_list.append(p)
-            if len(G_list) == len(aim_assort_values):
-                return G_list
-
-    if debug:
-        print(ps)
-        plt.plot(ps)
-        plt.show()
-    if cur_rec == max_rec:
-        raise Exception("Exceeded max recursion.")
-
-    assert (
-        calc_avg_degree(G) == avg_degree
-    ), f"Average degree changed from {calc_avg_degree(G)} to {avg_degree}, please check rewiring."
-    return focussed_assort_networks_gen(
-        aim_assort_values,
-        e_groups,
-        n_per_group,
-        p_rel,
-        network_gen_fn=network_gen_fn,
-        cur_rec=cur_rec + 1,
-        max_rec=max_rec,
-    )
+            print(list(ps))
+            plt.plot(ps)
+            plt.show()
+        if len(hits) == len(aims):
+            G_list = []
+            if 1.0 in aim_assort_values:
+                perm = initial_permutation(len(tsrc), e_groups)
+                G_list.append(arrays_to_graph(tsrc, tdst, perm, e_groups, n_per_group)[0])
+            for aim, hit_perm, p, q in hits:
+                print(f"adding p={aim}")
+                G_list.append(
+                    arrays_to_graph(tsrc, tdst, hit_perm, e_groups, n_per_group)[0]
+                )
+            return G_list
+    raise Exception("Exceeded max recursion.")
 
 
 def write_graph(G, mypath, predefined_name="None"):
-    if not os.path.exists(mypath):
-        os.makedirs(mypath)
-
-    onlyfiles = [
-        f for f in os.listdir(mypath) if os.path.isfile(os.path.join(mypath, f))
-    ]
-    filenumbers = [
-        int(re.sub("[^0-9]", "", fn))
-        for fn in onlyfiles
-        if any(i.isdigit() for i in fn)
-    ]
-
+    store = GraphStore(mypath)
     if predefined_name == "None":
-        if filenumbers == []:
-            fpath = os.path.join(mypath, "0.gml")
-        else:
-            fpath = os.path.join(mypath, f"{max(filenumbers)+1}.gml")
+        store.write(G)
     else:
-        fpath = os.path.join(mypath, predefined_name)
-
-    nx.write_gml(G, fpath)
+        store.write(G, name=predefined_name)
@@ -0,0 +1,199 @@
+"""Reduce long time series to display resolution before drawing.
+
+A 10000 step run drawn as a mean line and std band per `a` puts tens of
+thousands of vertices per series into a figure, while an axis is only a
+few hundred pixels wide. The functions here pick the points worth drawing:
+
+    lttb       Largest-Triangle-Three-Buckets, keeps the visual shape of a line.
+    minmax     Index of the minimum and maximum of every bucket, keeps spikes.
+    envelope   Lowest lower and highest upper bound per bucket, for bands.
+
+Buckets are equally wide in steps, or in log(step) with `log_time=True` for
+figures with a logarithmic time axis. The aggregate over runs is computed
+from the stacked (runs, steps) array of a results directory in one pass by
+`aggregate_runs`, so the cost of a figure only depends on the number of
+points drawn and not on `sim_dur`.
+"""
+import numpy as np
+import warnings
+import json
+import os
+
+
+def bucket_edges(n, n_buckets, log_time=False):
+    """Edges of at most `n_buckets` non-empty buckets over indices 0..n-1.
+
+    Args:
+        n (int): Number of points.
+        n_buckets (int): Number of buckets.
+        log_time (bool, optional): Equal width in log(index + 1) instead of index. Defaults to False.
+
+    Returns:
+        np.array: Increasing bucket edges, from 0 to n.
+    """
+    n_buckets = max(1, min(n_buckets, n))
+    if log_time:
+        edges = np.geomspace(1, n + 1, n_buckets + 1) - 1
+    else:
+        edges = np.linspace(0, n, n_buckets + 1)
+    edges = np.unique(np.round(edges).astype(np.int64))
+    edges[0], edges[-1] = 0, n
+    return np.unique(edges)
+
+
+def lttb(y, n_out, x=None, log_time=False):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. From every bucket in between
+    the point is kept that forms the largest triangle with the point kept
+    from the previous bucket and the mean of the next bucket.
+
+    Args:
+        y (np.array): Values.
+        n_out (int): Number of points to keep.
+        x (np.array, optional): Positions of the values. Defaults to the indices.
+        log_time (bool, optional): Buckets of equal width in log time. Defaults to False.
+
+    Returns:
+        np.array: Increasing indices into `y`, at most `n_out` + 2 of them.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=np.float64) if x is None else np.asarray(x, np.float64)
+
+    # Buckets over the interior points, the end points are kept as they are
+    edges = bucket_edges(n - 2, n_out - 2, log_time) + 1
+    n_buckets = len(edges) - 1
+    means_x = np.add.reduceat(x[1:-1], edges[:-1] - 1) / np.diff(edges)
+    means_y = np.add.reduceat(np.nan_to_num(y[1:-1]), edges[:-1] - 1) / np.diff(edges)
+    means_x, means_y = np.append(means_x, x[-1]), np.append(means_y, y[-1])
+
+    indices = np.empty(n_buckets + 2, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_buckets):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - means_x[i + 1]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (means_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        indices[i + 1] = a
+    return indices
+
+
+def minmax(y, n_out, log_time=False):
+    """Indices of the minimum and maximum of every bucket, `n_out` // 2 buckets.
+
+    The first and last index are always kept, so the reduced series spans
+    the same time range as `y`.
+
+    Args:
+        y (np.array): Values.
+        n_out (int): Number of points to keep.
+        log_time (bool, optional): Buckets of equal width in log time. Defaults to False.
+
+    Returns:
+        np.array: Increasing indices into `y`, at most `n_out` + 2 of them.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    edges = bucket_edges(n, max(1, n_out // 2), log_time)
+    widths = np.diff(edges)
+    bucket = np.repeat(np.arange(len(widths)), widths)
+    indices = []
+    with np.errstate(invalid="ignore"):
+        for reduce in (np.fmin, np.fmax):
+            # First step of every bucket holding its extreme, all-nan buckets have none
+            hits = np.flatnonzero(y == np.repeat(reduce.reduceat(y, edges[:-1]), widths))
+            _, first = np.unique(bucket[hits], return_index=True)
+            indices.append(hits[first])
+    return np.unique(np.concatenate(indices + [[0, n - 1]]))
+
+
+def envelope(lower, upper, n_out, log_time=False):
+    """Band reduced to `n_out` buckets, keeping its full extent.
+
+    Args:
+        lower (np.array): Lower bound per step.
+        upper (np.array): Upper bound per step.
+        n_out (int): Number of buckets.
+        log_time (bool, optional): Buckets of equal width in log time. Defaults to False.
+
+    Returns:
+        tuple: Step of every bucket start, and the lowest lower and highest upper bound in it.
+    """
+    lower, upper = np.asarray(lower, np.float64), np.asarray(upper, np.float64)
+    n = len(lower)
+    if n_out >= n:
+        return np.arange(n), lower, upper
+    edges = bucket_edges(n, n_out, log_time)
+    with np.errstate(invalid="ignore"):
+        low = np.fmin.reduceat(lower, edges[:-1])
+        high = np.fmax.reduceat(upper, edges[:-1])
+    # Close the band at the last step
+    return (
+        np.append(edges[:-1], n - 1),
+        np.append(low, lower[-1]),
+        np.append(high, upper[-1]),
+    )
+
+
+def downsample(y, n_out=1000, method="lttb", log_time=False):
+    """Indices of the points of `y` to draw.
+
+    Args:
+        y (np.array): Values.
+        n_out (int, optional): Number of points to keep. Defaults to 1000.
+        method (str, optional): "lttb" or "minmax". Defaults to "lttb".
+        log_time (bool, optional): Buckets of equal width in log time. Defaults to False.
+    """
+    if method == "lttb":
+        return lttb(y, n_out, log_time=log_time)
+    elif method == "minmax":
+        return minmax(y, n_out, log_time=log_time)
+    raise ValueError(f"Unknown downsampling method {method}, choose lttb or minmax.")
+
+
+def load_runs(path, keys):
+    """Stack the series of every run in a dyn_data directory.
+
+    Args:
+        path (str): Directory with one `<n>.json` per run, as written by `1_run_sims.py`.
+        keys (list): Series to load, e.g. ["lonely_mean", "non_lonely_mean"].
+
+    Returns:
+        dict: Per key a (runs, steps) array, shorter runs padded with nan.
+    """
+    files = sorted(f for f in os.listdir(path) if f.endswith(".json"))
+    series = {key: [] for key in keys}
+    for file in files:
+        with open(os.path.join(path, file), "r") as f:
+            data = json.load(f)
+        for key in keys:
+            series[key].append(np.asarray(data[key], dtype=np.float64))
+
+    stacked = {}
+    for key, runs in series.items():
+        length = max((len(run) for run in runs), default=0)
+        stacked[key] = np.full((len(runs), length), np.nan)
+        for i, run in enumerate(runs):
+            stacked[key][i, : len(run)] = run
+    return stacked
+
+
+def aggregate_runs(runs):
+    """Mean and std over runs of every step, of a (runs, steps) array.
+
+    Returns:
+        tuple: Mean and std per step, ignoring nan.
+    """
+    runs = np.atleast_2d(np.asarray(runs, dtype=np.float64))
+    with warnings.catch_warnings():
+        # Steps no run reached are nan
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(runs, axis=0), np.nanstd(runs, axis=0)
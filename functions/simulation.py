@@ -0,0 +1,291 @@
+from functions.metrics import (
+    pearson_arrays,
+    coleman_arrays,
+    group_labels,
+    dos_pearson,
+)
+
+import numpy as np
+import time
+
+
+def group_statistics(e, groups, counts):
+    """Mean and (population) standard deviation of the energies per group."""
+    n_groups = len(counts)
+    mean = np.bincount(groups, weights=e, minlength=n_groups) / counts
+    var = (
+        np.bincount(groups, weights=(e - mean[groups]) ** 2, minlength=n_groups)
+        / counts
+    )
+    return mean, np.sqrt(var)
+
+
+def every(k):
+    """Cadence of a hook: the initial state and every `k` steps."""
+    return lambda sim_dur: np.arange(0, sim_dur + 1, k)
+
+
+def log_spaced(n_points):
+    """Cadence of a hook: the initial state and about `n_points` log-spaced steps."""
+    return lambda sim_dur: np.unique(
+        np.concatenate([[0], np.round(np.geomspace(1, sim_dur, n_points)).astype(int)])
+    )
+
+
+def snapshots(steps):
+    """Cadence of a hook: the given steps, 0 being the initial state."""
+    return lambda sim_dur: np.unique([s for s in steps if 0 <= s <= sim_dur])
+
+
+class MetricHook:
+    """Metric evaluated on the model state during `simulate`.
+
+    Args:
+        name (str): Key of the recorded series.
+        fn (function): Called as fn(e, k, topology) with the state arrays and the `TopologyContext` of the model, returning a number, list or dict.
+        cadence (function): Steps to evaluate at, from `every`, `log_spaced` or `snapshots`.
+    """
+
+    def __init__(self, name, fn, cadence):
+        self.name = name
+        self.fn = fn
+        self.cadence = cadence
+
+    def __call__(self, e, k, topology):
+        value = self.fn(e, k, topology)
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        return value
+
+
+def pearson_hook(cadence):
+    return MetricHook(
+        "pearson", lambda e, k, top: pearson_arrays(top.src, top.dst, e), cadence
+    )
+
+
+def mean_energy_hook(cadence):
+    return MetricHook("mean_energy", lambda e, k, top: float(e.mean()), cadence)
+
+
+def coleman_hook(e_groups, cadence):
+    """Coleman index per group, with groups relabelled from the current energies."""
+    return MetricHook(
+        "coleman",
+        lambda e, k, top: coleman_arrays(
+            top.src, top.dst, group_labels(e, e_groups), n_groups=len(e_groups)
+        ),
+        cadence,
+    )
+
+
+def dos_hook(cadence, depth=4):
+    """Energy correlation per degree of separation, on the shells of the topology."""
+    return MetricHook(
+        "dos",
+        lambda e, k, top: list(dos_pearson(top.shells(depth), e).values()),
+        cadence,
+    )
+
+
+def simulate(
+    model,
+    groups,
+    sim_dur,
+    window,
+    record_pearson=True,
+    tol=1e-5,
+    memory_budget=2 * 1024**3,
+    hooks=None,
+):
+    """Run an `arrayModel` and stream per group statistics instead of storing every state.
+
+    Per step only the mean and standard deviation of `e` per group are kept,
+    so the recorder takes 2 * G * sim_dur floats regardless of the network
+    size. The run stops once the variance of every node's energy over the
+    last `window` steps is below `tol`, after which the statistics of the
+    last step are repeated up to `sim_dur`, as in `run_sims`.
+
+    The sliding window needs the last `window` states, N * window * 8 bytes.
+    When that exceeds `memory_budget` convergence is instead checked at the
+    end of every block of `window` steps from running sums, which needs no
+    history. Together with the model and the per step assortativity (about
+    50 bytes per edge in total) a network of 2 * 10^6 nodes with m = 11 runs
+    in about 1.2 GB in block mode, see `benchmarks/scaling.py`.
+
+    Metric hooks are evaluated on the state after the steps of their
+    cadence, step 0 being the initial state. After convergence the state no
+    longer changes, so the remaining steps repeat the value at convergence.
+    The time spent in the model, the recorder and every hook is reported,
+    with the hook overhead relative to the model steps.
+
+    Args:
+        model (arrayModel): Model to run.
+        groups (np.array): Group index of every node.
+        sim_dur (int): Number of steps.
+        window (int): Convergence window in steps.
+        record_pearson (bool, optional): Record the assortativity after every step. Defaults to True.
+        tol (float, optional): Variance below which a node counts as converged. Defaults to 1e-5.
+        memory_budget (int, optional): Bytes the sliding window may take. Defaults to 2 GiB.
+        hooks (list, optional): `MetricHook`s to evaluate during the run. Defaults to None.
+
+    Returns:
+        dict: `group_mean` and `group_std` of shape (G, sim_dur), `pearsons` with the initial assortativity followed by one value per simulated step, `converged_at`, the step the run stopped at or None, `hooks` with the `steps` and `values` per hook name, and `timing` in seconds.
+    """
+    counts = np.bincount(groups)
+    n_groups, n_nodes = len(counts), len(model.e)
+    group_mean = np.zeros((n_groups, sim_dur))
+    group_std = np.zeros((n_groups, sim_dur))
+    pearsons = [pearson_arrays(model.src, model.dst, model.e)] if record_pearson else []
+
+    sliding = n_nodes * window * 8 <= memory_budget
+    if sliding:
+        history = np.zeros((window, n_nodes))
+    s1, s2 = np.zeros(n_nodes), np.zeros(n_nodes)
+
+    hooks = list(hooks or [])
+    schedules = [set(hook.cadence(sim_dur).tolist()) for hook in hooks]
+    series = {hook.name: {"steps": [], "values": []} for hook in hooks}
+    timing = {"model": 0.0, "recording": 0.0, "hooks": {h.name: 0.0 for h in hooks}}
+
+    def run_hooks(steps):
+        # Evaluate the hooks due at any of `steps` once on the current state
+        for hook, schedule in zip(hooks, schedules):
+            due = [s for s in steps if s in schedule]
+            if not due:
+                continue
+            tic = time.perf_counter()
+            value = hook(model.e, model.k, model.topology)
+            timing["hooks"][hook.name] += time.perf_counter() - tic
+            series[hook.name]["steps"].extend(due)
+            series[hook.name]["values"].extend([value] * len(due))
+
+    run_hooks([0])
+    converged_at = None
+    for t in range(sim_dur):
+        tic = time.perf_counter()
+        model.next()
+        toc = time.perf_counter()
+        e = model.e
+        group_mean[:, t], group_std[:, t] = group_statistics(e, groups, counts)
+        if record_pearson:
+            pearsons.append(pearson_arrays(model.src, model.dst, e))
+        timing["model"] += toc - tic
+        timing["recording"] += time.perf_counter() - toc
+        run_hooks([t + 1])
+
+        if sliding:
+            # The window holds the states before step t
+            if t > window:
+                var = s2 / window - (s1 / window) ** 2
+                # Running sums only preselect, the decision is made on the
+                # exact variance of the window
+                if np.all(var < tol * (1 + 1e-6) + 1e-12) and np.all(
+                    np.var(history, axis=0) < tol
+                ):
+                    converged_at = t
+                    break
+            slot = t % window
+            s1 += e - history[slot]
+            s2 += e**2 - history[slot] ** 2
+            history[slot] = e
+            # Recompute the sums now and then, so rounding errors cannot pile up
+            if slot == window - 1:
+                s1, s2 = history.sum(axis=0), (history**2).sum(axis=0)
+        else:
+            s1 += e
+            s2 += e**2
+            if (t + 1) % window == 0:
+                if t + 1 > window and np.all(s2 / window - (s1 / window) ** 2 < tol):
+                    converged_at = t
+                    break
+                s1[:], s2[:] = 0, 0
+
+    if converged_at is not None:
+        group_mean[:, converged_at:] = group_mean[:, [converged_at]]
+        group_std[:, converged_at:] = group_std[:, [converged_at]]
+        run_hooks(range(converged_at + 2, sim_dur + 1))
+    timing["hook_overhead"] = (
+        sum(timing["hooks"].values()) / timing["model"] if timing["model"] else 0.0
+    )
+    return {
+        "group_mean": group_mean,
+        "group_std": group_std,
+        "pearsons": pearsons,
+        "converged_at": converged_at,
+        "hooks": series,
+        "timing": timing,
+    }
+
+
+def simulate_batch(model, sim_dur, window, tol=1e-5):
+    """Run a `batchModel` until every point converged, or for `sim_dur` steps.
+
+    Convergence is checked per point as in the block mode of `simulate`:
+    at the end of every block of `window` steps, from running sums, a point
+    converged when the variance of every node's energy over the block is
+    below `tol`. Converged points are frozen, so the remaining steps only
+    cost the points still changing.
+
+    Args:
+        model (batchModel): Model to run.
+        sim_dur (int): Number of steps.
+        window (int): Convergence window in steps.
+        tol (float, optional): Variance below which a node counts as converged. Defaults to 1e-5.
+
+    Returns:
+        dict: `e` and `k`, the (P, N) final states, `converged_at` per point, nan when it ran for the full duration, and `timing` in seconds.
+    """
+    n_points = len(model.e)
+    active = np.ones(n_points, dtype=bool)
+    converged_at = np.full(n_points, np.nan)
+    s1, s2 = np.zeros(model.e.shape), np.zeros(model.e.shape)
+
+    tic = time.perf_counter()
+    for t in range(sim_dur):
+        model.next(active)
+        s1 += model.e
+        s2 += model.e**2
+        if (t + 1) % window == 0:
+            if t + 1 > window:
+                var = s2 / window - (s1 / window) ** 2
+                done = active & np.all(var < tol, axis=1)
+                converged_at[done] = t
+                active &= ~done
+                if not active.any():
+                    break
+            s1[:], s2[:] = 0, 0
+    return {
+        "e": model.e,
+        "k": model.k,
+        "converged_at": converged_at,
+        "timing": {"model": time.perf_counter() - tic},
+    }
+
+
+def dyn_data(result):
+    """Dynamics data as written to `dyn_data`.
+
+    Two group runs keep the original keys, the first group being the lonely
+    one. Runs with more groups store the statistics of every group.
+    """
+    if result["group_mean"].shape[0] == 2:
+        data = {
+            "non_lonely_mean": result["group_mean"][1].tolist(),
+            "non_lonely_std": result["group_std"][1].tolist(),
+            "lonely_mean": result["group_mean"][0].tolist(),
+            "lonely_std": result["group_std"][0].tolist(),
+            "pearsons": result["pearsons"],
+        }
+    else:
+        data = {
+            "group_mean": result["group_mean"].tolist(),
+            "group_std": result["group_std"].tolist(),
+            "pearsons": result["pearsons"],
+        }
+    if "converged_at" in result:
+        data["converged_at"] = result["converged_at"]
+    # Hook series only when the run had any, so plain runs keep their keys
+    if result.get("hooks"):
+        data["hooks"] = result["hooks"]
+    return data
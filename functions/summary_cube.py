@@ -0,0 +1,307 @@
+"""Labelled N-dimensional summary of all processed runs.
+
+The figures need statistics over runs per simulation setting, which the
+notebook used to rebuild from raw files into nested dicts (and ad-hoc JSON
+dumps) every time. `build_cube` reduces the processed datasets written by
+`2_analysis.py` once into two labelled arrays
+
+    dos      (config, noise, beta, sim_dur, a, point, distance, statistic)
+    metrics  (config, noise, beta, sim_dur, a, point, metric, statistic)
+
+with statistic one of STATISTICS, and cells without runs nan. A cube is
+saved as a directory holding `cube.json` (dimensions, coordinates and
+provenance: the datasets it was built from with a hash of their inputs,
+the analysis version, the code commit and the build time) and one `.npy`
+chunk per variable and config, which `SummaryCube.open` memory maps, so a
+slice only reads the chunks it touches.
+
+Usage:
+    python -m functions.summary_cube <processed_root> [<cube_path>]
+"""
+from functions.misc import bootstrap
+
+from datetime import datetime, timezone
+import pandas as pd
+import numpy as np
+import subprocess
+import hashlib
+import json
+import sys
+import re
+import os
+
+LEADING_DIMS = ["config", "noise", "beta", "sim_dur", "a", "point"]
+STATISTICS = ["mean", "std", "se", "ci_low", "ci_high", "n"]
+DOS_METRIC = re.compile(r"dos_(?P<distance>\d+)")
+VERSION_DIR = re.compile(r"v(?P<version>\d+)")
+
+
+def _coordinate(values):
+    # Sorted unique values, None (no noise/beta recorded) last
+    values = [None if pd.isna(v) else getattr(v, "item", lambda: v)() for v in values]
+    present = sorted({v for v in values if v is not None})
+    return present + ([None] if None in values else [])
+
+
+def _statistics(values, seed=0):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n == 0:
+        return [np.nan] * 5 + [0]
+    std = np.std(values, ddof=1) if n > 1 else np.nan
+    if n > 1:
+        ci = bootstrap(values, 1000, seed=seed, processes=1)
+        low, high = ci["low"], ci["high"]
+    else:
+        low = high = np.nan
+    return [values.mean(), std, std / np.sqrt(n), low, high, n]
+
+
+class SummaryCube:
+    """Statistics over runs, as labelled arrays.
+
+    Args:
+        coords (dict): Coordinate values per dimension.
+        variables (dict): Per variable its dimension names and (memory mapped) chunks, one per config.
+        provenance (dict): Where the cube came from.
+    """
+
+    def __init__(self, coords, variables, provenance):
+        self.coords = coords
+        self.variables = variables
+        self.provenance = provenance
+
+    def dims(self, variable):
+        return self.variables[variable]["dims"]
+
+    def _index(self, dim, value):
+        coord = self.coords[dim]
+        if value is None:
+            matches = [i for i, c in enumerate(coord) if c is None]
+        elif dim == "point":
+            # Points are stored as the string of their float list, so
+            # [1, 0, 0] and "[1, 0, 0]" match "[1.0, 0.0, 0.0]"
+            if isinstance(value, str):
+                value = json.loads(value)
+            value = str([float(p) for p in value])
+            matches = [i for i, c in enumerate(coord) if c == value]
+        elif isinstance(value, str):
+            matches = [i for i, c in enumerate(coord) if c == value]
+        else:
+            matches = [
+                i
+                for i, c in enumerate(coord)
+                if c is not None and not isinstance(c, str) and np.isclose(c, value)
+            ]
+        if not matches:
+            raise KeyError(f"{value!r} not in {dim} coordinates {coord}")
+        return matches[0]
+
+    def sel(self, variable, **selection):
+        """Slice of a variable, selecting one coordinate value per given dimension.
+
+        Points are given as lists or as their string form, e.g. [1, 0, 0] or "[1.0, 0.0, 0.0]".
+
+        Returns:
+            tuple: The array over the remaining dimensions, and their names.
+        """
+        dims = self.dims(variable)
+        unknown = set(selection) - set(dims)
+        if unknown:
+            raise ValueError(f"Unknown dimensions {unknown}, {variable} has {dims}.")
+        index = [
+            self._index(dim, selection[dim]) if dim in selection else slice(None)
+            for dim in dims
+        ]
+        chunks = self.variables[variable]["chunks"]
+        if isinstance(index[0], int):
+            values = np.asarray(chunks[index[0]][tuple(index[1:])])
+        else:
+            values = np.stack([np.asarray(c[tuple(index[1:])]) for c in chunks])
+        return values, [dim for dim in dims if dim not in selection]
+
+    def to_frame(self, variable, **selection):
+        """Slice of a variable as a tidy DataFrame, one row per cell with runs."""
+        values, dims = self.sel(variable, **selection)
+        grid = pd.MultiIndex.from_product([self.coords[d] for d in dims], names=dims)
+        frame = pd.DataFrame({"value": values.ravel()}, index=grid).reset_index()
+        if "statistic" in dims:
+            frame = frame.pivot_table(
+                index=[d for d in dims if d != "statistic"],
+                columns="statistic",
+                values="value",
+                dropna=False,
+            ).reset_index()
+            frame.columns.name = None
+            keys = [d for d in dims if d != "statistic"]
+            frame = frame[keys + [s for s in self.coords["statistic"]]]
+            frame = frame[frame["n"] > 0]
+        return frame
+
+    def save(self, path):
+        """Write the cube to a directory, one `.npy` chunk per variable and config."""
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for variable, spec in self.variables.items():
+            var_path = os.path.join(path, variable)
+            if not os.path.exists(var_path):
+                os.makedirs(var_path)
+            for c, chunk in enumerate(spec["chunks"]):
+                tmp_path = os.path.join(var_path, f"{c}.{os.getpid()}.tmp.npy")
+                np.save(tmp_path, np.asarray(chunk))
+                os.replace(tmp_path, os.path.join(var_path, f"{c}.npy"))
+        meta = {
+            "coords": self.coords,
+            "variables": {v: {"dims": s["dims"]} for v, s in self.variables.items()},
+            "provenance": self.provenance,
+        }
+        # The metadata is written last, so a cube is only complete once it exists
+        with open(os.path.join(path, "cube.json.tmp"), "w") as f:
+            json.dump(meta, f, indent=4)
+        os.replace(os.path.join(path, "cube.json.tmp"), os.path.join(path, "cube.json"))
+
+    @classmethod
+    def open(cls, path):
+        """Open a saved cube, memory mapping its chunks."""
+        with open(os.path.join(path, "cube.json"), "r") as f:
+            meta = json.load(f)
+        n_configs = len(meta["coords"]["config"])
+        variables = {
+            variable: {
+                "dims": spec["dims"],
+                "chunks": [
+                    np.load(os.path.join(path, variable, f"{c}.npy"), mmap_mode="r")
+                    for c in range(n_configs)
+                ],
+            }
+            for variable, spec in meta["variables"].items()
+        }
+        return cls(meta["coords"], variables, meta["provenance"])
+
+
+def find_datasets(processed_root):
+    """Latest version of the processed dataset of every config below `processed_root`.
+
+    Returns:
+        dict: Per config the path of its dataset directory.
+    """
+    datasets = {}
+    for config in sorted(os.listdir(processed_root)):
+        config_path = os.path.join(processed_root, config)
+        if not os.path.isdir(config_path):
+            continue
+        versions = [
+            int(m["version"])
+            for d in os.listdir(config_path)
+            if (m := VERSION_DIR.fullmatch(d))
+            and os.path.exists(os.path.join(config_path, d, "runs.csv"))
+        ]
+        if versions:
+            datasets[config] = os.path.join(config_path, f"v{max(versions)}")
+    return datasets
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_cube(datasets):
+    """Reduce processed datasets to a `SummaryCube`.
+
+    Args:
+        datasets (dict): Per config the dataset directory written by `2_analysis.py`.
+    """
+    frames, sources = [], {}
+    for config, path in datasets.items():
+        runs = pd.read_csv(os.path.join(path, "runs.csv"))
+        frames.append(runs.assign(config=config))
+        with open(os.path.join(path, "inputs.json"), "rb") as f:
+            inputs_hash = hashlib.sha1(f.read()).hexdigest()
+        sources[config] = {
+            "path": path,
+            "analysis_version": int(VERSION_DIR.fullmatch(os.path.basename(path))["version"]),
+            "inputs_sha1": inputs_hash,
+            "rows": len(runs),
+        }
+    if not frames:
+        raise ValueError("No processed datasets to build a summary cube from.")
+    runs = pd.concat(frames, ignore_index=True)
+
+    coords = {dim: _coordinate(runs[dim]) for dim in LEADING_DIMS}
+    coords["point"] = [str(p) for p in coords["point"]]
+    dos = runs["metric"].str.fullmatch(DOS_METRIC.pattern)
+    coords["distance"] = sorted(
+        {int(DOS_METRIC.fullmatch(m)["distance"]) for m in runs["metric"][dos]}
+    )
+    coords["metric"] = sorted(set(runs["metric"][~dos]))
+    coords["statistic"] = STATISTICS
+
+    shape = [len(coords[dim]) for dim in LEADING_DIMS]
+    cubes = {
+        "dos": np.full(shape + [len(coords["distance"]), len(STATISTICS)], np.nan),
+        "metrics": np.full(shape + [len(coords["metric"]), len(STATISTICS)], np.nan),
+    }
+    cubes["dos"][..., -1] = cubes["metrics"][..., -1] = 0
+
+    position = {
+        dim: {value: i for i, value in enumerate(coords[dim])}
+        for dim in LEADING_DIMS + ["distance", "metric"]
+    }
+    keys = LEADING_DIMS + ["metric"]
+    for key, group in runs.groupby(keys, dropna=False, sort=False)["value"]:
+        cell = tuple(
+            position[dim][None if pd.isna(v) else (str(v) if dim == "point" else v)]
+            for dim, v in zip(LEADING_DIMS, key[:-1])
+        )
+        match = DOS_METRIC.fullmatch(key[-1])
+        if match is not None:
+            target = cubes["dos"][cell][position["distance"][int(match["distance"])]]
+        else:
+            target = cubes["metrics"][cell][position["metric"][key[-1]]]
+        target[:] = _statistics(group.to_numpy())
+
+    provenance = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "sources": sources,
+    }
+    variables = {
+        name: {
+            "dims": LEADING_DIMS + [extra, "statistic"],
+            "chunks": list(cube),
+        }
+        for name, cube, extra in (
+            ("dos", cubes["dos"], "distance"),
+            ("metrics", cubes["metrics"], "metric"),
+        )
+    }
+    return SummaryCube(coords, variables, provenance)
+
+
+def main(processed_root, cube_path=None):
+    cube_path = cube_path or os.path.join(processed_root, "summary_cube")
+    datasets = find_datasets(processed_root)
+    cube = build_cube(datasets)
+    cube.save(cube_path)
+    print(f"Wrote summary cube of {len(datasets)} configs to {cube_path}.")
+    return cube
+
+
+if __name__ == "__main__":
+    if not 2 <= (args_count := len(sys.argv)) <= 3:
+        print(__doc__)
+        raise SystemExit(2)
+    if not os.path.exists(sys.argv[1]):
+        print(f"Given processed data root does not exits: {sys.argv[1]}")
+        raise SystemExit(2)
+    main(*sys.argv[1:])
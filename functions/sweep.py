@@ -0,0 +1,504 @@
+"""Sweep the model over points of the (pc, pb, pec) simplex.
+
+The points come from `simplex_points`: a barycentric grid of a given
+resolution r (every point whose coordinates are multiples of 1/r, (r + 1)(r
++ 2) / 2 of them), or n Sobol or Latin hypercube samples of the unit square
+mapped uniformly onto the simplex. Every t0 network of every a in the
+config, found in the layout written by `0_network_gen.py`
+
+    <root>/t0_graphs/<config>/<a>/<n>.gml
+
+is one task of a process pool, in which all points not yet simulated on
+that network run together, `batch_size` at a time, as a `batchModel`. The
+outcomes of every point (final group means, assortativity, Coleman index per
+group and the step it converged at) are stored per network in
+
+    <output>/<config>/<a>/<n>.json
+
+keyed by the point as "pc,pb,pec", next to the simulation parameters they
+were computed with. Points already present with the same parameters are not
+simulated again, so a sweep can be extended with more points later.
+`SweepResults.load` collects the outcomes of one a over all networks keyed
+for ternary plotting, e.g. for `plot_triangle_heatmap`.
+
+With points method "adaptive" the config's points hold the arguments of
+`adaptive_sweep`, which starts from a coarse grid and only refines the
+cells of the simplex where the chosen outcome changes fastest, within a
+budget of simulations.
+
+Usage:
+    python -m functions.sweep <conf_file> <raw_data_root> <output_folder> [processes]
+"""
+from functions.topology import TopologyContext
+from functions.model import batchModel
+from functions.simulation import simulate_batch
+from functions.metrics import coleman_arrays, group_labels
+
+from multiprocessing import Pool
+from types import SimpleNamespace
+from scipy.stats import qmc
+import numpy as np
+import warnings
+import zlib
+import json
+import sys
+import re
+import os
+
+SIM_PARAMETERS = ["beta", "h", "noise_std", "sim_dur", "window", "seed"]
+
+
+def barycentric_grid(resolution):
+    """All points of the simplex whose coordinates are multiples of 1 / `resolution`.
+
+    Returns:
+        np.array: ((resolution + 1)(resolution + 2) / 2, 3) points (pc, pb, pec).
+    """
+    i, j = np.triu_indices(resolution + 1)
+    # Pairs i <= j split [0, resolution] into three parts
+    counts = np.stack([i, j - i, resolution - j], axis=1)
+    return counts / resolution
+
+
+def square_to_simplex(u):
+    """Map points of the unit square uniformly onto the simplex.
+
+    Args:
+        u (np.array): (n, 2) points in [0, 1)^2.
+
+    Returns:
+        np.array: (n, 3) points (pc, pb, pec).
+    """
+    u = np.asarray(u, dtype=np.float64)
+    r = np.sqrt(u[:, 0])
+    return np.stack([1 - r, r * (1 - u[:, 1]), r * u[:, 1]], axis=1)
+
+
+def simplex_points(method="grid", resolution=10, n=256, seed=0):
+    """Points of a sweep.
+
+    Args:
+        method (str, optional): "grid" for a barycentric grid, "sobol" or "lhs" for samples. Defaults to "grid".
+        resolution (int, optional): Resolution of the grid. Defaults to 10.
+        n (int, optional): Number of samples. Defaults to 256.
+        seed (int, optional): Seed of the samples. Defaults to 0.
+
+    Returns:
+        np.array: (P, 3) points (pc, pb, pec), rounded to 6 decimals.
+    """
+    if method == "grid":
+        points = barycentric_grid(resolution)
+    elif method == "sobol":
+        with warnings.catch_warnings():
+            # Balance is only guaranteed for powers of two, any n is fine here
+            warnings.simplefilter("ignore", category=UserWarning)
+            points = square_to_simplex(qmc.Sobol(d=2, seed=seed).random(n))
+    elif method == "lhs":
+        points = square_to_simplex(qmc.LatinHypercube(d=2, seed=seed).random(n))
+    else:
+        raise ValueError(f"Unknown point method {method}, choose grid, sobol or lhs.")
+    return np.round(points, 6)
+
+
+def point_key(point):
+    """Key of a point in the results, "pc,pb,pec" as `plot_triangle_heatmap` parses it."""
+    return ",".join(str(float(np.round(p, 6))) for p in point)
+
+
+def point_outcomes(topology, e, e_samples):
+    """Outcomes of a batch of final states of the same network.
+
+    Args:
+        topology (TopologyContext): Network the states are on, with its group labels.
+        e (np.array): (P, N) final energies.
+        e_samples (list): Initial energy of every group.
+
+    Returns:
+        dict: Per outcome a (P,) array, the group means as `lonely_mean` and `non_lonely_mean` for two groups.
+    """
+    groups = topology.groups
+    n_groups = len(e_samples)
+    counts = np.bincount(groups, minlength=n_groups)
+    one_hot = np.eye(n_groups)[groups]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (e @ one_hot) / counts
+
+    # Pearson correlation of the energies at both ends of the edges, per row
+    x, y = e[:, topology.src], e[:, topology.dst]
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        assortativity = (x * y).sum(axis=1) / np.sqrt(
+            (x**2).sum(axis=1) * (y**2).sum(axis=1)
+        )
+    # Constant energies count as perfectly assortative, as in `pearson_arrays`
+    constant = ~np.any(x, axis=1) & ~np.any(y, axis=1)
+    assortativity = np.where(constant, 1.0, np.round(assortativity, 5))
+
+    coleman = coleman_arrays(
+        topology.src, topology.dst, group_labels(e, e_samples), n_groups
+    )
+    outcomes = {}
+    if n_groups == 2:
+        outcomes["lonely_mean"], outcomes["non_lonely_mean"] = means.T
+    else:
+        outcomes.update({f"group_{g}_mean": means[:, g] for g in range(n_groups)})
+    outcomes["assortativity"] = assortativity
+    outcomes.update({f"coleman_{g}": coleman[:, g] for g in range(n_groups)})
+    return outcomes
+
+
+def _parameters(conf):
+    return {p: conf[p] for p in SIM_PARAMETERS}
+
+
+def _load_results(path, parameters):
+    # Outcomes per point key, empty when missing or from other parameters
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        results = json.load(f)
+    if results.get("parameters") != parameters:
+        return {}
+    return results["points"]
+
+
+def _write_results(path, parameters, points):
+    with open(path + ".tmp", "w") as f:
+        json.dump({"parameters": parameters, "points": points}, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def run_network(task):
+    """Simulate the points missing from the results of one network.
+
+    Args:
+        task (tuple): The sweep config, a, path of the t0 network, path of its results and the (P, 3) points.
+
+    Returns:
+        tuple: Results path and the number of points simulated.
+    """
+    conf, a, t0_path, results_path, points = task
+    parameters = _parameters(conf)
+    results = _load_results(results_path, parameters)
+    missing = [p for p in points if point_key(p) not in results]
+    if not missing:
+        return results_path, 0
+
+    topology = TopologyContext.for_t0(t0_path, conf["e_samples"], depth=0)
+    # Seeded per network and point, so the outcome of a point does not
+    # depend on the batch it ran in or on the points simulated before it
+    network = zlib.crc32(os.path.relpath(t0_path, conf["t0_root"]).encode())
+    batch_size = conf.get("batch_size", 256)
+    for start in range(0, len(missing), batch_size):
+        batch = np.array(missing[start : start + batch_size])
+        rngs = [
+            np.random.default_rng(
+                [conf["seed"], network, zlib.crc32(point_key(point).encode())]
+            )
+            for point in batch
+        ]
+        model = batchModel(
+            topology, batch, conf["h"], conf["beta"], conf["noise_std"], rng=rngs
+        )
+        result = simulate_batch(model, conf["sim_dur"], conf["window"])
+        outcomes = point_outcomes(topology, result["e"], conf["e_samples"])
+        outcomes["converged_at"] = result["converged_at"]
+        for i, point in enumerate(batch):
+            results[point_key(point)] = {
+                "point": point.tolist(),
+                **{
+                    name: None if np.isnan(values[i]) else float(values[i])
+                    for name, values in outcomes.items()
+                },
+            }
+        # Written after every batch, so an interrupted sweep keeps its progress
+        _write_results(results_path, parameters, results)
+    return results_path, len(missing)
+
+
+def config_path(conf):
+    return f"{conf['network_gen_fn']}-{conf['e_samples']}es-{conf['n_per_group']}n-{conf['p_rel']}p"
+
+
+def sweep(conf, points, output_folder, processes=None):
+    """Simulate `points` on every t0 network of every a in the config.
+
+    Args:
+        conf (dict): Sweep config, with `t0_root` the folder holding `t0_graphs`.
+        points (np.array or dict): (P, 3) points, or per a its own points.
+        output_folder (str): Where the results go.
+        processes (int, optional): Worker processes. Defaults to the number of cpus.
+
+    Returns:
+        int: Number of point simulations run.
+    """
+    conf_path = config_path(conf)
+    tasks = []
+    for a in conf["a_s"]:
+        t0_dir = os.path.join(conf["t0_root"], "t0_graphs", conf_path, str(a))
+        results_dir = os.path.join(output_folder, conf_path, str(a))
+        os.makedirs(results_dir, exist_ok=True)
+        a_points = points[a] if isinstance(points, dict) else points
+        a_points = [np.asarray(p, dtype=np.float64) for p in a_points]
+        files = sorted(f for f in os.listdir(t0_dir) if f.endswith(".gml"))
+        for file in files:
+            results_path = os.path.join(results_dir, file.replace(".gml", ".json"))
+            tasks.append((conf, a, os.path.join(t0_dir, file), results_path, a_points))
+
+    n_simulated = 0
+    with Pool(processes) as pool:
+        for _, n in pool.imap_unordered(run_network, tasks):
+            n_simulated += n
+    print(f"Simulated {n_simulated} points on {len(tasks)} networks.")
+    return n_simulated
+
+
+class SweepResults:
+    """Outcomes of a sweep at one a, per point over all networks.
+
+    Args:
+        outcomes (dict): Per point key the outcomes of every network, as {outcome: [values]}.
+        n_bootstrap_resample (int, optional): Resamples `plot_triangle_heatmap` bootstraps with. Defaults to 1000.
+    """
+
+    def __init__(self, outcomes, n_bootstrap_resample=1000):
+        self.outcomes = outcomes
+        self.conf = SimpleNamespace(n_bootstrap_resample=n_bootstrap_resample)
+
+    @property
+    def points(self):
+        return np.array([[float(p) for p in key.split(",")] for key in self.outcomes]).reshape(-1, 3)
+
+    @property
+    def coleman(self):
+        """Per point key the Coleman index of every group in every network, as `plot_triangle_heatmap` expects."""
+        coleman = {}
+        for key, o in self.outcomes.items():
+            groups = sorted(
+                (name for name in o if re.fullmatch(r"coleman_\d+", name)),
+                key=lambda name: int(name.split("_")[1]),
+            )
+            coleman[key] = [list(values) for values in zip(*(o[g] for g in groups))]
+        return coleman
+
+    def values(self, outcome):
+        """Per point key the values of `outcome` in every network, nan where undefined."""
+        return {
+            key: [np.nan if v is None else v for v in o[outcome]]
+            for key, o in self.outcomes.items()
+        }
+
+    @classmethod
+    def load(cls, output_folder, conf, a, n_bootstrap_resample=1000):
+        """Collect the results of all networks at `a`, for the parameters of `conf`."""
+        results_dir = os.path.join(output_folder, config_path(conf), str(a))
+        parameters = _parameters(conf)
+        outcomes = {}
+        for file in sorted(f for f in os.listdir(results_dir) if f.endswith(".json")):
+            points = _load_results(os.path.join(results_dir, file), parameters)
+            for key, values in points.items():
+                merged = outcomes.setdefault(key, {})
+                for name, value in values.items():
+                    if name != "point":
+                        merged.setdefault(name, []).append(value)
+        return cls(outcomes, n_bootstrap_resample)
+
+
+def _grid_cells(resolution, scale):
+    # Triangles of the barycentric grid, with every vertex as its integer
+    # (pc, pb) coordinates out of resolution * scale
+    cells = []
+    for x in range(resolution):
+        for y in range(resolution - x):
+            cells.append(((x, y), (x + 1, y), (x, y + 1)))
+            if x + y <= resolution - 2:
+                cells.append(((x + 1, y), (x, y + 1), (x + 1, y + 1)))
+    return [tuple((x * scale, y * scale) for x, y in cell) for cell in cells]
+
+
+def _subdivide(cell):
+    # The four triangles between the vertices and edge midpoints of a cell
+    v0, v1, v2 = cell
+    m01, m12, m02 = (
+        tuple((p + q) // 2 for p, q in zip(u, v)) for u, v in ((v0, v1), (v1, v2), (v0, v2))
+    )
+    return [(v0, m01, m02), (m01, v1, m12), (m02, m12, v2), (m01, m12, m02)]
+
+
+def _vertex_point(vertex, denominator):
+    x, y = vertex
+    return np.array([x, y, denominator - x - y]) / denominator
+
+
+def _point_statistics(results, outcome):
+    # Mean and standard error over networks per point key
+    statistics = {}
+    for key, values in results.values(outcome).items():
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        n = len(values)
+        mean = values.mean() if n else np.nan
+        se = values.std(ddof=1) / np.sqrt(n) if n > 1 else np.nan
+        statistics[key] = (mean, se)
+    return statistics
+
+
+def adaptive_sweep(
+    conf,
+    output_folder,
+    outcome="coleman_0",
+    resolution=4,
+    max_depth=4,
+    threshold=0.1,
+    se_threshold=None,
+    budget=10000,
+    processes=None,
+):
+    """Sweep that refines the simplex where `outcome` changes fastest.
+
+    Starts with the barycentric grid of `resolution`, split into triangular
+    cells. After every round of simulations a cell is a candidate for
+    refinement when the means of `outcome` at its vertices differ by more
+    than `threshold`, or when the standard error over networks at one of
+    them exceeds `se_threshold`. Candidates of all a are refined in order of
+    their variation, by splitting them into four at their edge midpoints,
+    for as long as the simulations of the new points fit in `budget`. A cell
+    is split at most `max_depth` times, so the finest spacing is that of a
+    grid of resolution * 2^max_depth. Rounds stop when no cell is refined.
+
+    The results are those of `sweep`, so an interrupted or repeated
+    adaptive sweep only simulates points it has no results for, and takes
+    the same refinement steps from them. The final cells per a are written
+    to `<output>/<config>/adaptive_cells.json`, as triples of point keys.
+
+    Args:
+        conf (dict): Sweep config, with `t0_root` the folder holding `t0_graphs`.
+        output_folder (str): Where the results go.
+        outcome (str, optional): Outcome to refine on, e.g. "coleman_0", "assortativity" or "lonely_mean". Defaults to "coleman_0".
+        resolution (int, optional): Resolution of the initial grid. Defaults to 4.
+        max_depth (int, optional): Number of times a cell may be split. Defaults to 4.
+        threshold (float, optional): Difference of the vertex means above which a cell is split. Defaults to 0.1.
+        se_threshold (float, optional): Standard error above which a cell is split, None to only use the variation. Defaults to None.
+        budget (int, optional): Total number of point simulations, points times networks over all a. Defaults to 10000.
+        processes (int, optional): Worker processes. Defaults to the number of cpus.
+
+    Returns:
+        dict: Per a the final cells, as (3, 3) arrays of points.
+    """
+    conf_path = config_path(conf)
+    n_networks = {
+        a: len(
+            [
+                f
+                for f in os.listdir(os.path.join(conf["t0_root"], "t0_graphs", conf_path, str(a)))
+                if f.endswith(".gml")
+            ]
+        )
+        for a in conf["a_s"]
+    }
+    scale = 2**max_depth
+    denominator = resolution * scale
+    cells = {a: [(cell, 0) for cell in _grid_cells(resolution, scale)] for a in conf["a_s"]}
+    vertices = {a: {v for cell, _ in cells[a] for v in cell} for a in conf["a_s"]}
+    used = sum(len(vertices[a]) * n_networks[a] for a in conf["a_s"])
+    if used > budget:
+        raise ValueError(
+            f"The initial grid takes {used} simulations, more than the budget of {budget}."
+        )
+
+    def key(vertex):
+        return point_key(_vertex_point(vertex, denominator))
+
+    for step in range(max_depth + 1):
+        points = {
+            a: [_vertex_point(v, denominator) for v in sorted(vertices[a])]
+            for a in conf["a_s"]
+        }
+        sweep(conf, points, output_folder, processes)
+        if step == max_depth:
+            break
+
+        candidates = []
+        for a in conf["a_s"]:
+            statistics = _point_statistics(
+                SweepResults.load(output_folder, conf, a), outcome
+            )
+            for i, (cell, depth) in enumerate(cells[a]):
+                if depth >= max_depth:
+                    continue
+                means, ses = np.array([statistics.get(key(v), (np.nan, np.nan)) for v in cell]).T
+                variation = np.nanmax(means) - np.nanmin(means) if not np.isnan(means).all() else np.nan
+                uncertain = se_threshold is not None and np.nanmax(ses, initial=-np.inf) > se_threshold
+                if variation > threshold or uncertain:
+                    candidates.append((np.nan_to_num(variation, nan=np.inf), a, i))
+
+        # Fastest changing cells first, over all a
+        refined = {a: set() for a in conf["a_s"]}
+        for _, a, i in sorted(candidates, key=lambda c: -c[0]):
+            children = _subdivide(cells[a][i][0])
+            new = {v for child in children for v in child} - vertices[a]
+            cost = len(new) * n_networks[a]
+            if used + cost > budget:
+                continue
+            used += cost
+            vertices[a] |= new
+            refined[a].add(i)
+        if not any(refined.values()):
+            break
+        for a in conf["a_s"]:
+            depth_of = {i: cells[a][i][1] for i in refined[a]}
+            cells[a] = [c for i, c in enumerate(cells[a]) if i not in refined[a]] + [
+                (child, depth_of[i] + 1)
+                for i in sorted(refined[a])
+                for child in _subdivide(cells[a][i][0])
+            ]
+        print(
+            f"Refined {sum(map(len, refined.values()))} cells, {used} of {budget} simulations used."
+        )
+
+    cells_path = os.path.join(output_folder, conf_path, "adaptive_cells.json")
+    with open(cells_path + ".tmp", "w") as f:
+        json.dump(
+            {str(a): [[key(v) for v in cell] for cell, _ in cells[a]] for a in conf["a_s"]},
+            f,
+            indent=4,
+        )
+    os.replace(cells_path + ".tmp", cells_path)
+    return {
+        a: np.array([[_vertex_point(v, denominator) for v in cell] for cell, _ in cells[a]])
+        for a in conf["a_s"]
+    }
+
+
+def load_conf(conf_file, t0_root):
+    with open(conf_file, "r") as f:
+        conf = json.load(f)
+    conf.setdefault("seed", 0)
+    conf["window"] = conf.get("window", int(conf["sim_dur"] * 0.1))
+    conf["t0_root"] = str(t0_root)
+    return conf
+
+
+def main(conf_file, t0_root, output_folder, processes=None):
+    conf = load_conf(conf_file, t0_root)
+    if conf["points"].get("method") == "adaptive":
+        settings = {k: v for k, v in conf["points"].items() if k != "method"}
+        return adaptive_sweep(conf, output_folder, processes=processes, **settings)
+    points = simplex_points(**conf["points"])
+    print(f"Sweeping {len(points)} points over {len(conf['a_s'])} values of a.")
+    return sweep(conf, points, output_folder, processes)
+
+
+if __name__ == "__main__":
+    if not 4 <= (args_count := len(sys.argv)) <= 5:
+        print(__doc__)
+        raise SystemExit(2)
+    if not os.path.exists(sys.argv[1]):
+        print(f"Given configuration file does not exits: {sys.argv[1]}")
+        raise SystemExit(2)
+    if not os.path.exists(sys.argv[2]):
+        print(f"Given raw data root does not exits: {sys.argv[2]}")
+        raise SystemExit(2)
+    processes = int(sys.argv[4]) if args_count == 5 else None
+    main(sys.argv[1], sys.argv[2], sys.argv[3], processes)
@@ -0,0 +1,213 @@
+from functions.metrics import dos_shells, group_labels
+
+from scipy import sparse
+import networkx as nx
+import numpy as np
+import hashlib
+import json
+import os
+
+
+class TopologyContext:
+    """Everything derived from the topology of a network, computed once.
+
+    The model never changes edges, so the edge arrays, in/out adjacency,
+    degree vectors, degree of separation shells and group labels of a t0
+    network are the same for every point, sim_dur and analysis run on it.
+    `arrayModel` and the shell based metrics (`get_DOS`, `dos_neighbors`)
+    accept a context instead of rebuilding these, and `for_t0` keeps it in
+    `.topology_cache/` (`TOPOLOGY_CACHE_DIR` overrides the location) so it is
+    built once per t0 network. The t0 directories themselves only hold GML.
+
+    Args:
+        src (np.array): Source node of every edge.
+        dst (np.array): Target node of every edge.
+        n_nodes (int): Number of nodes.
+        nodes (list, optional): Node label of every index. Defaults to the indices.
+        e0 (np.array, optional): Initial energy per node. Defaults to None.
+        k0 (np.array, optional): Initial connectivity per node. Defaults to None.
+        groups (np.array, optional): Group index of every node. Defaults to None.
+        shells (list, optional): Precomputed shells, from `dos_shells`. Defaults to None.
+    """
+
+    def __init__(
+        self, src, dst, n_nodes, nodes=None, e0=None, k0=None, groups=None, shells=None
+    ):
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        self.n_nodes = n = int(n_nodes)
+        self.nodes = list(range(n)) if nodes is None else list(nodes)
+        self.e0 = None if e0 is None else np.asarray(e0, dtype=np.float64)
+        self.k0 = None if k0 is None else np.asarray(k0, dtype=np.float64)
+        self.groups = None if groups is None else np.asarray(groups, dtype=np.int64)
+        self._shells = list(shells) if shells else []
+        self._cache_key = None
+
+        # Row i of the in-adjacency holds the nodes with an edge towards i
+        self.A_in = sparse.csr_matrix(
+            (np.ones(len(self.src)), (self.dst, self.src)), shape=(n, n)
+        )
+        self.A_in.sum_duplicates()
+        self._A_out = None
+        self.in_degree = np.bincount(self.dst, minlength=n)
+        self.out_degree = np.bincount(self.src, minlength=n)
+        self.has_in = self.in_degree != 0
+        self.inv_in_degree = np.zeros(n)
+        self.inv_in_degree[self.has_in] = 1 / self.in_degree[self.has_in]
+        self.inv_out_degree = np.zeros(n)
+        has_out = self.out_degree != 0
+        self.inv_out_degree[has_out] = 1 / self.out_degree[has_out]
+
+    @classmethod
+    def from_graph(cls, G, e_groups=None, depth=None):
+        """Build the context of a networkx graph, keeping its node order.
+
+        Args:
+            G (nx.DiGraph): Graph of network, nodes holding `e` and `k` when present.
+            e_groups (list, optional): Initial energy of every group, to label the nodes with `group_labels`. Defaults to None.
+            depth (int, optional): Compute the shells up to this depth right away. Defaults to None.
+        """
+        nodes = list(G.nodes)
+        index = {node: idx for idx, node in enumerate(nodes)}
+        edges = np.array(
+            [[index[u], index[v]] for u, v in G.edges], dtype=np.int64
+        ).reshape(-1, 2)
+        e0 = k0 = groups = None
+        if all("e" in G.nodes[n] for n in nodes):
+            e0 = [G.nodes[n]["e"] for n in nodes]
+            if e_groups is not None:
+                groups = group_labels(e0, e_groups)
+        if all("k" in G.nodes[n] for n in nodes):
+            k0 = [G.nodes[n]["k"] for n in nodes]
+        topology = cls(edges[:, 0], edges[:, 1], len(nodes), nodes, e0, k0, groups)
+        if depth:
+            topology.shells(depth)
+        return topology
+
+    @property
+    def A_out(self):
+        """Out-adjacency, row i holding the successors of i. Built on first use."""
+        if self._A_out is None:
+            self._A_out = self.A_in.T.tocsr()
+        return self._A_out
+
+    def shells(self, depth=4):
+        """Degree of separation shells 1..depth, see `dos_shells`."""
+        if len(self._shells) < depth:
+            self._shells = dos_shells(self.A_out, depth)
+        return self._shells[:depth]
+
+    @property
+    def depth(self):
+        return len(self._shells)
+
+    def cache_key(self):
+        """Content hash of the topology, used by `cached_metric`."""
+        if self._cache_key is None:
+            h = hashlib.sha1()
+            h.update(json.dumps(self.nodes, default=str).encode())
+            h.update(self.src.tobytes())
+            h.update(self.dst.tobytes())
+            self._cache_key = h.hexdigest()
+        return self._cache_key
+
+    def save(self, path, source=None):
+        """Write the context to a .npz file.
+
+        Args:
+            path (str): File to write.
+            source (str, optional): Signature of the network the context was built from. Defaults to None.
+        """
+        arrays = {"src": self.src, "dst": self.dst}
+        for name in ("e0", "k0", "groups"):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        for d, S in enumerate(self._shells, start=1):
+            arrays[f"shell{d}_indptr"] = S.indptr
+            arrays[f"shell{d}_indices"] = S.indices
+        header = {
+            "n_nodes": self.n_nodes,
+            "nodes": self.nodes,
+            "depth": self.depth,
+            "source": source,
+        }
+        arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), np.uint8)
+        # Write next to the target and move it in place, so concurrent runs
+        # never load a partially written file
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a context written by `save`.
+
+        Returns:
+            tuple: The context and the source signature it was saved with.
+        """
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            n = header["n_nodes"]
+            shells = [
+                sparse.csr_matrix(
+                    (
+                        np.ones(len(data[f"shell{d}_indices"]), dtype=bool),
+                        data[f"shell{d}_indices"],
+                        data[f"shell{d}_indptr"],
+                    ),
+                    shape=(n, n),
+                )
+                for d in range(1, header["depth"] + 1)
+            ]
+            optional = {
+                name: data[name] if name in data.files else None
+                for name in ("e0", "k0", "groups")
+            }
+            topology = cls(
+                data["src"],
+                data["dst"],
+                n,
+                header["nodes"],
+                shells=shells,
+                **optional,
+            )
+        return topology, header["source"]
+
+    @classmethod
+    def for_t0(cls, gml_path, e_groups=None, depth=4):
+        """Context of a t0 network, loaded from the cache when up to date.
+
+        The context is rebuilt and saved again when the GML file changed
+        since, or when it holds fewer shells or other group energies than
+        asked for.
+
+        Args:
+            gml_path (str): Path of the t0 network.
+            e_groups (list, optional): Initial energy of every group. Defaults to None.
+            depth (int, optional): Depth of the shells to keep. Defaults to 4.
+        """
+        path = topology_path(gml_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stat = os.stat(gml_path)
+        source = json.dumps([stat.st_size, stat.st_mtime_ns, e_groups])
+        if os.path.exists(path):
+            try:
+                topology, saved_source = cls.load(path)
+            except (OSError, ValueError, KeyError):
+                topology, saved_source = None, None
+            if saved_source == source and topology.depth >= depth:
+                return topology
+
+        topology = cls.from_graph(nx.read_gml(gml_path), e_groups, depth)
+        topology.save(path, source)
+        return topology
+
+
+def cache_dir():
+    return os.environ.get("TOPOLOGY_CACHE_DIR", ".topology_cache")
+
+
+def topology_path(gml_path):
+    """Path of the stored `TopologyContext` of a network, keyed by its absolute path."""
+    key = hashlib.sha1(os.path.abspath(gml_path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), f"{key}.topology.npz")
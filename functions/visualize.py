@@ -1,34 +1,77 @@
 import researchhelper.visualize.general_formatting as gf
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+import matplotlib
 import matplotlib.colors as mcolors
+import matplotlib.patches as mpatches
 import matplotlib.cm as cm
+import pandas as pd
 import numpy as np
 import networkx as nx
+from multiprocessing import Pool
+import subprocess
+import hashlib
+import inspect
+import warnings
+import json
+import re
+import os
 
 from functions.misc import bootstrap_resample_data
+from functions.topology import TopologyContext
+from functions.layout import layout_positions, graph_layout
+from functions.plot_data import aggregate_runs, downsample, envelope
 
+TRIANGLE = np.array([[0, 0], [0.5, np.sqrt(3) / 2], [1, 0]])
 
-def plot_timeseries(ax, data, a, data_std=[], cmap="tab10", vmin=-1, vmax=1):
+
+def plot_timeseries(
+    ax,
+    data,
+    a,
+    data_std=[],
+    cmap="tab10",
+    vmin=-1,
+    vmax=1,
+    n_points=1000,
+    method="minmax",
+    log_time=False,
+):
+    """Mean over runs with a band of one std, reduced to `n_points` before drawing.
+
+    The mean line keeps the points picked by `method` ("lttb" or "minmax",
+    see `functions.plot_data`) and the band is the min/max envelope of
+    `n_points` buckets, so the drawing cost does not grow with the number of
+    steps. `n_points=None` draws every step.
+
+    Args:
+        ax (matplotlib.axis): Axis to plot in.
+        data (np.array): (runs, steps) series, shorter runs padded with nan.
+        a (float): Assortativity, sets the colour.
+        data_std (np.array, optional): (runs, steps) std within every run, averaged for the band instead of the std between runs. Defaults to [].
+        n_points (int, optional): Number of points to draw. Defaults to 1000.
+        method (str, optional): Downsampling of the mean line. Defaults to "minmax".
+        log_time (bool, optional): Buckets of equal width in log time, for a log time axis. Defaults to False.
+    """
     if len(data) > 0:
         cmap = plt.get_cmap(cmap)
         norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
-        # ax.plot(data.T, color=cmap(norm(a)), alpha=0.2)
-        data_mean = np.mean(data, axis=0)
-        if data_std == []:
-            data_std = np.std(data, axis=0)
+        color = cmap(norm(a))
+        data_mean, between_std = aggregate_runs(data)
+        if len(data_std) == 0:
+            data_std = between_std
         else:
             data_std = np.mean(data_std, axis=0)
-        ax.plot(data_mean, color=cmap(norm(a)), zorder=11)
-        ax.fill_between(
-            range(len(data_mean)),
-            data_mean - data_std,
-            data_mean + data_std,
-            color=cmap(norm(a)),
-            zorder=10,
-            alpha=0.5,
-        )
+        lower, upper = data_mean - data_std, data_mean + data_std
+
+        n_steps = len(data_mean)
+        n_points = n_steps if n_points is None else n_points
+        line = downsample(data_mean, n_points, method, log_time)
+        steps, lower, upper = envelope(lower, upper, n_points, log_time)
+        ax.plot(line, data_mean[line], color=color, zorder=11)
+        ax.fill_between(steps, lower, upper, color=color, zorder=10, alpha=0.5)
 
 
 def set_labels_and_titles(
@@ -92,39 +135,96 @@ def plot_metric_data(data, energies, cols, name):
     plt.show()
 
 
-def plot_triangle_heatmap(gm, group):
+def _padded(values):
+    # Ragged lists of observations as a (points, max observations) array, padded with nan
+    values = [np.asarray(v, dtype=np.float64).ravel() for v in values]
+    padded = np.full((len(values), max((len(v) for v in values), default=0)), np.nan)
+    for i, v in enumerate(values):
+        padded[i, : len(v)] = v
+    return padded
+
+
+def _triangle_frame(ax):
+    # Outline and corner labels of the simplex
+    x, y, _ = point_on_triangle(np.array([1, 1, 0, 1]), np.array([0, 1, 0, 0]))
+    ax.plot(x, y, color="grey", alpha=1)
+    ax.text(x[0] - 0.02, y[0], "Behavior", ha="right")
+    ax.text(x[1], y[1] + 0.04, "Cognitive", ha="center")
+    ax.text(x[2] + 0.02, y[2], "Contagion")
+    return x, y
+
+
+def plot_triangle_heatmap(gm, group, tripcolor=False, seed=None):
+    """Coleman index of `group` over the simplex, as one scatter or a triangulated surface.
+
+    The bootstrap means of all points with the same number of runs are
+    computed in one call, as the columns of a (runs, points) array, and the
+    points are drawn with
+    a single `scatter` (or `tripcolor` over their Delaunay triangulation),
+    so dense simplex grids of thousands of points draw in about a second.
+    Points without a value are grey: light when group 0 never has a value,
+    dark when group 1 never has one.
+
+    Args:
+        gm: Model results, with `coleman` mapping "s,t,u" to a list with the Coleman index per group of every run.
+        group (int): Group to plot.
+        tripcolor (bool, optional): Fill the simplex by interpolating between the points. Defaults to False.
+        seed (int, optional): Seed of the bootstrap. Defaults to None.
+    """
     colormap = cm.rainbow
     normalize = mcolors.Normalize(vmin=-1, vmax=1)
     fig, ax = plt.subplots(1, 1, figsize=(6, 6.5))
-    for c in gm.coleman:
-        means, mean_of_means, se_of_means = bootstrap_resample_data(
-            [d[group] for d in gm.coleman[c]], gm.conf.n_bootstrap_resample
+
+    keys = list(gm.coleman)
+    stu = np.array([[float(i) for i in c.split(",")] for c in keys]).reshape(-1, 3)
+    x, y = get_xy(*stu.T)
+    # (runs, groups) per point, for any number of groups
+    runs = [np.asarray(gm.coleman[c], dtype=np.float64) for c in keys]
+    n_groups = {r.shape[1] for r in runs if r.ndim == 2 and len(r)}
+    assert len(n_groups) <= 1, f"Desired one number of groups, got {sorted(n_groups)}"
+    n_groups = n_groups.pop() if n_groups else group + 1
+    assert group < n_groups, f"Desired (group < {n_groups})"
+    runs = [r.reshape(len(gm.coleman[c]), n_groups) for r, c in zip(runs, keys)]
+    values = _padded([r[:, group] for r in runs])
+    lengths = np.array([len(r) for r in runs])
+    mean_of_means = np.full(len(keys), np.nan)
+    # One bootstrap over the columns of all points with the same number of runs
+    for n_runs in np.unique(lengths[lengths > 0]):
+        columns = lengths == n_runs
+        _, mean_of_means[columns], _ = bootstrap_resample_data(
+            values[columns, :n_runs].T, gm.conf.n_bootstrap_resample, seed=seed
         )
-        x, y = get_xy(*[float(i) for i in c.split(",")])
-        values0 = np.array([val[0] for val in gm.coleman[c]])
-        values1 = np.array([val[1] for val in gm.coleman[c]])
-        if np.isnan(mean_of_means):
-            if np.isnan(values0).all():
-                color = "lightgrey"
-            elif np.isnan(values1).all():
-                color = "darkgrey"
-        else:
-            color = colormap(normalize(mean_of_means))
-        ax.scatter(x, y, color=color, norm=normalize, s=30)
+    missing = np.isnan(mean_of_means)
+    no_values0 = np.array([np.isnan(r[:, 0]).all() for r in runs], dtype=bool)
+
+    if tripcolor and (~missing).sum() >= 3:
+        ax.tripcolor(
+            x[~missing],
+            y[~missing],
+            mean_of_means[~missing],
+            cmap=colormap,
+            norm=normalize,
+            shading="gouraud",
+        )
+    else:
+        ax.scatter(
+            x[~missing],
+            y[~missing],
+            c=mean_of_means[~missing],
+            cmap=colormap,
+            norm=normalize,
+            s=30,
+        )
+    if missing.any():
+        grey = np.where(no_values0[missing], "lightgrey", "darkgrey")
+        ax.scatter(x[missing], y[missing], color=grey, s=30)
 
     # setup the colorbar
     scalarmappaple = cm.ScalarMappable(norm=normalize, cmap=colormap)
     scalarmappaple.set_array(np.linspace(-1, 1, 100))
-    plt.colorbar(scalarmappaple, orientation="horizontal", pad=0.05)
-
-    locs = [(1, 0), (1, 1), (0, 0), (1, 0)]
-    ps = [point_on_triangle(*l) for l in locs]
-    x, y, c = zip(*ps)
-    ax.plot(x, y, color="grey", alpha=1)
-    ax.text(x[0] - 0.02, y[0], "Behavior", ha="right")
-    ax.text(x[1], y[1] + 0.04, "Cognitive", ha="center")
-    ax.text(x[2] + 0.02, y[2], "Contagion")
+    plt.colorbar(scalarmappaple, ax=ax, orientation="horizontal", pad=0.05)
 
+    _triangle_frame(ax)
     plt.axis("off")
     plt.show()
 
@@ -132,114 +232,252 @@ def plot_triangle_heatmap(gm, group):
 def point_on_triangle(x, y):
     """
     Get point on equilateral unit triangle mapped from x,y coordinates.
+
+    Works on scalars and on arrays of coordinates alike.
     """
-    pt1, pt2, pt3 = (0, 0), (0.5, np.sqrt(3) / 2), (1, 0)
-    q = abs(x - y)
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    q = np.abs(x - y)
     s, t, u = q, 0.5 * (x + y - q), 1 - 0.5 * (q + x + y)
-    return (
-        s * pt1[0] + t * pt2[0] + u * pt3[0],
-        s * pt1[1] + t * pt2[1] + u * pt3[1],
-        [s, t, u],
-    )
+    return (*get_xy(s, t, u), [s, t, u])
 
 
 def get_xy(s, t, u):
-    pt1, pt2, pt3 = (0, 0), (0.5, np.sqrt(3) / 2), (1, 0)
-    return (
-        s * pt1[0] + t * pt2[0] + u * pt3[0],
-        s * pt1[1] + t * pt2[1] + u * pt3[1],
+    """Cartesian coordinates of the barycentric coordinates (s, t, u) on the unit triangle.
+
+    Scalars or arrays of equal shape; the corners s, t and u are (0, 0),
+    (0.5, sqrt(3) / 2) and (1, 0).
+    """
+    stu = np.stack(np.broadcast_arrays(s, t, u), axis=-1).astype(np.float64)
+    xy = stu @ TRIANGLE
+    return xy[..., 0][()], xy[..., 1][()]
+
+
+_movie = None
+
+
+def _init_movie_worker(movie):
+    global _movie
+    _movie = movie
+
+
+def _movie_scene(movie):
+    """Figure of a network movie with the static parts drawn once.
+
+    The edges never change, so they are drawn into a background that every
+    frame restores, after which only the node scatter and time label are
+    redrawn (blitting).
+    """
+    fig = Figure(figsize=(15, 15), dpi=movie["dpi"])
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.axis("off")
+
+    pos = movie["pos"]
+    segments = np.stack([pos[movie["src"]], pos[movie["dst"]]], axis=1)
+    ax.add_collection(
+        LineCollection(segments, alpha=0.4, linewidths=2, color="#727272")
+    )
+    nodes = ax.scatter(*pos.T, s=100, alpha=1, animated=True)
+    text = ax.text(
+        1.1,
+        1,
+        "",
+        ha="right",
+        fontsize=56,
+        color="C1",
+        wrap=True,
+        transform=ax.transAxes,
+        animated=True,
+    )
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    return canvas, nodes, text, background
+
+
+def _render_frames(movie, e, k, labels):
+    # Yield the RGBA buffer of every frame of the (T, N) trajectories
+    canvas, nodes, text, background = _movie_scene(movie)
+    cmap = plt.get_cmap(movie["cmap"])
+    colors, sizes = cmap(e), 100 + k * 300
+    for t in range(len(e)):
+        canvas.restore_region(background)
+        nodes.set_color(colors[t])
+        nodes.set_sizes(sizes[t])
+        text.set_text(labels[t])
+        nodes.axes.draw_artist(nodes)
+        nodes.axes.draw_artist(text)
+        yield canvas.buffer_rgba()
+
+
+def _write_video(frames, save_path, size, fps):
+    # Pipe raw RGBA frames into ffmpeg, padding to even dimensions for h264
+    width, height = size
+    proc = subprocess.Popen(
+        [
+            matplotlib.rcParams["animation.ffmpeg_path"],
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgba",
+            "-s",
+            f"{width}x{height}",
+            "-framerate",
+            str(fps),
+            "-i",
+            "-",
+            "-vf",
+            "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-pix_fmt",
+            "yuv420p",
+            save_path,
+        ],
+        stdin=subprocess.PIPE,
+    )
+    try:
+        for frame in frames:
+            proc.stdin.write(frame)
+    finally:
+        proc.stdin.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed writing {save_path}")
+    return save_path
+
+
+def _render_chunk(task):
+    e, k, labels, save_path = task
+    width, height = (np.array([15, 15]) * _movie["dpi"]).astype(int)
+    return _write_video(
+        _render_frames(_movie, e, k, labels), save_path, (width, height), _movie["fps"]
     )
 
 
-def nx_network_mp4(Gs, labels, save_path, remove_inactive_nodes=False):
+def _concat_videos(paths, save_path):
+    list_path = f"{save_path}.parts.txt"
+    with open(list_path, "w") as f:
+        f.writelines(f"file '{os.path.abspath(path)}'\n" for path in paths)
+    try:
+        subprocess.run(
+            [
+                matplotlib.rcParams["animation.ffmpeg_path"],
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                list_path,
+                "-c",
+                "copy",
+                save_path,
+            ],
+            check=True,
+        )
+    finally:
+        for path in [list_path, *paths]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def nx_network_mp4(
+    Gs,
+    labels,
+    save_path,
+    e=None,
+    k=None,
+    pos=None,
+    interval=350,
+    dpi=100,
+    processes=1,
+    cmap_name="viridis",
+):
     """Create an MP4 from the network dynamics over time.
 
+    The model never changes edges, so the movie is rendered from the
+    topology and the (T, N) trajectories of `e` and `k`: the edges are drawn
+    once into a background and every frame only recolours and resizes the
+    node scatter with array operations (blitting). Frames are piped to
+    ffmpeg as raw RGBA. With `processes` > 1 contiguous chunks of frames are
+    rendered to separate files in parallel and then concatenated.
+
+    Unlike the earlier `FuncAnimation` version the movie is not a matplotlib
+    animation, so the path of the file is returned instead of the animation,
+    and the time label sits at (1.1, 1) in axes instead of data coordinates,
+    keeping it in the top right corner whatever the scale of the layout.
+    The `remove_inactive_nodes` argument, which never had an effect, is gone.
+
     Parameters
     ----------
-    full_graph : nx.Graph
-        Networkx graph with all nodes and edges.
-    Gs : List[nx.Graph
-        List of networkx graphs that change over time.
-    labels : List[str
+    Gs : TopologyContext or List[nx.Graph]
+        Topology of the network, or the legacy list of graph snapshots over
+        time, from which the topology and trajectories are taken.
+    labels : List[str]
         List of labels showing the current time.
-    layout : nx.__layout
-        Networkx layout.
-        (e.g., nx.kamada_kawai_layout, nx.spring_layout)
     save_path : str
         Where do you want to save your mp4?
-    remove_inactive_nodes : bool
-        True to remove inactive nodes.
-        Otherwise full nodelist is always visible. Defaults to False.
+    e : np.array
+        (T, N) energy of every node per frame, in the node order of the
+        topology. Required when `Gs` is a topology.
+    k : np.array
+        (T, N) connectivity of every node per frame, like `e`.
+    pos : np.array
+        (N, 2) node positions. Defaults to the cached neato layout of
+        `layout_positions`.
+    interval : int
+        Time between frames in ms. Defaults to 350.
+    dpi : int
+        Resolution of the 15 by 15 inch frames. Defaults to 100.
+    processes : int
+        Number of processes rendering chunks of frames. Defaults to 1.
+    cmap_name : str
+        Colormap of the energies. Defaults to "viridis".
 
     Returns
     -------
-    None
+    str
+        Path of the written movie.
 
     """
-    assert len(Gs) == len(labels), "Desired (len(Gs) == len(labels))"
-
-    cmap = plt.get_cmap("viridis")
-    pos = nx.nx_agraph.graphviz_layout(Gs[0], prog="neato")
-    fig, ax = plt.subplots(figsize=(15, 15))
-    ax.axis("off")
-
-    # Add Edges
-    segments = np.array([[pos[x], pos[y]] for x, y in Gs[0].edges()])
-    edges = LineCollection(segments, alpha=0.4, linewidths=2, color="#727272")
-    ax.add_artist(edges)
-
-    # Add Nodes
-    sizes = [100 + (Gs[0].nodes[node]["k"] * 300) for node in Gs[0].nodes]
-    colors = [cmap(Gs[0].nodes[node]["e"]) for node in Gs[0].nodes]
-    coordinates = np.array([i for i in pos.values()]).T
-    nodes = ax.scatter(*coordinates, s=sizes, alpha=1, color=colors)
-
-    # Add Time indication
-    text = ax.text(1.1, 1, labels[0], ha="right", fontsize=56, color="C1", wrap=True)
-
-    # Combine elements into list to pass later on
-    actors = [edges, nodes, text]
-
-    def update(i: int, edges, nodes, text, pos):
-        """
-
-        Parameters
-        ----------
-        i: int
-            Index of frames.
-        edges : np.array
-            List of edge locations of previous step.
-        nodes : np.array
-            List of node locations of previous step.
-        text : str
-            Text to be shown in upper right corner at each update.
-        pos : dict
-            Networkx - Matplotlib positional layout dictionary.
-        ax : matplotlib.axis
-            Matplotlib axis to plot in.
-
-
-        Returns
-        -------
-        None
-
-        """
-
-        segments = [[pos[x], pos[y]] for x, y in Gs[i].edges()]
-        edges.set_paths(segments)
-
-        sizes = [100 + (Gs[i].nodes[node]["k"] * 300) for node in Gs[i].nodes]
-        colors = [cmap(Gs[i].nodes[node]["e"]) for node in Gs[i].nodes]
-        nodes.set_color(colors)
-        nodes.set_sizes(sizes)
-        text.set_text(labels[i])
-
-    # Create animation and save it
-    ani = animation.FuncAnimation(
-        fig, update, frames=len(Gs), fargs=(*actors, pos), interval=350, repeat=False
-    )
-    ani.save(save_path)
-    return ani
+    if isinstance(Gs, TopologyContext):
+        topology = Gs
+    else:
+        topology = TopologyContext.from_graph(Gs[0])
+        e = [[H.nodes[node]["e"] for node in topology.nodes] for H in Gs]
+        k = [[H.nodes[node]["k"] for node in topology.nodes] for H in Gs]
+    e = np.atleast_2d(np.asarray(e, dtype=np.float64))
+    k = np.atleast_2d(np.asarray(k, dtype=np.float64))
+    assert len(e) == len(k) == len(labels), "Desired (len(e) == len(k) == len(labels))"
+
+    if pos is None:
+        pos = layout_positions(topology)
+    movie = {
+        "pos": np.asarray(pos, dtype=np.float64),
+        "src": topology.src,
+        "dst": topology.dst,
+        "dpi": dpi,
+        "fps": 1000 / interval,
+        "cmap": cmap_name,
+    }
+
+    n_chunks = max(1, min(processes, len(e)))
+    if n_chunks == 1:
+        _init_movie_worker(movie)
+        return _render_chunk((e, k, list(labels), save_path))
+
+    root, ext = os.path.splitext(save_path)
+    bounds = np.linspace(0, len(e), n_chunks + 1).astype(int)
+    tasks = [
+        (e[a:b], k[a:b], list(labels[a:b]), f"{root}.part{i}{ext}")
+        for i, (a, b) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]
+    with Pool(processes, initializer=_init_movie_worker, initargs=(movie,)) as pool:
+        paths = pool.map(_render_chunk, tasks)
+    _concat_videos(paths, save_path)
+    return save_path
 
 
 def plot_grid(ax, G, with_labels=False, title="", cmap_name="viridis"):
@@ -264,7 +502,7 @@ def plot_grid(ax, G, with_labels=False, title="", cmap_name="viridis"):
     """
     cmap = plt.get_cmap(cmap_name)
     norm = mcolors.Normalize(vmin=0, vmax=1)
-    pos = nx.nx_agraph.graphviz_layout(G, prog="neato")
+    pos = graph_layout(G)
 
     sizes = [50 for node in G.nodes]
     colors = [cmap(norm(G.nodes[node]["e"])) for node in G.nodes]
@@ -283,14 +521,6 @@ def plot_grid(ax, G, with_labels=False, title="", cmap_name="viridis"):
     return
 
 
-def get_xy(s, t, u):
-    pt1, pt2, pt3 = (0, 0), (0.5, np.sqrt(3) / 2), (1, 0)
-    return (
-        s * pt1[0] + t * pt2[0] + u * pt3[0],
-        s * pt1[1] + t * pt2[1] + u * pt3[1],
-    )
-
-
 def plot_triangle(
     data,
     e_var,
@@ -310,26 +540,20 @@ def plot_triangle(
     def size(x):
         return 15 + (x * 240)
 
-    for p in data:
-        ax.scatter(
-            p[0],
-            p[1],
-            color=cmap(norm(np.nanmean(data[p]))),
-            s=size(np.nanmean(e_var[p])),
-        )
+    points = np.array(list(data), dtype=np.float64).reshape(-1, 2)
+    with warnings.catch_warnings():
+        # Points without any value have a nan mean
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        means = np.nanmean(_padded([data[p] for p in data]), axis=1)
+        e_vars = np.nanmean(_padded([e_var[p] for p in data]), axis=1)
+    ax.scatter(*points.T, c=means, cmap=cmap, norm=norm, s=size(e_vars))
 
     # setup the colorbar
     scalarmappaple = cm.ScalarMappable(norm=norm, cmap=cmap)
     scalarmappaple.set_array(np.linspace(-1, 1, 100))
-    plt.colorbar(scalarmappaple, orientation="horizontal", pad=0.05)
+    plt.colorbar(scalarmappaple, ax=ax, orientation="horizontal", pad=0.05)
 
-    locs = [(1, 0), (1, 1), (0, 0), (1, 0)]
-    ps = [point_on_triangle(*l) for l in locs]
-    x, y, c = zip(*ps)
-    ax.plot(x, y, color="grey", alpha=1)
-    ax.text(x[0] - 0.02, y[0], "Behavior", ha="right")
-    ax.text(x[1], y[1] + 0.04, "Cognitive", ha="center")
-    ax.text(x[2] + 0.02, y[2], "Contagion")
+    x, y = _triangle_frame(ax)
     ax.text(
         -0.15,
         y[1],
@@ -344,3 +568,358 @@ def plot_triangle(
         plt.savefig(save_path)
     else:
         plt.show()
+
+
+# The `final_results` figure set, rendered from the summary cube by
+# `3_render_figures.py`. Every figure is a spec in FIGURES: a function that
+# draws into a given Figure, its size and resolution, and the parameters it
+# is called with. Renderers only use the object oriented matplotlib API, so
+# they work headless and without pyplot state shared between figures.
+
+FIGURES = {}
+PURE_POINTS = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+POINT_NAMES = {
+    "[1.0, 0.0, 0.0]": "Pure Cognitive",
+    "[0.0, 1.0, 0.0]": "Pure Behavior",
+    "[0.0, 0.0, 1.0]": "Pure Contagion",
+    "[0.5, 0.5, 0.0]": "Mixed Cognitive-Behavior",
+    "[0.5, 0.0, 0.5]": "Mixed Cognitive-Contagion",
+    "[0.0, 0.5, 0.5]": "Mixed Behavior-Contagion",
+    "[0.8, 0.1, 0.1]": "Dominant Cognitive",
+    "[0.1, 0.8, 0.1]": "Dominant Behavior",
+    "[0.1, 0.1, 0.8]": "Dominant Contagion",
+}
+NETWORK_SIZE = re.compile(r"-(?P<n>\d+)n-")
+
+
+def figure_spec(name, figsize=(7, 5), dpi=300, **params):
+    """Register the decorated renderer as figure `name` of the figure set.
+
+    The renderer is called as `render(fig, cube, setting, **params)`, with
+    `setting` the config, noise, beta and sim_dur selection of the main runs.
+    One renderer can be registered under several names with other params.
+    """
+
+    def register(render):
+        FIGURES[name] = {
+            "render": render,
+            "figsize": figsize,
+            "dpi": dpi,
+            "params": params,
+        }
+        return render
+
+    return register
+
+
+def spec_hash(name):
+    """Hash of everything that determines figure `name` apart from its data."""
+    spec = FIGURES[name]
+    content = {
+        "name": name,
+        "figsize": spec["figsize"],
+        "dpi": spec["dpi"],
+        "params": spec["params"],
+        "render": inspect.getsource(spec["render"]),
+    }
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def render_figure(name, cube, setting, save_path):
+    """Render figure `name` of the figure set to `save_path`.
+
+    Args:
+        name (str): Name of the figure in FIGURES.
+        cube (SummaryCube): Statistics to plot.
+        setting (dict): Config, noise, beta and sim_dur of the main runs.
+        save_path (str): Image to write.
+    """
+    spec = FIGURES[name]
+    fig = Figure(figsize=spec["figsize"], layout="constrained")
+    FigureCanvasAgg(fig)
+    spec["render"](fig, cube, setting, **spec["params"])
+    # Only replace the previous image once the new one is complete
+    root, ext = os.path.splitext(save_path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    fig.savefig(tmp_path, dpi=spec["dpi"], bbox_inches="tight")
+    os.replace(tmp_path, save_path)
+    return save_path
+
+
+def _point_name(point):
+    point = str([float(p) for p in json.loads(str(point))])
+    return POINT_NAMES.get(point, point)
+
+
+def _load_runs(cube, config):
+    # Per run values of a config, for figures of distributions over runs
+    runs = pd.read_csv(os.path.join(cube.provenance["sources"][config]["path"], "runs.csv"))
+    runs["point"] = [str([float(p) for p in json.loads(p)]) for p in runs["point"]]
+    return runs
+
+
+def _select_runs(runs, **selection):
+    mask = np.ones(len(runs), dtype=bool)
+    for column, value in selection.items():
+        if value is None:
+            mask &= runs[column].isna().to_numpy()
+        elif isinstance(value, str):
+            mask &= (runs[column] == value).to_numpy()
+        else:
+            mask &= np.isclose(runs[column].to_numpy(dtype=np.float64), value)
+    if not mask.any():
+        raise ValueError(f"No runs for {selection}")
+    return runs[mask]
+
+
+def _has_runs(cube, selection):
+    return np.nansum(cube.sel("metrics", **selection, statistic="n")[0]) > 0
+
+
+def _sel(cube, variable, **selection):
+    # cube.sel that fails on a selection without runs instead of returning
+    # nothing but nan, so no empty figure is written
+    values, dims = cube.sel(variable, **selection)
+    if np.all(np.isnan(values)):
+        raise ValueError(f"No runs of {variable} for {selection}")
+    return values, dims
+
+
+@figure_spec("dos_heatmap", figsize=(10, 5))
+def _dos_heatmap(fig, cube, setting, points=PURE_POINTS):
+    # Mean correlation per distance (rows, grouped per point) and a (columns)
+    blocks = []
+    for point in points:
+        mean, _ = _sel(cube, "dos", **setting, point=point, statistic="mean")
+        blocks += [mean.T, np.full((1, mean.shape[0]), np.nan)]
+    values = np.concatenate(blocks[:-1])
+    distances = cube.coords["distance"]
+
+    ax = fig.subplots()
+    image = ax.imshow(
+        values, cmap="RdBu_r", norm=mcolors.CenteredNorm(vcenter=0), aspect="auto"
+    )
+    for (row, col), value in np.ndenumerate(values):
+        if not np.isnan(value):
+            ax.text(col, row, f"{value:.2f}", ha="center", va="center", fontsize=8)
+    fig.colorbar(image, ax=ax, label="Pearson Correlation")
+
+    block = len(distances) + 1
+    ax.set_yticks(
+        [i * block + j for i in range(len(points)) for j in range(len(distances))],
+        [str(d) for _ in points for d in distances],
+    )
+    ax.set_xticks(range(len(cube.coords["a"])), cube.coords["a"])
+    for i, point in enumerate(points):
+        ax.text(-0.5, i * block - 0.6, _point_name(point), fontsize=14)
+    ax.set_ylabel("Distance", fontsize=12)
+    ax.set_xlabel(r"Modularity ($Q$)", fontsize=12)
+    ax.tick_params(length=0)
+
+
+@figure_spec("kde_plot", figsize=(8, 4.2))
+def _kde_plot(fig, cube, setting, points=PURE_POINTS, a_s=(-0.8, -0.4, 0.0, 0.4, 0.8)):
+    # Density of the per run correlations per distance, the densities of all
+    # distances together integrating to one
+    from scipy.stats import gaussian_kde
+
+    runs = _select_runs(
+        _load_runs(cube, setting["config"]),
+        **{k: v for k, v in setting.items() if k != "config"},
+    )
+    colors = plt.get_cmap("tab10")
+    x = np.linspace(-0.82, 0.82, 200)
+    drawn = 0
+    ax = fig.subplots(len(a_s), len(points), sharex=True, sharey=True, squeeze=False)
+    for col, point in enumerate(points):
+        for row, a in enumerate(a_s):
+            cell = _select_runs(runs, a=a, point=str(point))
+            total = cell["metric"].str.startswith("dos_").sum()
+            for d in cube.coords["distance"]:
+                values = cell.loc[cell["metric"] == f"dos_{d}", "value"].dropna()
+                # A single distinct value has no density, e.g. one run
+                if values.nunique() < 2:
+                    continue
+                density = gaussian_kde(values)(x) * len(values) / total
+                ax[row, col].fill_between(
+                    x, density, color=colors(d - 1), alpha=0.8, linewidth=0, zorder=1000
+                )
+                drawn += 1
+            ax[row, col].axvline(0, color="black", linestyle="-.", alpha=0.4, zorder=-100)
+            ax[row, col].set_xlim((-0.82, 0.82))
+            ax[row, col].set_ylim((0, 20))
+            ax[row, col].set_yticks([0, 20])
+            gf.set_frame(ax[row, col], major_alpha=0)
+        ax[0, col].set_title(_point_name(point))
+    if not drawn:
+        raise ValueError(f"Not enough runs for a density of any distance for {setting}")
+    for row, a in enumerate(a_s):
+        ax[row, 0].set_ylabel(f"$Q={a}$", fontsize=10)
+    fig.supylabel("Density", fontsize=12)
+
+    patches = [
+        mpatches.Patch(color=colors(d - 1), label=f"{d}") for d in cube.coords["distance"]
+    ]
+    fig.legend(
+        handles=patches,
+        prop={"size": 10},
+        loc="outside right center",
+        title="Distance",
+        title_fontsize=12,
+    )
+
+
+@figure_spec("doi_over_pathways")
+def _doi_over_pathways(fig, cube, setting, a=0.8, points=PURE_POINTS):
+    # Mean correlation per distance at modularity `a`, relative to distance 1
+    ax = fig.subplots()
+    distances = np.array(cube.coords["distance"])
+    width = 0.8 / len(points)
+    for i, point in enumerate(points):
+        mean, _ = _sel(cube, "dos", **setting, a=a, point=point, statistic="mean")
+        ax.bar(
+            np.arange(len(distances)) + i * width,
+            np.round(mean / mean[0], 2),
+            width,
+            label=_point_name(point),
+            zorder=100,
+        )
+    ax.set_xticks(np.arange(len(distances)) + width * (len(points) - 1) / 2, distances)
+    ax.set_ylim(-1.1, 1.3)
+    gf.set_legend(ax, "upper right", size=16)
+    gf.set_frame(ax, major_alpha=0.3, x_major_td=0)
+    set_labels_and_titles(
+        ax,
+        "",
+        r"Distance",
+        "Normalized Pearson Correlation",
+        tick_size=16,
+        label_size=16,
+        title_size=18,
+    )
+
+
+def _max_doi_frame(cube, selection):
+    return cube.to_frame("metrics", **selection, metric="max_doi").sort_values("a")
+
+
+def _max_doi_curve(ax, frame, label, **kwargs):
+    ax.plot(frame["a"], frame["mean"], label=label, **kwargs)
+    ax.fill_between(
+        frame["a"],
+        frame["mean"] - frame["std"].fillna(0),
+        frame["mean"] + frame["std"].fillna(0),
+        alpha=0.3,
+    )
+
+
+def _max_doi_axis(ax, title=""):
+    gf.set_frame(ax=ax)
+    set_labels_and_titles(
+        ax=ax,
+        title=title,
+        xlabel=r"Modularity ($Q$)",
+        ylabel=r"Max Degree of Influence",
+        tick_size=16,
+        label_size=16,
+        title_size=18,
+    )
+    ax.set_ylim(0, 3.3)
+    gf.set_legend(ax, "upper left", size=16)
+
+
+@figure_spec("dos_degree_100_pc", sim_dur=100)
+@figure_spec("dos_degree_1000_pc", sim_dur=1000)
+@figure_spec("dos_degree_10000_pc", sim_dur=10000)
+def _dos_degree(fig, cube, setting, sim_dur, points=PURE_POINTS):
+    # Max degree of influence over modularity per point, after `sim_dur` steps
+    ax = fig.subplots()
+    for point in points:
+        frame = _max_doi_frame(cube, {**setting, "sim_dur": sim_dur, "point": point})
+        if frame.empty:
+            raise ValueError(f"No runs of max_doi for {setting}, {sim_dur=}, {point=}")
+        _max_doi_curve(ax, frame, _point_name(point), linewidth=2.5)
+    _max_doi_axis(ax)
+
+
+@figure_spec("dos_degree_Pure_Cognitive_over_time_pc", point=[1.0, 0.0, 0.0])
+@figure_spec("dos_degree_Pure_Behavior_over_time_pc", point=[0.0, 1.0, 0.0])
+@figure_spec("dos_degree_Pure_Contagion_over_time_pc", point=[0.0, 0.0, 1.0])
+def _dos_degree_over_time(fig, cube, setting, point):
+    # Max degree of influence over modularity of one point, per sim_dur
+    ax = fig.subplots()
+    drawn = 0
+    for sim_dur in cube.coords["sim_dur"]:
+        frame = _max_doi_frame(cube, {**setting, "sim_dur": sim_dur, "point": point})
+        # Not every sim_dur was run for every point
+        if not frame.empty:
+            _max_doi_curve(ax, frame, rf"$t_{{{sim_dur}}}$")
+            drawn += 1
+    if not drawn:
+        raise ValueError(f"No runs of max_doi for {setting} at any sim_dur, {point=}")
+    _max_doi_axis(ax, _point_name(point))
+
+
+def _comparison_bars(fig, cube, setting, hues, title, a_s, points):
+    # Mean and std of the correlation per distance, one bar per hue, in a
+    # grid of a (rows) by point (columns)
+    if not hues:
+        raise ValueError(f"No runs to compare for {setting}")
+    ax = fig.subplots(len(a_s), len(points), sharex=True, sharey=True, squeeze=False)
+    distances = np.array(cube.coords["distance"])
+    width = 0.8 / len(hues)
+    colors = plt.get_cmap("tab10")
+    for row, a in enumerate(a_s):
+        for col, point in enumerate(points):
+            for i, (label, selection) in enumerate(hues):
+                cell = {**setting, **selection, "a": a, "point": point}
+                mean, _ = _sel(cube, "dos", **cell, statistic="mean")
+                std, _ = cube.sel("dos", **cell, statistic="std")
+                ax[row, col].bar(
+                    np.arange(len(distances)) + i * width,
+                    mean,
+                    width,
+                    yerr=np.nan_to_num(std),
+                    color=colors(i),
+                    alpha=0.6,
+                    label=label,
+                )
+            gf.set_frame(ax[row, col], major_alpha=0.2)
+            ax[row, col].set_xticks(
+                np.arange(len(distances)) + width * (len(hues) - 1) / 2, distances
+            )
+        ax[row, -1].yaxis.set_label_position("right")
+        ax[row, -1].set_ylabel(f"$Q={a}$", rotation=-90, labelpad=15)
+    for col, point in enumerate(points):
+        ax[0, col].set_title(_point_name(point))
+    fig.supxlabel(r"Distance ($d_\#$)")
+    fig.supylabel("Correlation of\nalignment")
+    handles, labels = ax[0, 0].get_legend_handles_labels()
+    fig.legend(handles, labels, title=title, loc="outside right upper", prop={"size": 10})
+
+
+@figure_spec("noise_comparison", figsize=(8.4, 12))
+def _noise_comparison(fig, cube, setting, a_s=(0.4, 0.6, 0.8), points=PURE_POINTS):
+    # The noise levels run for the main config
+    hues = [
+        ("none" if noise is None else str(noise), {"noise": noise})
+        for noise in cube.coords["noise"]
+        if _has_runs(cube, {**setting, "noise": noise})
+    ]
+    _comparison_bars(fig, cube, setting, hues, "Noise", a_s, points)
+
+
+@figure_spec("size_comparison", figsize=(8.4, 12))
+def _size_comparison(fig, cube, setting, a_s=(0.4, 0.6, 0.8), points=PURE_POINTS):
+    # The configs that only differ from the main config in their size
+    family = NETWORK_SIZE.sub("-", setting["config"])
+    configs = [
+        c
+        for c in cube.coords["config"]
+        if NETWORK_SIZE.sub("-", c) == family and _has_runs(cube, {**setting, "config": c})
+    ]
+    configs.sort(key=lambda c: int(NETWORK_SIZE.search(c)["n"]))
+    hues = [(NETWORK_SIZE.search(c)["n"], {"config": c}) for c in configs]
+    _comparison_bars(fig, cube, setting, hues, "Network size", a_s, points)
@@ -1,6 +1,8 @@
 from functions.network_generation import erdos, barabasi_albert, write_graph
-from functions.metrics import calc_pearson
-from functions.model import mainModel
+from functions.graph_store import EndStateStore
+from functions.topology import TopologyContext
+from functions.model import arrayModel
+from functions.simulation import simulate, dyn_data
 
 from multiprocessing.pool import ThreadPool as Pool
 import networkx as nx
@@ -61,6 +63,11 @@ def run_sims(a):
         "network_gen_fn": barabasi_albert,
         "a": a,
         "beta": 1 / 2,
+        # "gml" writes a full graph copy per run, which the notebook reads;
+        # "states" only keeps the final k/e vectors in an EndStateStore
+        "tt_format": "gml",
+        # Degree of separation shells kept with the t0 topology, 0 for none
+        "dos_depth": 4,
     }
     conf["window"] = int(conf["sim_dur"] * 0.1)
     if conf["network_gen_fn"] == erdos:
@@ -73,9 +80,12 @@ def run_sims(a):
     sim_info = f"Simulation N:{conf['n_per_group']}, noise: {conf['noise_std']}, sim_dur:{conf['sim_dur']} Running points: {conf['points']} for {conf['a']=}"
     logging.info(sim_info)
 
-    files = os.listdir(t0_path)
+    files = [f for f in os.listdir(t0_path) if f.endswith(".gml")]
     for file in files:
-        G = nx.read_gml(os.path.join(t0_path, file))
+        # Shared by all points, and cached in .topology_cache for the analysis
+        topology = TopologyContext.for_t0(
+            os.path.join(t0_path, file), conf["e_samples"], depth=conf["dos_depth"]
+        )
 
         for point in conf['points']:
             model_path = f"p{'-'.join(str(np.round(p,2)) for p in point)}"
@@ -106,58 +116,30 @@ def run_sims(a):
                 "noise_std": conf["noise_std"],
                 "beta": conf["beta"],
                 "point": point,
-                "G": G.copy(),
-            }
-            model = mainModel(**model_parameters)
-
-            # Initialize the datastructures
-            es = np.zeros((len(model.G.nodes), conf["sim_dur"]))
-            # ks = np.zeros((len(model.G.nodes), sim_dur))
-            pearsons = [calc_pearson(model.G)]
-
-            # Run the model
-            for t in range(conf["sim_dur"]):
-                model.next()
-
-                # Save the data
-                for n_idx, node in enumerate(model.G.nodes):
-                    es[n_idx, t] = model.G.nodes[node]["e"]
-                    # ks[n_idx, t] = model.G.nodes[node]["k"]
-                pearsons.append(calc_pearson(model.G))
-
-                # Check if the system has converged
-                if t > conf["window"] and np.all(
-                    (np.var(es[:, t - conf["window"]: t], axis=1) < 1e-5)
-                ):
-                    es[:, t:conf["sim_dur"]] = np.tile(
-                        es[:, t], (conf["sim_dur"] - t, 1)).T
-                    break
-
-            non_lonely_mean = np.mean(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][1]], axis=0
-            )
-            non_lonely_std = np.std(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][1]], axis=0
-            )
-
-            lonely_mean = np.mean(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][0]], axis=0
-            )
-            lonely_std = np.std(
-                es[np.round(es[:, 0], 1) == conf["e_samples"][0]], axis=0
-            )
-            data = {
-                "non_lonely_mean": non_lonely_mean.tolist(),
-                "non_lonely_std": non_lonely_std.tolist(),
-                "lonely_mean": lonely_mean.tolist(),
-                "lonely_std": lonely_std.tolist(),
-                "pearsons": pearsons,
             }
+            model = arrayModel.from_topology(topology, **model_parameters)
+            result = simulate(model, topology.groups, conf["sim_dur"], conf["window"])
+            data = {**dyn_data(result), "noise_std": conf["noise_std"]}
 
             logging.info(
                 f"Writing data for assort {a}, file {file}, and for point {point}"
             )
-            write_graph(model.G, graph_path, predefined_name=file)
+            if conf["tt_format"] == "gml":
+                G_tt = nx.read_gml(os.path.join(t0_path, file))
+                nx.set_node_attributes(
+                    G_tt,
+                    {
+                        node: {"k": k, "e": e}
+                        for node, k, e in zip(
+                            G_tt.nodes, model.k.tolist(), model.e.tolist()
+                        )
+                    },
+                )
+                write_graph(G_tt, graph_path, predefined_name=file)
+            else:
+                EndStateStore(graph_path).write(
+                    file, os.path.join(t0_path, file), model.k, model.e
+                )
             write_dyn_data(data, dyn_data_path)
     return f"Pool finished for {a}"
 